@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+'''
+Benchmarks markdown_gps's code-block scanner against the character-at-a-time
+Charstream scanner it replaced, on a large synthetic trip log built by
+repeating the real ones:
+
+    python benchmarks/bench_codeblocks.py --size-mb 50
+'''
+import argparse
+import glob
+import time
+import sys
+import io
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import markdown_gps
+
+
+class Charstream:
+    '''The original character stream, kept here as the benchmark baseline.'''
+    def __init__(self, s: str):
+        self.string = s
+        self.idx = 0
+
+    def getchar(self):
+        i = self.idx
+        self.idx += 1
+        return self.string[i]
+
+    def peak(self, n=1):
+        i = self.idx
+        return self.string[i:i + n]
+
+    def skip(self, n=1):
+        self.idx += n
+        return
+
+
+def charstream_find_codeblocks(charstream):
+    '''The original state-machine scanner, kept here as the benchmark baseline.'''
+    OTHER = 'OTHER'
+    NEWLINE = 'NEWLINE'
+    GRAVE_1 = 'GRAVE_1'
+    GRAVE_2 = 'GRAVE_2'
+    INSIDE_CODEBLOCK = 'INSIDE_CODEBLOCK'
+
+    codeblocks = list()
+
+    state = NEWLINE
+    try:
+        while True:
+            if state == NEWLINE:
+                c = charstream.getchar()
+                if c == '`':
+                    state = GRAVE_1
+                    continue
+            elif state == GRAVE_1:
+                c = charstream.getchar()
+                if c == '`':
+                    state = GRAVE_2
+                elif c == '\n':
+                    state = NEWLINE
+                else:
+                    state = OTHER
+                continue
+            elif state == GRAVE_2:
+                c = charstream.getchar()
+                if c == '`':
+                    state = INSIDE_CODEBLOCK
+                elif c == '\n':
+                    state = NEWLINE
+                else:
+                    state = OTHER
+                continue
+            elif state == INSIDE_CODEBLOCK:
+                newblock = ''
+                while True:
+                    if charstream.peak(3) == '```':
+                        charstream.skip(3)
+                        codeblocks.append(newblock)
+                        state = OTHER
+                        break
+                    c = charstream.getchar()
+                    newblock += c
+            elif state == OTHER:
+                c = charstream.getchar()
+                if c == '\n':
+                    state = NEWLINE
+                    continue
+    except IndexError as e:
+        # not an error, means we hit EOF
+        return codeblocks
+
+
+def make_document(size_mb):
+    '''Concatenates the repo's trip logs until the document is `size_mb` MB.'''
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    logs = ''
+    for fn in sorted(glob.glob(os.path.join(root, '*_batey_bike_trip', '*.md'))):
+        with open(fn) as f:
+            logs += f.read() + '\n'
+    repeats = max(1, int(size_mb * 1024 * 1024) // len(logs))
+    return logs * repeats
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=float, default=50)
+    parser.add_argument(
+        '--skip-baseline',
+        action='store_true',
+        help="Don't time the Charstream scanner, which is slow on large documents"
+    )
+    args = parser.parse_args()
+
+    doc = make_document(args.size_mb)
+    print(f"Document: {len(doc) / (1024 * 1024):.1f} MB")
+
+    new_t, new_blocks = timed(markdown_gps.parse_md_find_codeblocks, doc)
+    print(f"find_fenced_blocks:   {new_t:8.3f}s  {len(new_blocks)} blocks")
+    stream_t, stream_blocks = timed(
+        lambda: [b for _, b in markdown_gps.stream_fenced_blocks(io.StringIO(doc))]
+    )
+    print(f"stream_fenced_blocks: {stream_t:8.3f}s  {len(stream_blocks)} blocks")
+    if args.skip_baseline:
+        return
+
+    old_t, old_blocks = timed(charstream_find_codeblocks, Charstream(doc))
+    print(f"Charstream:           {old_t:8.3f}s  {len(old_blocks)} blocks")
+    # The old scanner included the newline after the opening fence in each block
+    assert [b.lstrip('\n') for b in old_blocks] == new_blocks == stream_blocks
+    print(f"Speedup: {old_t / new_t:.0f}x (find), {old_t / stream_t:.0f}x (stream)")
+
+
+if __name__ == '__main__':
+    main()
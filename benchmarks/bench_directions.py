@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+'''
+Times fetching directions for many legs one request at a time versus through
+RouteFetcher's thread pool, against the local stand-in directions server:
+
+    python benchmarks/bench_directions.py --legs 200 --latency 0.2
+'''
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import googlemaps
+
+from directions import RouteFetcher
+from create_maps import GMAPS_APIKEY
+from directions_server import start_server, server_url
+
+
+def make_legs(n, seed=0):
+    rnd = random.Random(seed)
+    lat, lng = 48.7, -119.4
+    stops = list()
+    for _ in range(n + 1):
+        lat += rnd.uniform(-0.02, 0.02)
+        lng += rnd.uniform(-0.02, 0.02)
+        stops.append((round(lat, 6), round(lng, 6)))
+    return list(zip(stops, stops[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--legs', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rps', type=float, default=0)
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency)
+    client = googlemaps.Client(
+        key=GMAPS_APIKEY, base_url=server_url(server), queries_per_second=1000
+    )
+    legs = make_legs(args.legs)
+
+    results = dict()
+    for name, workers in [('serial', 1), ('concurrent', args.workers)]:
+        fetcher = RouteFetcher(client, None, workers=workers, rate=args.rps)
+        start = time.perf_counter()
+        results[name] = fetcher.fetch_legs(legs)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {elapsed:7.2f}s  {len(legs) / elapsed:7.1f} legs/s")
+    assert results['serial'] == results['concurrent']
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
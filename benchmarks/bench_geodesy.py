@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+'''
+Times geodesy.py's array functions against the scalar versions
+create_maps.py used to have, on a long synthetic track:
+
+    python benchmarks/bench_geodesy.py --points 1000000
+'''
+import argparse
+import random
+import math
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import geodesy
+
+
+# The original scalar create_maps.py functions, kept here as the benchmark
+# baseline and as the reference tests/test_geodesy.py checks geodesy.py against.
+# distance_on_unit_sphere is taken from here:
+#     http://www.johndcook.com/blog/python_longitude_latitude/
+def distance_on_unit_sphere(lat1, long1, lat2, long2):
+    """Calculates the distance between two lat/long points. Returns distance in
+    meters."""
+    lat1, long1 = float(lat1), float(long1)
+    lat2, long2 = float(lat2), float(long2)
+    # Convert latitude and longitude to
+    # spherical coordinates in radians.
+    degrees_to_radians = math.pi / 180.0
+
+    # phi = 90 - latitude
+    phi1 = (90.0 - lat1) * degrees_to_radians
+    phi2 = (90.0 - lat2) * degrees_to_radians
+
+    # theta = longitude
+    theta1 = long1 * degrees_to_radians
+    theta2 = long2 * degrees_to_radians
+
+    # Compute spherical distance from spherical coordinates.
+    # For two locations in spherical coordinates
+    # (1, theta, phi) and (1, theta, phi)
+    # cosine( arc length ) =
+    #    sin phi sin phi' cos(theta-theta') + cos phi cos phi'
+    # distance = rho * arc length
+    cos = (
+        math.sin(phi1) * math.sin(phi2) * math.cos(theta1 - theta2) +
+        math.cos(phi1) * math.cos(phi2)
+    )
+    cos = min(1, max(cos, -1))
+    try:
+        arc = math.acos(cos)
+    except Exception as e:
+        raise e
+    return arc * 6378100
+
+
+def lon_to_x(lng, zoom):
+    """
+    transform longitude to tile number
+    :type lng: float
+    :type zoom: int
+    :rtype: float
+    """
+    if not (-180 <= lng <= 180):
+        lng = (lng + 180) % 360 - 180
+
+    return ((lng + 180.) / 360) * pow(2, zoom)
+
+
+def lat_to_y(lat, zoom):
+    """
+    transform latitude to tile number
+    :type lat: float
+    :type zoom: int
+    :rtype: float
+    """
+    if not (-90 <= lat <= 90):
+        lat = (lat + 90) % 180 - 90
+
+    return (
+        1 - math.log(math.tan(lat * math.pi / 180) + 1 / math.cos(lat * math.pi / 180)) / math.pi
+    ) / 2 * pow(2, zoom)
+
+
+def x_to_px(self, x):
+    """
+    transform tile number to pixel on image canvas
+    :type x: float
+    :rtype: float
+    """
+    px = (x - self.x_center) * self.tile_size + self.width / 2
+    return int(round(px))
+
+
+def y_to_px(self, y):
+    """
+    transform tile number to pixel on image canvas
+    :type y: float
+    :rtype: float
+    """
+    px = (y - self.y_center) * self.tile_size + self.height / 2
+    return int(round(px))
+
+
+def make_track(n, seed=0):
+    rnd = random.Random(seed)
+    lat, lng = 48.7, -119.4
+    lats, lngs = list(), list()
+    for _ in range(n):
+        lat += rnd.uniform(-0.01, 0.01)
+        lng += rnd.uniform(-0.01, 0.01)
+        lats.append(lat)
+        lngs.append(lng)
+    return lats, lngs
+
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1000000)
+    args = parser.parse_args()
+
+    lats, lngs = make_track(args.points)
+    if geodesy.np is not None:
+        lats, lngs = geodesy.np.array(lats), geodesy.np.array(lngs)
+    else:
+        print('NumPy not installed; timing the pure Python fallback')
+
+    scalar_t = timed(lambda: [
+        distance_on_unit_sphere(lats[i], lngs[i], lats[i + 1], lngs[i + 1])
+        for i in range(len(lats) - 1)
+    ])
+    array_t = timed(lambda: geodesy.consecutive_distances(lats, lngs))
+    print(f"distances:  scalar {scalar_t:7.3f}s  array {array_t:7.3f}s  ({scalar_t / array_t:.0f}x)")
+
+    scalar_t = timed(lambda: [(lon_to_x(lng, 12), lat_to_y(lat, 12))
+                              for lat, lng in zip(lats, lngs)])
+    array_t = timed(lambda: (geodesy.lon_to_x(lngs, 12), geodesy.lat_to_y(lats, 12)))
+    print(f"projection: scalar {scalar_t:7.3f}s  array {array_t:7.3f}s  ({scalar_t / array_t:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
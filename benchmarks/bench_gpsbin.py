@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+'''
+Times loading a large GPS dataset into create_maps.py as JSON lines versus
+as a memory-mapped gpsbin file, and checks both give the same track:
+
+    python benchmarks/bench_gpsbin.py --rows 1000000
+'''
+import tempfile
+import argparse
+import random
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import create_maps
+import gpsbin
+
+
+def make_rows(n, seed=0):
+    rnd = random.Random(seed)
+    lat, lng, moment = 48.7, -119.4, 1467900000
+    for idx in range(n):
+        lat += rnd.uniform(-0.001, 0.001)
+        lng += rnd.uniform(-0.001, 0.001)
+        moment += rnd.randint(1, 30)
+        yield {
+            'dilution_of_precision': '23000/1000',
+            'error': '',
+            'filename': f"images/{idx:08d}.jpg",
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6),
+            'timestamp_utc': moment,
+        }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_path = os.path.join(tmpdir, 'gps.json')
+        bin_path = os.path.join(tmpdir, 'gps.gpsbin')
+        with open(json_path, 'w') as f:
+            for row in make_rows(args.rows):
+                f.write(json.dumps(row, sort_keys=True) + '\n')
+        with open(json_path) as f, open(bin_path, 'wb') as out:
+            gpsbin.write_rows((json.loads(line) for line in f), out)
+
+        from_json, json_t = timed(lambda: create_maps.read_track(json_path))
+        from_bin, bin_t = timed(lambda: create_maps.read_track(bin_path))
+        assert list(from_json.lat) == list(from_bin.lat)
+        assert list(from_json.moment) == list(from_bin.moment)
+
+        print(f"JSON lines: {os.path.getsize(json_path) / 1e6:7.1f} MB, loaded in {json_t:.3f}s")
+        print(f"gpsbin:     {os.path.getsize(bin_path) / 1e6:7.1f} MB, loaded in {bin_t:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+Checks that interpolate.py's epoch-based even timing matches the old
+per-point datetime arithmetic, then times both on a long synthetic track:
+
+    python benchmarks/bench_interpolate.py --legs 20000 --points-per-leg 100
+'''
+import argparse
+import datetime
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import interpolate
+from track import TrackArray
+
+
+def old_clamp_end_before_midnight(start_t, end_t):
+    if start_t.day != end_t.day:
+        end_t = datetime.datetime(
+            year=start_t.year, day=start_t.day, month=start_t.month, hour=23, minute=59, second=59
+        )
+    return start_t, end_t
+
+
+def old_interpolate(track, leg_points):
+    '''The datetime-per-point loop interpolate_timelocations used to run.'''
+    moments = list()
+    for idx in range(len(track) - 1):
+        moments.append(track.moment[idx])
+        if idx in leg_points:
+            flatpoints = leg_points[idx]
+            start_t, end_t = old_clamp_end_before_midnight(
+                datetime.datetime.fromtimestamp(track.moment[idx]),
+                datetime.datetime.fromtimestamp(track.moment[idx + 1]),
+            )
+            per_point_timediff = (end_t - start_t) / (len(flatpoints) + 1)
+            for pidx, point in enumerate(flatpoints):
+                moments.append((start_t + (pidx + 1) * per_point_timediff).timestamp())
+    moments.append(track.moment[-1])
+    return moments
+
+
+def make_legs(n, points_per_leg, seed=0):
+    rnd = random.Random(seed)
+    track = TrackArray()
+    lat, lng, moment = 48.7, -119.4, 1467900000.0
+    leg_points = dict()
+    for idx in range(n + 1):
+        track.append(lat, lng, moment)
+        nlat, nlng = lat + rnd.uniform(-0.05, 0.05), lng + rnd.uniform(-0.05, 0.05)
+        leg_points[idx] = [(lat + (nlat - lat) * k / points_per_leg, lng + (nlng - lng) * k / points_per_leg)
+                           for k in range(1, points_per_leg)]
+        lat, lng, moment = nlat, nlng, moment + rnd.uniform(60, 7200)
+    del leg_points[n]
+    return track, leg_points
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--legs', type=int, default=20000)
+    parser.add_argument('--points-per-leg', type=int, default=100)
+    args = parser.parse_args()
+    track, leg_points = make_legs(args.legs, args.points_per_leg)
+
+    old, old_t = timed(lambda: old_interpolate(track, leg_points))
+    even, even_t = timed(lambda: interpolate.interpolate_legs(track, leg_points, 'even'))
+    _, dist_t = timed(lambda: interpolate.interpolate_legs(track, leg_points, 'distance'))
+    # The old timedeltas were rounded to microseconds
+    assert len(old) == len(even)
+    assert max(abs(a - b) for a, b in zip(old, even.moment)) < 1e-3
+
+    print(f"{len(even)} points")
+    print(f"datetime loop:       {old_t:.3f}s")
+    print(f"epoch even:          {even_t:.3f}s  ({old_t / even_t:.0f}x)")
+    print(f"epoch distance:      {dist_t:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
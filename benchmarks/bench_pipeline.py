@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+'''
+Times each stage of the pipeline on synthetic trips (see synthetic.py) of
+increasing size, and reports the throughput and peak memory of each as
+JSON, so runs on different commits can be compared:
+
+    python benchmarks/bench_pipeline.py --sizes 1000,100000,1000000 --out before.json
+    git checkout my-branch
+    python benchmarks/bench_pipeline.py --sizes 1000,100000,1000000 --compare before.json
+
+Every stage and size runs in a fresh process, so its peak RSS is its own.
+`setup_peak_rss_kb` is the high-water mark after generating the input and
+`peak_rss_kb` the one after running the stage. Stages which write a file
+per item or hold several Python objects per point don't run above their
+entry in LIMITS unless --no-limits is given.
+'''
+import multiprocessing
+import contextlib
+import subprocess
+import platform
+import tempfile
+import argparse
+import resource
+import zoneinfo
+import json
+import time
+import sys
+import gc
+import os
+
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import staticmap
+
+import synthetic
+import polyline
+import exif_gps
+import markdown_gps
+from track import TrackArray
+from directions import RouteFetcher, decode_polyline
+from create_maps import bin_by_day, color_hash, draw_tlocs, calc_mapinfo, render_job
+from create_maps import interpolate_timelocations
+from directions_server import StraightDirectionsClient
+from tile_server import start_server, tile_url
+
+TZ = zoneinfo.ZoneInfo('America/Los_Angeles')
+# Length of every synthetic trip
+DAYS = 7
+
+# Route points the fake directions client returns per leg
+POINTS_PER_LEG = 50
+# Photos are taken at one in this many points
+POINTS_PER_PHOTO = 50
+
+LIMITS = {
+    'exif_gps': 20000,
+    'markdown_codeblocks': 2000000,
+    'interpolate_timelocations': 2000000,
+    'draw_tlocs': 2000000,
+    'render': 1000000,
+}
+
+
+# Each stage sets up its input for `n` points and returns a function running
+# the stage, which returns how many items it processed, and how many bytes
+# of input the stage reads.
+Setup = Tuple[Callable[[], int], int]
+
+
+def setup_exif_gps(n, seed, workdir) -> Setup:
+    track = synthetic.make_track(n, days=DAYS, seed=seed)
+    paths = synthetic.write_jpegs(os.path.join(workdir, 'images'), track)
+    size = sum(os.path.getsize(path) for path in paths)
+    return lambda: sum(1 for row in exif_gps.extract_rows(paths) if not row['error']), size
+
+
+def setup_markdown_codeblocks(n, seed, workdir) -> Setup:
+    text = synthetic.make_markdown(synthetic.make_track(n, days=DAYS, seed=seed), seed=seed)
+
+    def run():
+        blocks = markdown_gps.parse_md_find_codeblocks(text)
+        # Rows, less each block's header
+        return sum(block.count('\n') - 1 for block in blocks)
+
+    return run, len(text.encode('utf-8'))
+
+
+def setup_decode_polyline(n, seed, workdir) -> Setup:
+    encoded = polyline.encode(synthetic.make_track(n, days=DAYS, seed=seed).points())
+    return lambda: len(decode_polyline(encoded)), len(encoded)
+
+
+def setup_interpolate_timelocations(n, seed, workdir) -> Setup:
+    # Enough photos that the routes between them make up about n points,
+    # a kilometer apart so that every leg needs directions
+    photos = max(2, n // POINTS_PER_LEG)
+    track = synthetic.make_track(photos, days=DAYS, km_per_day=photos / DAYS, seed=seed)
+    fetcher = RouteFetcher(StraightDirectionsClient(POINTS_PER_LEG), None, workers=1, rate=None)
+    return lambda: len(interpolate_timelocations(fetcher, track, 'even', TZ)), 0
+
+
+def setup_bin_by_day(n, seed, workdir) -> Setup:
+    track = synthetic.make_track(n, days=DAYS, seed=seed)
+    return lambda: sum(len(day) for day in bin_by_day(track, TZ).values()), 0
+
+
+def setup_draw_tlocs(n, seed, workdir) -> Setup:
+    track = synthetic.make_track(n, days=DAYS, seed=seed)
+    photos = track.take(range(0, len(track), POINTS_PER_PHOTO))
+
+    def run():
+        m = staticmap.StaticMap(1000, 1000)
+        draw_tlocs(m, track, photos, tz=TZ)
+        return len(track)
+
+    return run, 0
+
+
+def setup_render(n, seed, workdir) -> Setup:
+    track = synthetic.make_track(n, days=DAYS, seed=seed)
+    photos = track.take(range(0, len(track), POINTS_PER_PHOTO))
+    day_photos = bin_by_day(photos, TZ)
+    layers = [(dtrack, day_photos.get(day, TrackArray()), color_hash(day))
+              for day, dtrack in bin_by_day(track, TZ).items()]
+    server = start_server()
+    job = {
+        'filename': os.path.join(workdir, 'map.png'),
+        'dimensions': calc_mapinfo(track.lat, track.lng, photos.lat, photos.lng)['dimensions'],
+        'layers': layers,
+        'tolerance': 0.5,
+        'timezone': TZ,
+        'tile_url': tile_url(server),
+        'tile_cache': '',
+        'profile_dir': None,
+    }
+
+    def run():
+        _, stages = render_job(job)
+        RENDER_STAGES.append(stages)
+        return len(track)
+
+    return run, 0
+
+
+# The per-stage measurements render_job returns, for the last run
+RENDER_STAGES: List[Dict[str, Dict[str, Any]]] = list()
+
+STAGES: Dict[str, Callable[..., Setup]] = {
+    'exif_gps': setup_exif_gps,
+    'markdown_codeblocks': setup_markdown_codeblocks,
+    'decode_polyline': setup_decode_polyline,
+    'interpolate_timelocations': setup_interpolate_timelocations,
+    'bin_by_day': setup_bin_by_day,
+    'draw_tlocs': setup_draw_tlocs,
+    'render': setup_render,
+}
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(stage, n, seed, repeat, conn):
+    '''Runs in a child process: sets up `stage` for `n` points, runs it
+    `repeat` times and sends back the fastest run's measurements.'''
+    try:
+        # Keeps progress messages, such as RouteFetcher's, out of the report
+        with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            run, size = STAGES[stage](n, seed, workdir)
+            result: Dict[str, Any] = {'setup_peak_rss_kb': peak_rss_kb()}
+            best = None
+            for _ in range(repeat):
+                gc.collect()
+                start = time.perf_counter()
+                start_cpu = time.process_time()
+                items = run()
+                wall, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+                if best is None or wall < best[0]:
+                    best = (wall, cpu, items)
+            wall, cpu, items = best
+            result.update({
+                'items': items,
+                'bytes': size,
+                'wall_s': round(wall, 6),
+                'cpu_s': round(cpu, 6),
+                'items_per_s': round(items / wall, 1) if wall > 0 else None,
+                'peak_rss_kb': peak_rss_kb(),
+            })
+            if size:
+                result['mb_per_s'] = round(size / wall / 1e6, 3) if wall > 0 else None
+            if RENDER_STAGES:
+                result['stages'] = RENDER_STAGES[-1]
+        conn.send(result)
+    except Exception as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_stage(stage, n, seed, repeat) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=measure, args=(stage, n, seed, repeat, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        # Killed, e.g. by the OOM killer
+        result = {'error': f"worker exited with code {proc.exitcode}"}
+    proc.join()
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def print_comparison(old_report, results):
+    old = {(r['stage'], r['points']): r for r in old_report['results']}
+    print(f"Compared with {old_report.get('commit') or 'the old run'}:", file=sys.stderr)
+    for r in results:
+        before = old.get((r['stage'], r['points']))
+        if before is None or not before.get('wall_s') or not r.get('wall_s'):
+            continue
+        print(
+            f"  {r['stage']:<26} {r['points']:>9}  {before['wall_s'] / r['wall_s']:6.2f}x speed  "
+            f"{r['peak_rss_kb'] - before['peak_rss_kb']:+9d} KB peak RSS",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--sizes',
+        default='1000,10000,100000,1000000',
+        help='Comma separated numbers of points to run each stage with (up to 10000000)'
+    )
+    parser.add_argument(
+        '--stages',
+        default=','.join(STAGES),
+        help=f"Comma separated stages to run, out of {', '.join(STAGES)}"
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='Keep the fastest of this many runs')
+    parser.add_argument(
+        '--no-limits', action='store_true', help='Run every stage at every size, ignoring LIMITS'
+    )
+    parser.add_argument(
+        '--out', metavar='PATH', help='Write the JSON report here instead of stdout'
+    )
+    parser.add_argument('--compare', metavar='PATH', help='A previous report to compare against')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stages = args.stages.split(',')
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    results = list()
+    for stage in stages:
+        for n in sizes:
+            if not args.no_limits and n > LIMITS.get(stage, n):
+                continue
+            result = {'stage': stage, 'points': n}
+            result.update(run_stage(stage, n, args.seed, args.repeat))
+            results.append(result)
+            if 'error' in result:
+                print(f"{stage:<26} {n:>9}  failed: {result['error']}", file=sys.stderr)
+                continue
+            print(
+                f"{stage:<26} {n:>9}  {result['wall_s']:9.4f}s  "
+                f"{result['items_per_s']:>13,.0f} items/s  {result['peak_rss_kb'] / 1024:8.1f} MB peak",
+                file=sys.stderr
+            )
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2) + '\n'
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
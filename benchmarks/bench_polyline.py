@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+Benchmarks polyline.py's decoder against the original decode_polyline on
+megabyte-sized polylines (tests/test_polyline.py checks they agree):
+
+    python benchmarks/bench_polyline.py --points 500000
+'''
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from typing import List, Tuple
+
+import directions
+import polyline
+
+Coord = Tuple[float, float]
+
+
+# The original create_maps.decode_polyline, kept here as the benchmark baseline
+# and as the reference tests/test_polyline.py checks directions.decode_polyline against
+def decode_polyline(point_str) -> List[Coord]:
+    '''Decodes a polyline that has been encoded using Google's algorithm
+    http://code.google.com/apis/maps/documentation/polylinealgorithm.html
+    https://gist.github.com/signed0/2031157
+
+    This is a generic method that returns a list of (latitude, longitude)
+    tuples.
+
+    :param point_str: Encoded polyline string.
+    :type point_str: string
+    :returns: List of 2-tuples where each tuple is (latitude, longitude)
+    :rtype: list
+    '''
+    # sone coordinate offset is represented by 4 to 5 binary chunks
+    coord_chunks = [[]]
+    for char in point_str:
+        # convert each character to decimal from ascii
+        value = ord(char) - 63
+        # values that have a chunk following have an extra 1 on the left
+        split_after = not (value & 0x20)
+        value &= 0x1F
+
+        coord_chunks[-1].append(value)
+        if split_after:
+            coord_chunks.append([])
+
+    del coord_chunks[-1]
+    coords = []
+
+    for coord_chunk in coord_chunks:
+        coord = 0
+        for i, chunk in enumerate(coord_chunk):
+            coord |= chunk << (i * 5)
+        #there is a 1 on the right if the coord is negative
+        if coord & 0x1:
+            coord = ~coord  #invert
+        coord >>= 1
+        coord /= 100000.0
+        coords.append(coord)
+    # convert the 1 dimensional list to a 2 dimensional list and offsets to
+    # actual values
+    points: List[Coord] = []
+    prev_x = 0
+    prev_y = 0
+    for i in range(0, len(coords) - 1, 2):
+        if coords[i] == 0 and coords[i + 1] == 0:
+            continue
+        prev_x += coords[i + 1]
+        prev_y += coords[i]
+        # a round to 6 digits ensures that the floats are the same as when
+        # they were encoded
+        points.append((round(prev_y, 6), round(prev_x, 6)))
+    return points
+
+
+def random_route(n, rnd: random.Random) -> List[Coord]:
+    '''A random walk of `n` points on the 5-decimal grid polylines encode,
+    with occasional repeated points and long jumps.'''
+    lat, lng = rnd.randint(-8999999, 8999999), rnd.randint(-17999999, 17999999)
+    points = list()
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.05:
+            pass  # repeat the previous point
+        elif r < 0.1:
+            lat = max(-9000000, min(9000000, lat + rnd.randint(-500000, 500000)))
+            lng = max(-18000000, min(18000000, lng + rnd.randint(-500000, 500000)))
+        else:
+            lat = max(-9000000, min(9000000, lat + rnd.randint(-300, 300)))
+            lng = max(-18000000, min(18000000, lng + rnd.randint(-300, 300)))
+        points.append((lat / 100000.0, lng / 100000.0))
+    return points
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=500000)
+    args = parser.parse_args()
+
+    points = random_route(args.points, random.Random(1))
+    encoded = polyline.encode(points)
+    print(f"Polyline: {len(encoded) / (1024 * 1024):.1f} MB, {len(points)} points")
+
+    old_t, old = timed(decode_polyline, encoded)
+    new_t, new = timed(polyline.decode, encoded)
+    compat_t, compat = timed(directions.decode_polyline, encoded)
+    enc_t, _ = timed(polyline.encode, points)
+    assert compat == old
+    print(f"original decode_polyline: {old_t:7.3f}s")
+    print(f"polyline.decode:          {new_t:7.3f}s  ({old_t / new_t:.1f}x)")
+    print(f"directions.decode_polyline: {compat_t:5.3f}s  ({old_t / compat_t:.1f}x)")
+    print(f"polyline.encode:          {enc_t:7.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+'''
+Times rendering the same maps repeatedly with and without the on-disk tile
+cache, against the local stand-in tile server, and counts how many tiles the
+server had to send:
+
+    python benchmarks/bench_tiles.py --maps 10 --latency 0.05
+'''
+import tempfile
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import staticmap
+
+from tilecache import CachedStaticMap, TileCache
+from tile_server import start_server, tile_url
+
+
+def make_track(rnd, n=50):
+    lat, lng = 48.7 + rnd.uniform(-0.05, 0.05), -119.4 + rnd.uniform(-0.05, 0.05)
+    points = list()
+    for _ in range(n):
+        lat += rnd.uniform(-0.005, 0.005)
+        lng += rnd.uniform(-0.005, 0.005)
+        points.append((lng, lat))
+    return points
+
+
+def render_all(tracks, url, tile_cache):
+    start = time.perf_counter()
+    for track in tracks:
+        m = CachedStaticMap(800, 800, url_template=url, tile_cache=tile_cache)
+        m.add_line(staticmap.Line(track, 'red', 4))
+        m.render()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--maps', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency)
+    handler = server.RequestHandlerClass
+    url = tile_url(server)
+    rnd = random.Random(0)
+    tracks = [make_track(rnd) for _ in range(args.maps)]
+
+    with tempfile.TemporaryDirectory() as cachedir:
+        for label, cache in (('uncached', None), ('cached', TileCache(cachedir))):
+            for rnd_no in range(args.rounds):
+                before = handler.requests
+                elapsed = render_all(tracks, url, cache)
+                print(
+                    f"{label:>8} round {rnd_no + 1}: {elapsed:.2f}s, "
+                    f"{handler.requests - before} tiles fetched"
+                )
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+'''
+Compares the memory taken by a long track held as a list of TimeLocations
+with the same track held as a TrackArray, and checks that TrackArray's day
+views split the track where per-point day binning does:
+
+    python benchmarks/bench_track.py --points 1000000
+'''
+import tracemalloc
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from track import TimeLocation, TrackArray
+
+
+def make_points(n, seed=0):
+    rnd = random.Random(seed)
+    lat, lng, moment = 48.7, -119.4, 1467900000.0
+    for _ in range(n):
+        lat += rnd.uniform(-0.001, 0.001)
+        lng += rnd.uniform(-0.001, 0.001)
+        moment += rnd.uniform(0, 2)
+        yield lat, lng, moment
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    built = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1000000)
+    args = parser.parse_args()
+
+    def build_tlocs():
+        return [TimeLocation(lat, lng, moment) for lat, lng, moment in make_points(args.points)]
+
+    def build_track():
+        track = TrackArray()
+        for lat, lng, moment in make_points(args.points):
+            track.append(lat, lng, moment)
+        return track
+
+    tlocs, tlocs_size, tlocs_t = measure(build_tlocs)
+    track, track_size, track_t = measure(build_track)
+
+    days = dict()
+    for tloc in tlocs:
+        days.setdefault(tloc.dt().date(), list()).append(tloc)
+    assert [(day, len(dtlocs)) for day, dtlocs in days.items()] == \
+        [(day, len(dtrack)) for day, dtrack in track.days()]
+    del tlocs
+
+    for label, size, elapsed in (('TimeLocation list', tlocs_size, tlocs_t),
+                                 ('TrackArray', track_size, track_t)):
+        print(f"{label:>17}: {size / 1e6:8.1f} MB, {size / args.points:5.1f} B/point, "
+              f"built in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
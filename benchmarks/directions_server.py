@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+A local stand-in for the Google Maps directions API, for exercising
+create_maps.py and directions.py without network access or API quota. Routes
+are straight lines between the requested stops (including any waypoints),
+and every response is delayed by `--latency` seconds to simulate the real
+round-trip time:
+
+    python benchmarks/directions_server.py --port 8765 --latency 0.2 &
+    python create_maps.py --directions-base-url http://127.0.0.1:8765 ...
+
+StraightDirectionsClient gives the same answers in-process, for timing our
+own work without any HTTP in the way.
+'''
+import http.server
+import urllib.parse
+import threading
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import polyline
+
+
+def parse_stop(s):
+    lat, lng = s.split(',')
+    return float(lat), float(lng)
+
+
+def straight_route(origin, destination, points_per_leg):
+    return [(
+        round(origin[0] + (destination[0] - origin[0]) * i / points_per_leg, 5),
+        round(origin[1] + (destination[1] - origin[1]) * i / points_per_leg, 5),
+    ) for i in range(points_per_leg + 1)]
+
+
+def straight_legs(stops, points_per_leg):
+    '''Returns the legs of a directions response visiting `stops` in order,
+    each leg a single step with its points encoded like the real API's.'''
+    legs = list()
+    for origin, destination in zip(stops, stops[1:]):
+        points = straight_route(origin, destination, points_per_leg)
+        legs.append({'steps': [{'polyline': {'points': polyline.encode(points)}}]})
+    return legs
+
+
+class StraightDirectionsClient:
+    '''Answers `directions()` like googlemaps.Client would from the
+    stand-in server, but in-process, counting its requests.'''
+    def __init__(self, points_per_leg=50):
+        self.points_per_leg = points_per_leg
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def directions(self, origin, destination, mode='driving', waypoints=(), **kwargs):
+        with self.lock:
+            self.requests += 1
+        stops = [origin] + list(waypoints) + [destination]
+        return [{'legs': straight_legs(stops, self.points_per_leg)}]
+
+
+class DirectionsHandler(http.server.BaseHTTPRequestHandler):
+    latency = 0.0
+    points_per_leg = 50
+    requests = 0
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path != '/maps/api/directions/json':
+            self.send_error(404)
+            return
+        type(self).requests += 1
+        time.sleep(self.latency)
+        stops = [parse_stop(query['origin'][0])]
+        if 'waypoints' in query:
+            for waypoint in query['waypoints'][0].split('|'):
+                stops.append(parse_stop(waypoint.replace('via:', '')))
+        stops.append(parse_stop(query['destination'][0]))
+        legs = straight_legs(stops, self.points_per_leg)
+        body = json.dumps({'status': 'OK', 'routes': [{'legs': legs}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=0.0, points_per_leg=50):
+    '''Starts the stand-in server on a background thread and returns it; its
+    URL is `server_url(server)`.'''
+    handler = type(
+        'Handler', (DirectionsHandler, ), {
+            'latency': latency,
+            'points_per_leg': points_per_leg
+        }
+    )
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--points-per-leg', type=int, default=50)
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency, args.points_per_leg)
+    print(f"Serving directions on {server_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
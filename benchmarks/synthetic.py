@@ -0,0 +1,115 @@
+'''
+synthetic.py generates seeded stand-ins for a trip's data at any size, so
+the pipeline can be benchmarked far beyond the few hundred rows of the real
+trips: GPS tracks spanning several days (with points either side of each
+midnight), JPEGs carrying just a GPS EXIF block, and markdown trip logs with
+CSV blocks of timestamped positions. The same seed always gives the same
+data.
+'''
+import datetime
+import random
+import struct
+import math
+import sys
+import os
+
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from track import TrackArray
+
+# 2016-07-07 08:00 UTC, the morning the first trip set off
+TRIP_START = 1467878400.0
+
+
+def make_track(n, days=7, km_per_day=80, seed=0) -> TrackArray:
+    '''Returns a track of `n` points in time order, evenly spread with some
+    jitter over `days` days (so there are points around every midnight),
+    wandering about `km_per_day` a day from near the start of the 2016 trip.'''
+    rnd = random.Random(seed)
+    track = TrackArray()
+    interval = days * 86400 / max(1, n)
+    step_deg = km_per_day * days / max(1, n) / 111.0
+    lat, lng, heading = 48.7, -119.4, rnd.uniform(0, 2 * math.pi)
+    for idx in range(n):
+        track.append(lat, lng, TRIP_START + (idx + rnd.random() * 0.5) * interval)
+        heading += rnd.gauss(0, 0.3)
+        lat += step_deg * math.cos(heading)
+        lng += step_deg * math.sin(heading) / math.cos(math.radians(lat))
+    return track
+
+
+def _dms_rationals(value) -> List[int]:
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    millis = int(round(((value - degrees) * 60 - minutes) * 60 * 1000))
+    return [degrees, 1, minutes, 1, millis, 1000]
+
+
+def make_jpeg(lat, lng, moment) -> bytes:
+    '''Returns a JPEG holding only an EXIF segment with GPS latitude,
+    longitude, date and time, which is all exif_gps.py reads before it
+    stops at the image data.'''
+    when = datetime.datetime.fromtimestamp(int(moment), datetime.timezone.utc)
+    # IFD0 has one entry, pointing at the GPS IFD straight after it
+    gps_ifd = 8 + 2 + 12 + 4
+    entries = 6
+    data = gps_ifd + 2 + entries * 12 + 4
+    values = [
+        struct.pack('<6L', *_dms_rationals(lat)),
+        struct.pack('<6L', *_dms_rationals(lng)),
+        struct.pack('<6L', when.hour, 1, when.minute, 1, when.second, 1),
+        when.strftime('%Y:%m:%d').encode('ascii') + b'\0',
+    ]
+    offsets = list()
+    for value in values:
+        offsets.append(data)
+        data += len(value)
+    tiff = b'II' + struct.pack('<HL', 42, 8)
+    tiff += struct.pack('<HHHLLL', 1, 0x8825, 4, 1, gps_ifd, 0)
+    tiff += struct.pack('<H', entries)
+    tiff += struct.pack('<HHL4s', 1, 2, 2, b'N' if lat >= 0 else b'S')
+    tiff += struct.pack('<HHLL', 2, 5, 3, offsets[0])
+    tiff += struct.pack('<HHL4s', 3, 2, 2, b'E' if lng >= 0 else b'W')
+    tiff += struct.pack('<HHLL', 4, 5, 3, offsets[1])
+    tiff += struct.pack('<HHLL', 7, 5, 3, offsets[2])
+    tiff += struct.pack('<HHLL', 29, 2, len(values[3]), offsets[3])
+    tiff += struct.pack('<L', 0) + b''.join(values)
+    app1 = b'Exif\0\0' + tiff
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + b'\xff\xd9'
+
+
+def write_jpegs(directory, track: TrackArray) -> List[str]:
+    '''Writes a JPEG for each point of `track` into `directory`, returning
+    their paths.'''
+    os.makedirs(directory, exist_ok=True)
+    paths = list()
+    for idx, tloc in enumerate(track):
+        path = os.path.join(directory, f"IMG_{idx:07d}.jpg")
+        with open(path, 'wb') as f:
+            f.write(make_jpeg(tloc.lat, tloc.lng, tloc.moment))
+        paths.append(path)
+    return paths
+
+
+def make_markdown(track: TrackArray, rows_per_block=50, seed=0) -> str:
+    '''Returns a trip log with a paragraph of notes before each CSV block,
+    the blocks holding every point of `track` as `time, lat, lng,
+    description` rows with Pacific Daylight Time timestamps.'''
+    rnd = random.Random(seed)
+    pdt = datetime.timezone(datetime.timedelta(hours=-7))
+    words = ['rode', 'climbed', 'camped', 'lunch', 'river', 'pass', 'headwind', 'flat', 'town']
+    parts = ['# Synthetic bike trip\n\n']
+    for start in range(0, len(track), rows_per_block):
+        notes = ' '.join(rnd.choice(words) for _ in range(40))
+        parts.append(f"{notes}\n\n```\ntime, lat, lng, description\n")
+        for idx in range(start, min(start + rows_per_block, len(track))):
+            when = datetime.datetime.fromtimestamp(track.moment[idx], pdt)
+            parts.append(
+                f"{when:%Y-%m-%d %H:%M -0700}, {track.lat[idx]:.6f}, {track.lng[idx]:.6f}, "
+                f"stop {idx}\n"
+            )
+        parts.append('```\n\n')
+    return ''.join(parts)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''
+A local stand-in for an OpenStreetMap-style tile server, for rendering maps
+with create_maps.py without network access or hammering the public servers.
+Tiles are flat-coloured PNGs derived from z/x/y, and every response is
+delayed by `--latency` seconds to simulate the real round-trip time:
+
+    python benchmarks/tile_server.py --port 8766 --latency 0.05 &
+    python create_maps.py --tile-url 'http://127.0.0.1:8766/{z}/{x}/{y}.png' ...
+'''
+import http.server
+import threading
+import argparse
+import time
+import io
+import re
+
+from PIL import Image
+
+TILE_PATH_RE = re.compile(r'^/(\d+)/(\d+)/(\d+)\.png$')
+
+
+def make_tile(z, x, y, tile_size=256):
+    im = Image.new('RGB', (tile_size, tile_size), ((x * 37) % 256, (y * 53) % 256, (z * 91) % 256))
+    out = io.BytesIO()
+    im.save(out, 'PNG')
+    return out.getvalue()
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    latency = 0.0
+    requests = 0
+
+    def do_GET(self):
+        match = TILE_PATH_RE.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        type(self).requests += 1
+        time.sleep(self.latency)
+        body = make_tile(*[int(g) for g in match.groups()])
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=0.0):
+    '''Starts the stand-in server on a background thread and returns it; its
+    URL template is `tile_url(server)`.'''
+    handler = type('Handler', (TileHandler, ), {'latency': latency})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def tile_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/{{z}}/{{x}}/{{y}}.png"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency)
+    print(f"Serving tiles on {tile_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
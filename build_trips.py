@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+'''
+build_trips.py builds the GPS data and maps of every trip directory
+(`20XX_batey_bike_trip/`) in one go, instead of running the pipeline in the
+README by hand for each year. Each trip has two targets:
+
+    gps   20XX_pictures_gps_data.json, from images/* (via exif_gps.py) and
+          20XX_batey_bike_trip.md (via markdown_gps.py)
+    maps  map_20XX_bike_trip.png and its day maps, from the GPS data (via
+          create_maps.py)
+
+A trip without an images/ directory has no gps target; its GPS data file,
+if there is one, is used as it is. Only targets whose outputs are older
+than their inputs (or, with --hashes, whose inputs' contents have changed
+since they were last built) are rebuilt, and targets of different trips run
+concurrently:
+
+    python build_trips.py --jobs 4
+    python build_trips.py --dry-run
+'''
+import concurrent.futures
+import subprocess
+import threading
+import argparse
+import hashlib
+import glob
+import json
+import time
+import sys
+import os
+import re
+
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRIP_DIR_RE = re.compile(r'^(\d{4})_batey_bike_trip$')
+STATE_FILE = '.build_state.json'
+
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Target:
+    '''One step of the build: running `commands` turns `inputs` into
+    `outputs`. If `stdout_to` is set, the commands' output is concatenated
+    into that file. `deps` are the targets which produce some of the
+    inputs.'''
+    def __init__(self, name, inputs, outputs, commands, stdout_to=None, deps=()):
+        self.name = name
+        self.inputs: List[str] = inputs
+        self.outputs: List[str] = outputs
+        self.commands: List[List[str]] = commands
+        self.stdout_to: Optional[str] = stdout_to
+        self.deps: List[Target] = list(deps)
+
+    def stale_reason(self, state: Optional[Dict[str, Dict[str, str]]]) -> Optional[str]:
+        '''Returns why the target needs building, or None if it's up to date.
+        Compares input digests with those recorded in `state` if given,
+        otherwise compares mtimes. Missing inputs or outputs make it stale.'''
+        missing = [path for path in self.inputs + self.outputs if not os.path.exists(path)]
+        if missing:
+            return f"{os.path.relpath(missing[0])} is missing"
+        if state is not None:
+            recorded = state.get(self.name, dict())
+            for path in self.inputs:
+                if recorded.get(path) != file_digest(path):
+                    return f"{os.path.relpath(path)} changed"
+            return None
+        oldest_output = min(os.path.getmtime(path) for path in self.outputs)
+        for path in self.inputs:
+            if os.path.getmtime(path) > oldest_output:
+                return f"{os.path.relpath(path)} is newer"
+        return None
+
+    def run(self):
+        '''Runs the commands, replacing `stdout_to` only if they all succeed.'''
+        if self.stdout_to is None:
+            for command in self.commands:
+                subprocess.run(command, check=True)
+            return
+        tmppath = self.stdout_to + '.tmp'
+        try:
+            with open(tmppath, 'wb') as out:
+                for command in self.commands:
+                    subprocess.run(command, check=True, stdout=out)
+            os.replace(tmppath, self.stdout_to)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+
+def find_trips(root) -> Dict[str, str]:
+    '''Returns {year: trip directory} for every trip directory under `root`.'''
+    trips = dict()
+    for name in sorted(os.listdir(root)):
+        match = TRIP_DIR_RE.match(name)
+        if match and os.path.isdir(os.path.join(root, name)):
+            trips[match.group(1)] = os.path.join(root, name)
+    return trips
+
+
+def trip_targets(year, tripdir, jobs_per_target=1, create_maps_args=()) -> List[Target]:
+    python = sys.executable
+    markdown = os.path.join(tripdir, f"{year}_batey_bike_trip.md")
+    gpsdata = os.path.join(tripdir, f"{year}_pictures_gps_data.json")
+    images = sorted(glob.glob(os.path.join(tripdir, 'images', '*')))
+    targets = list()
+
+    gps = None
+    if os.path.isdir(os.path.join(tripdir, 'images')) or not os.path.exists(gpsdata):
+        commands = list()
+        inputs = list()
+        if images:
+            commands.append([
+                python, os.path.join(HERE, 'exif_gps.py'), '--jobs', str(jobs_per_target),
+                '--cache', os.path.join(tripdir, '.exif_gps_cache.sqlite')
+            ] + images)
+            inputs += images
+        if os.path.exists(markdown):
+            commands.append([python, os.path.join(HERE, 'markdown_gps.py'), markdown])
+            inputs.append(markdown)
+        if not commands:
+            return targets
+        gps = Target(f"{year} gps", inputs, [gpsdata], commands, stdout_to=gpsdata)
+        targets.append(gps)
+
+    mapfile = os.path.join(tripdir, f"map_{year}_bike_trip.png")
+    targets.append(Target(
+        f"{year} maps",
+        [gpsdata],
+        [mapfile],
+        [[python, os.path.join(HERE, 'create_maps.py'), '--input', gpsdata, '--jobs',
+          str(jobs_per_target)] + list(create_maps_args) + [mapfile]],
+        deps=[gps] if gps is not None else [],
+    ))
+    return targets
+
+
+class Builder:
+    '''Runs targets as soon as their deps are built, at most `workers` at a
+    time, skipping those which are up to date. A target whose dep was
+    rebuilt is always rebuilt; one whose dep failed is skipped, and one whose
+    dep had nothing to build has nothing to build either.'''
+    def __init__(self, targets: List[Target], workers=1, state_path=None, force=False, dry_run=False):
+        self.targets = targets
+        self.workers = workers
+        self.force = force
+        self.dry_run = dry_run
+        self.state_path = state_path
+        self.state: Optional[Dict[str, Dict[str, str]]] = None
+        if state_path is not None:
+            self.state = dict()
+            if os.path.exists(state_path):
+                with open(state_path) as f:
+                    self.state = json.load(f)
+        self.lock = threading.Lock()
+        # target name -> 'built', 'fresh', 'empty', 'failed' or 'skipped'
+        self.results: Dict[str, str] = dict()
+        self.timings: Dict[str, float] = dict()
+
+    def log(self, message):
+        # Targets finish on different threads; keep their lines whole
+        with self.lock:
+            print(message, flush=True)
+
+    def reason(self, target: Target) -> Optional[str]:
+        if self.force:
+            return 'forced'
+        for dep in target.deps:
+            if self.results.get(dep.name) == 'built':
+                return f"{dep.name} was rebuilt"
+        return target.stale_reason(self.state)
+
+    def build_one(self, target: Target) -> str:
+        if any(self.results.get(dep.name) in ('failed', 'skipped') for dep in target.deps):
+            self.log(f"[{target.name}] skipped, a dependency failed")
+            return 'skipped'
+        if any(self.results.get(dep.name) == 'empty' for dep in target.deps):
+            self.log(f"[{target.name}] nothing to build, a dependency had nothing to build")
+            return 'empty'
+        if target.inputs and all(
+            os.path.exists(path) and os.path.getsize(path) == 0 for path in target.inputs
+        ):
+            # e.g. the maps of a trip whose notes have no GPS data yet
+            self.log(f"[{target.name}] nothing to build, its inputs are empty")
+            return 'empty'
+        reason = self.reason(target)
+        if reason is None:
+            self.log(f"[{target.name}] up to date")
+            return 'fresh'
+        if self.dry_run:
+            self.log(f"[{target.name}] would build: {reason}")
+            for command in target.commands:
+                self.log('    ' + subprocess.list2cmdline(command))
+            return 'built'
+        missing = [path for path in target.inputs if not os.path.exists(path)]
+        if missing:
+            self.log(f"[{target.name}] skipped, {os.path.relpath(missing[0])} is missing")
+            return 'skipped'
+        self.log(f"[{target.name}] building: {reason}")
+        start = time.perf_counter()
+        try:
+            target.run()
+        except (subprocess.CalledProcessError, OSError) as e:
+            self.log(f"[{target.name}] failed: {e}")
+            return 'failed'
+        finally:
+            self.timings[target.name] = time.perf_counter() - start
+        self.log(f"[{target.name}] built in {self.timings[target.name]:.1f}s")
+        if self.state is not None:
+            with self.lock:
+                self.state[target.name] = {path: file_digest(path) for path in target.inputs}
+                self.save_state()
+        return 'built'
+
+    def save_state(self):
+        tmppath = self.state_path + '.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmppath, self.state_path)
+
+    def run(self) -> bool:
+        '''Builds everything, returning whether every target succeeded.'''
+        pending = list(self.targets)
+        running: Dict[concurrent.futures.Future, Target] = dict()
+        with concurrent.futures.ThreadPoolExecutor(max(1, self.workers)) as pool:
+            while pending or running:
+                ready = [t for t in pending if all(dep.name in self.results for dep in t.deps)]
+                for target in ready:
+                    pending.remove(target)
+                    running[pool.submit(self.build_one, target)] = target
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    self.results[running.pop(future).name] = future.result()
+        return not any(result in ('failed', 'skipped') for result in self.results.values())
+
+    def print_timings(self):
+        if not self.timings:
+            return
+        print('Timings:')
+        for name, elapsed in sorted(self.timings.items(), key=lambda item: -item[1]):
+            print(f"  {name:<12} {elapsed:8.1f}s  {self.results.get(name, '')}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'years', nargs='*', help='Only build these trips (e.g. 2018 2019); all of them by default'
+    )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=0,
+        help='Total number of worker processes shared by every target (0 means one per CPU)'
+    )
+    parser.add_argument(
+        '--jobs-per-target',
+        type=int,
+        default=1,
+        help='Worker processes each target runs with, out of the --jobs total'
+    )
+    parser.add_argument(
+        '--hashes',
+        action='store_true',
+        help=f"Decide what's stale by hashing inputs (recorded in {STATE_FILE}) instead of by mtime"
+    )
+    parser.add_argument('--force', action='store_true', help='Rebuild every target')
+    parser.add_argument(
+        '--dry-run', '-n', action='store_true', help='Print what would be built without building it'
+    )
+    parser.add_argument(
+        '--offline', action='store_true', help='Pass --offline to create_maps.py'
+    )
+    args = parser.parse_args()
+
+    trips = find_trips(HERE)
+    if args.years:
+        unknown = [year for year in args.years if year not in trips]
+        if unknown:
+            parser.error(f"no trip directory for {', '.join(unknown)}")
+        trips = {year: trips[year] for year in args.years}
+
+    create_maps_args = ['--offline'] if args.offline else []
+    targets = list()
+    for year, tripdir in trips.items():
+        targets += trip_targets(year, tripdir, args.jobs_per_target, create_maps_args)
+
+    budget = args.jobs if args.jobs > 0 else os.cpu_count()
+    builder = Builder(
+        targets,
+        workers=max(1, budget // max(1, args.jobs_per_target)),
+        state_path=os.path.join(HERE, STATE_FILE) if args.hashes else None,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
+    start = time.perf_counter()
+    ok = builder.run()
+    builder.print_timings()
+    print(f"Finished in {time.perf_counter() - start:.1f}s")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
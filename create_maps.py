@@ -13,41 +13,39 @@ and the routes implied by the coordinates on a map.
 import googlemaps
 import staticmap
 
+import multiprocessing
 import binascii
+import argparse
 import datetime
+import zoneinfo
+import operator
+import hashlib
+import heapq
 import json
 import math
 import sys
+import io
+import os
 
-from typing import List, Any, Dict, Tuple
+from typing import List, Any, Dict, Iterator, Optional, Sequence, Tuple
+
+import simplify
+import geodesy
+import metrics
+import gpsbin
+from track import TrackArray
+from interpolate import STRATEGIES, interpolate_legs
+from tilecache import CachedStaticMap, TileCache
+from directions import DirectionsCache, DirectionsCacheMiss, RouteFetcher
 
 # Pirated google maps API key (from an example code sample published by Google)
 GMAPS_APIKEY = "AIz" + "aSyA3gqF4a2G0bcRG7J" + "gzAwo40iVStrSv2OM"
 
-Coord = Tuple[float, float]
-
-
-class TimeLocation:
-    def __init__(self, lat=None, lng=None, moment=None):
-        '''TimeLocation is both a time and place.'''
-        # lat/lng are latitude longitude expressed in Decimal Degrees (DD)
-        self.lat = lat
-        self.lng = lng
-        # moment is epoch timestamp in seconds
-        self.moment: int = moment
-
-    @staticmethod
-    def fromrow(d):
-        lat = d['latitude']
-        lng = d['longitude']
-        moment = d['timestamp_utc']
-        return TimeLocation(lat, lng, moment)
+TILE_URL = "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"
 
-    def latlngpoint(self):
-        return [self.lat, self.lng]
-
-    def dt(self) -> datetime.datetime:
-        return datetime.datetime.fromtimestamp(self.moment)
+# Bump this whenever render_job would draw something different from the same
+# job, so maps rendered by an older version aren't considered up to date.
+RENDER_VERSION = 1
 
 
 def color_hash(obj):
@@ -68,325 +66,161 @@ def color_hash(obj):
     return leland_colors_hex[binascii.crc32(str(obj).encode('utf-8')) % len(leland_colors_hex)]
 
 
-# Below taken from here:
-#     http://www.johndcook.com/blog/python_longitude_latitude/
-def distance_on_unit_sphere(lat1, long1, lat2, long2):
-    """Calculates the distance between two lat/long points. Returns distance in
-    meters."""
-    lat1, long1 = float(lat1), float(long1)
-    lat2, long2 = float(lat2), float(long2)
-    # Convert latitude and longitude to
-    # spherical coordinates in radians.
-    degrees_to_radians = math.pi / 180.0
-
-    # phi = 90 - latitude
-    phi1 = (90.0 - lat1) * degrees_to_radians
-    phi2 = (90.0 - lat2) * degrees_to_radians
-
-    # theta = longitude
-    theta1 = long1 * degrees_to_radians
-    theta2 = long2 * degrees_to_radians
-
-    # Compute spherical distance from spherical coordinates.
-    # For two locations in spherical coordinates
-    # (1, theta, phi) and (1, theta, phi)
-    # cosine( arc length ) =
-    #    sin phi sin phi' cos(theta-theta') + cos phi cos phi'
-    # distance = rho * arc length
-    cos = (
-        math.sin(phi1) * math.sin(phi2) * math.cos(theta1 - theta2) +
-        math.cos(phi1) * math.cos(phi2)
-    )
-    cos = min(1, max(cos, -1))
-    try:
-        arc = math.acos(cos)
-    except Exception as e:
-        raise e
-    return arc * 6378100
-
-
-def decode_polyline(point_str) -> List[Coord]:
-    '''Decodes a polyline that has been encoded using Google's algorithm
-    http://code.google.com/apis/maps/documentation/polylinealgorithm.html
-    https://gist.github.com/signed0/2031157
-
-    This is a generic method that returns a list of (latitude, longitude)
-    tuples.
-
-    :param point_str: Encoded polyline string.
-    :type point_str: string
-    :returns: List of 2-tuples where each tuple is (latitude, longitude)
-    :rtype: list
-    '''
-    # sone coordinate offset is represented by 4 to 5 binary chunks
-    coord_chunks = [[]]
-    for char in point_str:
-        # convert each character to decimal from ascii
-        value = ord(char) - 63
-        # values that have a chunk following have an extra 1 on the left
-        split_after = not (value & 0x20)
-        value &= 0x1F
-
-        coord_chunks[-1].append(value)
-        if split_after:
-            coord_chunks.append([])
-
-    del coord_chunks[-1]
-    coords = []
-
-    for coord_chunk in coord_chunks:
-        coord = 0
-        for i, chunk in enumerate(coord_chunk):
-            coord |= chunk << (i * 5)
-        #there is a 1 on the right if the coord is negative
-        if coord & 0x1:
-            coord = ~coord  #invert
-        coord >>= 1
-        coord /= 100000.0
-        coords.append(coord)
-    # convert the 1 dimensional list to a 2 dimensional list and offsets to
-    # actual values
-    points: List[Coord] = []
-    prev_x = 0
-    prev_y = 0
-    for i in range(0, len(coords) - 1, 2):
-        if coords[i] == 0 and coords[i + 1] == 0:
-            continue
-        prev_x += coords[i + 1]
-        prev_y += coords[i]
-        # a round to 6 digits ensures that the floats are the same as when
-        # they were encoded
-        points.append((round(prev_y, 6), round(prev_x, 6)))
-    return points
-
-
-def flatten_routes_points(directionsresponse) -> List[Coord]:
-    '''Accepts a `directionsresponse`, which is the response from calling the
-    Google Maps `directions()` API. Returns a list of tuples, where each tuple
-    is a lat-lng pair. '''
-    flatpoints: List[Coord] = list()
-    for route in directionsresponse:
-        directionslegs = route['legs']
-        for leg in directionslegs:
-            directionssteps = leg['steps']
-            for step in directionssteps:
-                flatpoints += decode_polyline(step['polyline']['points'])
-    return flatpoints
-
-
-def bin_by_day(tlocs: List[TimeLocation]) -> Dict[str, List[TimeLocation]]:
-    days = {}
-    for tl in tlocs:
-        ts = datetime.datetime.fromtimestamp(tl.moment)
-        ts_str = ts.strftime("%Y_%m_%d")
-        if not ts_str in days:
-            days[ts_str] = list()
-        days[ts_str].append(tl)
-    return days
+def bin_by_day(track: TrackArray, tz: Optional[datetime.tzinfo] = None) -> Dict[str, TrackArray]:
+    '''Splits a time ordered track into views of each day, in timezone `tz`
+    or else local time.'''
+    return {day.strftime("%Y_%m_%d"): dtrack for day, dtrack in track.days(tz)}
+
+
+def split_segments(track: TrackArray, tz: Optional[datetime.tzinfo] = None) -> List[TrackArray]:
+    '''Splits `track` into runs which should be drawn as one continuous line.
+    A run ends wherever the track crosses midnight, since that's where
+    clamp_end_before_midnight leaves a gap instead of implying travel
+    through the night.'''
+    return [segment for _, segment in track.days(tz)]
+
+
+# Widths in pixels of the white outline and of the colored line or marker
+# drawn over it
+LINE_WIDTHS = (8, 6)
+MARKER_WIDTHS = (9, 7)
 
 
 def draw_tlocs(
     m: staticmap.StaticMap,
-    tlocs: List[TimeLocation],
-    orig_tlocs: List[TimeLocation],
+    tlocs: TrackArray,
+    orig_tlocs: TrackArray,
     linecolor='red',
     markercolor='green',
+    tz: Optional[datetime.tzinfo] = None,
 ):
-    def tlocs_to_lines(_tlocs: List[TimeLocation]):
-        _lpairs = list()
-        for idx in range(len(_tlocs) - 1):
-            cur = _tlocs[idx].latlngpoint()
-            nxt = _tlocs[idx + 1].latlngpoint()
-            coordpair = [
-                # I don't know why, but this komoot/staticmap library uses longitude-first coordinates :(
-                [cur[1], cur[0]],
-                [nxt[1], nxt[0]],
-            ]
-            _lpairs.append(coordpair)
-        return _lpairs
-
-    linepairs = list()
-    linepairs = tlocs_to_lines(tlocs)
-    # We use normal line formatting because the drawing function will flip the format
-    orig_points = [tloc.latlngpoint() for tloc in orig_tlocs]
-
-    def draw_lines(color, thickness):
-        for pair in linepairs:
-            coords = pair
-            line = staticmap.Line(coords, color, thickness)
-            m.add_line(line)
-
-    draw_lines('white', 8)
-    draw_lines(linecolor, 6)
-
-    def draw_rawpoints(color, thickness):
-        for point in orig_points:
-            pnt = [point[1], point[0]]
-            marker = staticmap.CircleMarker(pnt, color, thickness)
-            m.add_marker(marker)
-
-    draw_rawpoints('white', 9)
-    draw_rawpoints(markercolor, 7)
-
-
-def clamp_end_before_midnight(
-    start_t: datetime.datetime, end_t: datetime.datetime
-) -> Tuple[datetime.datetime, datetime.datetime]:
-    '''
-    If the time difference between start and end would span multiple days, we
-    don't want to smoothly interpolate between then since that would imply
-    continuous travel, even through the middle of the night, which doesn't
-    match up with what we'd intuit. Instead, we clamp the end time to be 1
-    second before midnight on the day of the start, and we assume that there's
-    just missing data between then and the start of the later day.
-    '''
-    if start_t.day != end_t.day:
-        end_t = datetime.datetime(
-            year=start_t.year,
-            day=start_t.day,
-            month=start_t.month,
-            hour=23,
-            minute=59,
-            second=59,
-        )
-    return start_t, end_t
-
-
-def interpolate_timelocations(
-    gmaps: googlemaps.Client,
-    tlocs: List[TimeLocation],
-) -> List[TimeLocation]:
-    ''' Given a list of TimeLocations, interpolate between the two
-    timelocations using the Googlemaps directions() API. '''
-    interpolated_tlocs: List[TimeLocation] = list()
-    for idx in range(len(tlocs) - 1):
-        cur: TimeLocation = tlocs[idx]
-        nxt: TimeLocation = tlocs[idx + 1]
-        interpolated_tlocs.append(cur)
-        if distance_on_unit_sphere(*(cur.latlngpoint()), *(nxt.latlngpoint())) > 500:
-            print('Getting directions')
-            directions = gmaps.directions(cur.latlngpoint(), nxt.latlngpoint(), mode='bicycling')
-            flatpoints = flatten_routes_points(directions)
-            # If the timediff would span a midnight boundary, the we assume
-            # that there's a time-jump and clamp the duration interp
-            start_t, end_t = clamp_end_before_midnight(cur.dt(), nxt.dt())
-            per_point_timediff = (end_t - start_t) / (len(flatpoints) + 1)
-            for pidx, point in enumerate(flatpoints):
-                offset = (pidx + 1) * per_point_timediff
-                newtime: datetime.datetime = start_t + offset
-                newtloc = TimeLocation(lat=point[0], lng=point[1], moment=newtime.timestamp())
-                interpolated_tlocs.append(newtloc)
-    interpolated_tlocs.append(tlocs[-1])
-    return interpolated_tlocs
-
-
-def lon_to_x(lng, zoom):
-    """
-    transform longitude to tile number
-    :type lng: float
-    :type zoom: int
-    :rtype: float
-    """
-    if not (-180 <= lng <= 180):
-        lng = (lng + 180) % 360 - 180
-
-    return ((lng + 180.) / 360) * pow(2, zoom)
-
-
-def lat_to_y(lat, zoom):
-    """
-    transform latitude to tile number
-    :type lat: float
-    :type zoom: int
-    :rtype: float
-    """
-    if not (-90 <= lat <= 90):
-        lat = (lat + 90) % 180 - 90
-
-    return (
-        1 - math.log(math.tan(lat * math.pi / 180) + 1 / math.cos(lat * math.pi / 180)) / math.pi
-    ) / 2 * pow(2, zoom)
-
-
-def x_to_px(self, x):
-    """
-    transform tile number to pixel on image canvas
-    :type x: float
-    :rtype: float
-    """
-    # print(f"{x=}")
-    # print(f"{self.x_center=}")
-    # print(f"{self.tile_size=}")
-    # print(f"{self.width=}")
-    px = (x - self.x_center) * self.tile_size + self.width / 2
-    return int(round(px))
-
-
-def y_to_px(self, y):
-    """
-    transform tile number to pixel on image canvas
-    :type y: float
-    :rtype: float
-    """
-    # print(f"{y=}")
-    # print(f"{self.y_center=}")
-    # print(f"{self.tile_size=}")
-    # print(f"{self.height=}")
-    px = (y - self.y_center) * self.tile_size + self.height / 2
-    return int(round(px))
-
-
-def mincoords(coords):
-    return (min(c[0] for c in coords), min(c[1] for c in coords))
-
-
-def maxcoords(coords):
-    return (max(c[0] for c in coords), max(c[1] for c in coords))
-
-
-def calc_mapinfo(m):
-    zoom = m._calculate_zoom()
-    # print(f"{zoom=}")
-    # extent has two coordinates which if rendered, are one in the top right
-    # and one in the bottom left. bottom left coord comes first of the four
-    # numbers.
-    extent = m.determine_extent(zoom)
-    # lng,lat fmt, in keeping with staticmap code we're copying
-    topright_coords = (extent[2], extent[3])
-    botmleft_coords = (extent[0], extent[1])
-
-    # Have to set center on m to correctly calculate pix positions later
-    lon_center, lat_center = (extent[0] + extent[2]) / 2, (extent[1] + extent[3]) / 2
-    m.x_center = lon_to_x(lon_center, zoom)
-    m.y_center = lat_to_y(lat_center, zoom)
-
-    topright_pix = (
-        x_to_px(m, lon_to_x(topright_coords[0], zoom)),
-        y_to_px(m, lat_to_y(topright_coords[1], zoom)),
-    )
-    botmleft_pix = (
-        x_to_px(m, lon_to_x(botmleft_coords[0], zoom)),
-        y_to_px(m, lat_to_y(botmleft_coords[1], zoom)),
-    )
-
-    # print(f"{topright_pix=}")
-    # print(f"{botmleft_pix=}")
-
-    mincorner = mincoords([topright_pix, botmleft_pix])
-    maxcorner = maxcoords([topright_pix, botmleft_pix])
-
-    height = maxcorner[1] - mincorner[1]
-    width = maxcorner[0] - mincorner[0]
-
-    # print(f"{height=}")
-    # print(f"{width=}")
+    # I don't know why, but this komoot/staticmap library uses
+    # longitude-first coordinates :(
+    # Each segment is one multi-point line rather than a line per pair of
+    # points. staticmap's own simplification is turned off since it would
+    # visibly change long lines; tracks are simplified by simplify_tlocs.
+    segments = [list(zip(seg.lng, seg.lat)) for seg in split_segments(tlocs, tz) if len(seg) > 1]
+    for color, thickness in zip(['white', linecolor], LINE_WIDTHS):
+        for coords in segments:
+            m.add_line(staticmap.Line(coords, color, thickness, simplify=False))
+
+    orig_points = list(zip(orig_tlocs.lng, orig_tlocs.lat))
+    for color, thickness in zip(['white', markercolor], MARKER_WIDTHS):
+        m.markers.extend(staticmap.CircleMarker(pnt, color, thickness) for pnt in orig_points)
+
+
+def simplify_tlocs(tlocs: TrackArray, zoom: int, tolerance_px=0.5) -> TrackArray:
+    '''Drops points which wouldn't visibly change the drawn line at `zoom`;
+    see simplify.simplify_indices.'''
+    if len(tlocs) <= 2 or tolerance_px <= 0:
+        return tlocs
+    return tlocs.take(simplify.simplify_indices(tlocs.lat, tlocs.lng, zoom, tolerance_px))
+
+
+# The widest marker draw_tlocs draws, in pixels either side of the point
+MARKER_EXTENT_PX = max(MARKER_WIDTHS)
+
+
+def calc_mapinfo(
+    lats: Sequence[float],
+    lngs: Sequence[float],
+    marker_lats: Sequence[float],
+    marker_lngs: Sequence[float],
+    width=1000,
+    height=1000,
+    tile_size=256,
+) -> Dict[str, Any]:
+    '''Works out how staticmap will frame a `width` x `height` map of a track
+    through `lats`/`lngs` with markers at `marker_lats`/`marker_lngs`, as drawn
+    by draw_tlocs, straight from the coordinates. Returns the bounding box,
+    the zoom staticmap will pick, the size in pixels of the drawn features at
+    that zoom, their aspect ratio, and the output dimensions fitting them.'''
+    # Tile numbers only grow with longitude and shrink with latitude, so only
+    # the corners of each bounding box matter. They're projected at zoom 0
+    # and scaled up for each zoom tried. Markers reach MARKER_EXTENT_PX past
+    # their points whatever the zoom.
+    boxes = list()
+    bbox = None
+    for box_lats, box_lngs, pad in [(lats, lngs, 0), (marker_lats, marker_lngs, MARKER_EXTENT_PX)]:
+        if len(box_lats) == 0:
+            continue
+        min_lat, min_lng, max_lat, max_lng = geodesy.bounding_box(box_lats, box_lngs)
+        left, right = geodesy.lon_to_x([min_lng, max_lng], 0)
+        top, bottom = geodesy.lat_to_y([max_lat, min_lat], 0)
+        boxes.append((left, top, right, bottom, pad))
+        if bbox is None:
+            bbox = (min_lat, min_lng, max_lat, max_lng)
+        else:
+            bbox = (
+                min(bbox[0], min_lat), min(bbox[1], min_lng),
+                max(bbox[2], max_lat), max(bbox[3], max_lng)
+            )
+
+    def feature_size(zoom):
+        scale = 2**zoom * tile_size
+        left = min(b[0] * scale - b[4] for b in boxes)
+        top = min(b[1] * scale - b[4] for b in boxes)
+        right = max(b[2] * scale + b[4] for b in boxes)
+        bottom = max(b[3] * scale + b[4] for b in boxes)
+        return float(right - left), float(bottom - top)
+
+    # Same search as staticmap: the highest zoom at which everything fits
+    zoom = 0
+    for z in range(17, -1, -1):
+        feature_width, feature_height = feature_size(z)
+        if feature_width <= width and feature_height <= height:
+            zoom = z
+            break
+    # Whole pixels, as measured on a rendered map
+    feature_width, feature_height = [int(round(size)) for size in feature_size(zoom)]
+    aspect_ratio = feature_width / feature_height
     return {
-        'feature_height': height,
-        'feature_width': width,
+        'bbox': bbox,
         'zoom': zoom,
+        'feature_width': feature_width,
+        'feature_height': feature_height,
+        'aspect_ratio': aspect_ratio,
+        'dimensions': calc_output_dimensions(aspect_ratio),
     }
 
 
+def interpolate_timelocations(
+    fetcher: RouteFetcher,
+    tlocs: TrackArray,
+    strategy='even',
+    tz: Optional[datetime.tzinfo] = None,
+    meter: Optional[metrics.Metrics] = None,
+) -> TrackArray:
+    ''' Given a track, interpolate between each pair of points using the
+    Googlemaps directions() API, by way of `fetcher` and its directions
+    cache. Points along each route are timed by `strategy`; see
+    interpolate.interpolate_legs. The 'directions_fetch' and 'interpolation'
+    stages are measured by `meter`, if given. '''
+    if meter is None:
+        meter = metrics.Metrics()
+    with meter.stage('directions_fetch'):
+        # Find every leg needing directions up front so they can all be
+        # fetched concurrently
+        leg_idxs = geodesy.legs_longer_than(tlocs.lat, tlocs.lng, 500)
+        legs = [(tlocs[idx].latlngpoint(), tlocs[idx + 1].latlngpoint()) for idx in leg_idxs]
+        # Only legs from the same day are batched into one directions request
+        days = [datetime.datetime.fromtimestamp(tlocs.moment[idx], tz).date() for idx in leg_idxs]
+        requests = fetcher.requests
+        hits, misses = (fetcher.cache.hits, fetcher.cache.misses) if fetcher.cache else (0, 0)
+        try:
+            leg_points = dict(zip(leg_idxs, fetcher.fetch_legs(legs, batch_keys=days)))
+        finally:
+            meter.add('directions_fetch', 'items', len(legs))
+            meter.add('directions_fetch', 'api_calls', fetcher.requests - requests)
+            if fetcher.cache is not None:
+                meter.add('directions_fetch', 'cache_hits', fetcher.cache.hits - hits)
+                meter.add('directions_fetch', 'cache_misses', fetcher.cache.misses - misses)
+    with meter.stage('interpolation'):
+        interp_tlocs = interpolate_legs(tlocs, leg_points, strategy, tz)
+    meter.add('interpolation', 'items', len(interp_tlocs))
+    return interp_tlocs
+
+
 def calc_output_dimensions(wh_aspect_ratio, shortside_goal_length=1000):
     '''Returns width height'''
     if wh_aspect_ratio < 1:
@@ -399,60 +233,394 @@ def calc_output_dimensions(wh_aspect_ratio, shortside_goal_length=1000):
     return int(width), int(height)
 
 
+def render_job(job) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+    '''Draws and saves one output image. `job` holds the output filename,
+    the image dimensions, the simplification tolerance and a list of layers,
+    each of which is (track, markers, color) with both as TrackArrays, the
+    trip's timezone, where tiles come from (a URL template and an optional
+    tile cache directory) and the directory of cProfile dumps, if any.
+    Returns the filename and the measurements of rendering it, as
+    metrics.Metrics.as_dict().'''
+    meter = metrics.Metrics(profile_dir=job['profile_dir'])
+    layers = job['layers']
+    tile_cache = None
+    if job['tile_cache']:
+        tile_cache = TileCache(job['tile_cache'])
+    m = CachedStaticMap(
+        *job['dimensions'], url_template=job['tile_url'], tile_cache=tile_cache, meter=meter
+    )
+    # Simplify each track for the zoom of the map it's drawn on
+    with meter.stage('extent_calc'):
+        all_lines = TrackArray.concat([lines for lines, _, _ in layers])
+        all_markers = TrackArray.concat([markers for _, markers, _ in layers])
+        zoom = calc_mapinfo(
+            all_lines.lat,
+            all_lines.lng,
+            all_markers.lat,
+            all_markers.lng,
+            m.width,
+            m.height,
+            m.tile_size,
+        )['zoom']
+    with meter.stage('draw'):
+        for lines, markers, color in layers:
+            lines = simplify_tlocs(lines, zoom, job['tolerance'])
+            draw_tlocs(m, lines, markers, linecolor=color, markercolor=color, tz=job['timezone'])
+            meter.add('draw', 'items', len(lines) + len(markers))
+    image = m.render(zoom=zoom)
+    if tile_cache is not None:
+        meter.add('tile_fetch', 'cache_hits', tile_cache.hits)
+        meter.add('tile_fetch', 'cache_misses', tile_cache.misses)
+    with meter.stage('png_encode'):
+        image.save(job['filename'])
+    meter.add('png_encode', 'items')
+    meter.add('png_encode', 'bytes_written', os.path.getsize(job['filename']))
+    # Each map's stages get their own profiles, wherever they were rendered
+    meter.dump_profiles(prefix=os.path.basename(job['filename']) + '.')
+    return job['filename'], meter.as_dict()
+
+
+def iter_points(path) -> Iterator[Tuple[float, float, float]]:
+    '''Lazily yields (timestamp, latitude, longitude) for each row without an
+    error in `path` (stdin if '-'), in the order they're in. `path` may be
+    JSON lines or gpsbin, and may be a pipe.'''
+    f = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    if f.peek(len(gpsbin.MAGIC))[:len(gpsbin.MAGIC)] == gpsbin.MAGIC:
+        # Regular files are memory-mapped; pipes have to be read in full
+        data = path if path != '-' and f.seekable() else f.read()
+        if path != '-':
+            f.close()
+        track = gpsbin.load_track(data)
+        yield from zip(track.moment, track.lat, track.lng)
+        return
+    lines = sys.stdin if path == '-' else io.TextIOWrapper(f, encoding='utf-8')
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if 'error' in row and row['error']:
+                continue
+            yield float(row['timestamp_utc']), row['latitude'], row['longitude']
+    finally:
+        if path != '-':
+            lines.close()
+
+
+def read_track(paths: Sequence[str] = ('-', )) -> TrackArray:
+    '''Reads GPS rows from each of `paths` (stdin if '-'), as JSON lines or
+    gpsbin, and returns the ones without errors as one track in time order.
+    Inputs which are each already in time order (see the --sort options of
+    exif_gps.py and markdown_gps.py) are merged as they're read; otherwise
+    the whole track is sorted once it's been read.
+
+    Merging saves the sort and holding each input's parsed rows, but not
+    memory proportional to the number of points: every point still ends up
+    in the returned track (24 bytes each), since finding the map extents,
+    interpolating and splitting into days all need the whole trip.'''
+    if len(paths) == 1 and os.path.isfile(paths[0]) and gpsbin.is_gpsbin(paths[0]):
+        return gpsbin.load_track(paths[0])
+    track = TrackArray()
+    in_order = True
+    last = -math.inf
+    merged = heapq.merge(*(iter_points(path) for path in paths), key=operator.itemgetter(0))
+    for moment, lat, lng in merged:
+        if moment < last:
+            in_order = False
+        last = moment
+        track.append(lat, lng, moment)
+    if not in_order:
+        print("Input isn't in time order; sorting it", file=sys.stderr)
+        track = track.take(sorted(range(len(track)), key=track.moment.__getitem__))
+    return track
+
+
+def job_digest(job) -> str:
+    '''Returns a hash of everything that decides what render_job draws for
+    `job`: its points, colors, line and marker widths, dimensions and
+    rendering options.'''
+    digest = hashlib.sha256()
+    params = {
+        'version': RENDER_VERSION,
+        'dimensions': list(job['dimensions']),
+        'tolerance': job['tolerance'],
+        'timezone': str(job['timezone']),
+        'tile_url': job['tile_url'],
+        'line_widths': LINE_WIDTHS,
+        'marker_widths': MARKER_WIDTHS,
+        'layers': [[len(lines), len(markers), color] for lines, markers, color in job['layers']],
+    }
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    for lines, markers, _ in job['layers']:
+        for col in (lines.lat, lines.lng, lines.moment, markers.lat, markers.lng, markers.moment):
+            digest.update(col)
+    return digest.hexdigest()
+
+
+class RenderManifest:
+    '''A JSON file next to the output maps, recording the job_digest each
+    map was last rendered from, so maps whose inputs haven't changed can be
+    skipped.'''
+    def __init__(self, path):
+        self.path = path
+        self.digests: Dict[str, str] = dict()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.digests = json.load(f)
+
+    def is_current(self, filename, digest) -> bool:
+        return self.digests.get(os.path.basename(filename)) == digest and os.path.exists(filename)
+
+    def record(self, filename, digest):
+        self.digests[os.path.basename(filename)] = digest
+
+    def save(self):
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(self.digests, f, indent=2, sort_keys=True)
+        os.replace(tmppath, self.path)
+
+
 def main():
-    gmaps = googlemaps.Client(key=GMAPS_APIKEY)
-    rows = list()
-    readfile = sys.stdin
-    for line in readfile:
-        if line.strip():
-            rows.append(json.loads(line))
-    # this 'm' is temporary only; the real 'm' is created with dynamic
-    # dimensions for better fit later on.
-    m = staticmap.StaticMap(1000, 1000)
-    rows = [r for r in rows if not 'error' in r or not r['error']]
-    rows = sorted(rows, key=lambda x: x['timestamp_utc'])
-
-    tlocs = [TimeLocation.fromrow(row) for row in rows]
-    # Draw to in-mem canvas so we can learn about aspect-ratioes in order to
-    # have a nicely sized output image
-    draw_tlocs(m, tlocs, tlocs)
-
-    mapinfo = calc_mapinfo(m)
-    aspect_ratio = mapinfo['feature_width'] / mapinfo['feature_height']
-    m = staticmap.StaticMap(*calc_output_dimensions(aspect_ratio))
-
-    interp_tlocs = interpolate_timelocations(gmaps, tlocs)
-
-    orig_day_tlocs = bin_by_day(tlocs)
-    day_tlocs = bin_by_day(interp_tlocs)
-
-    output_name = 'map.png'
-    if len(sys.argv) > 1:
-        output_name = sys.argv[1]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', nargs='?', default='map.png', help='Path of the overview map')
+    parser.add_argument(
+        '--input',
+        '-i',
+        metavar='PATH',
+        action='append',
+        help='GPS data as JSON lines or gpsbin (see gpsbin.py), or - for stdin. May be given '
+        'more than once, to merge several time ordered inputs. Read from stdin if omitted'
+    )
+    parser.add_argument(
+        '--track-out',
+        metavar='PATH',
+        help='Also write the interpolated track to this file, in gpsbin format'
+    )
+    parser.add_argument(
+        '--directions-cache',
+        metavar='PATH',
+        default='.directions_cache.sqlite',
+        help='SQLite file caching directions API responses (empty string to disable)'
+    )
+    parser.add_argument(
+        '--directions-ttl-days',
+        type=float,
+        default=None,
+        help='Ignore and evict cached directions older than this many days'
+    )
+    parser.add_argument(
+        '--directions-cache-max',
+        type=int,
+        default=None,
+        help='Evict the least recently used directions beyond this many entries'
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help="Never call the directions API; fail if a route isn't already cached"
+    )
+    parser.add_argument(
+        '--directions-workers',
+        type=int,
+        default=8,
+        help='Number of directions requests to have in flight at once'
+    )
+    parser.add_argument(
+        '--directions-rps',
+        type=float,
+        default=10,
+        help='Maximum directions requests started per second (0 for no limit)'
+    )
+    parser.add_argument(
+        '--directions-batch-waypoints',
+        type=int,
+        default=0,
+        help='Batch consecutive legs of a day into one directions request with up to this many '
+        'waypoints (at most 25; 0 requests each leg separately)'
+    )
+    parser.add_argument(
+        '--directions-base-url',
+        default=None,
+        help='Send directions requests to this server instead of Google, e.g. a local stand-in'
+    )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=1,
+        help='Number of worker processes rendering maps (0 means one per CPU)'
+    )
+    parser.add_argument(
+        '--interpolation',
+        choices=STRATEGIES,
+        default='even',
+        help='How to time the points along each route: evenly spaced, or by distance travelled'
+    )
+    parser.add_argument(
+        '--timezone',
+        default=None,
+        help='Timezone of the trip (e.g. America/Los_Angeles), used to split the trip into days. '
+        'Defaults to local time'
+    )
+    parser.add_argument(
+        '--tile-url',
+        default=TILE_URL,
+        help='URL template of the map tile server, with {z}, {x} and {y} placeholders'
+    )
+    parser.add_argument(
+        '--tile-cache',
+        metavar='DIR',
+        default='.tile_cache',
+        help='Directory caching downloaded map tiles (empty string to disable)'
+    )
+    parser.add_argument(
+        '--tile-cache-mb',
+        type=float,
+        default=512,
+        help='Evict least recently used tiles beyond this many megabytes (0 for no limit)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Render every map, even those whose inputs are unchanged since they were last rendered'
+    )
+    parser.add_argument(
+        '--simplify-tolerance',
+        type=float,
+        default=0.5,
+        help='Drop route points within this many pixels of the drawn line (0 to draw every point)'
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    meter = metrics.from_args(args)
+    tz = zoneinfo.ZoneInfo(args.timezone) if args.timezone else None
+
+    cache = None
+    if args.directions_cache:
+        ttl = None
+        if args.directions_ttl_days is not None:
+            ttl = args.directions_ttl_days * 24 * 60 * 60
+        cache = DirectionsCache(args.directions_cache, ttl=ttl, max_entries=args.directions_cache_max)
+    gmaps = None
+    if not args.offline:
+        client_kwargs = dict()
+        if args.directions_base_url:
+            client_kwargs['base_url'] = args.directions_base_url
+        gmaps = googlemaps.Client(key=GMAPS_APIKEY, **client_kwargs)
+    fetcher = RouteFetcher(
+        gmaps,
+        cache,
+        mode='bicycling',
+        offline=args.offline,
+        workers=args.directions_workers,
+        rate=args.directions_rps,
+        max_waypoints=min(args.directions_batch_waypoints, 25),
+    )
+
+    inputs = args.input or ['-']
+    with meter.stage('ingest'):
+        tlocs = read_track(inputs)
+    meter.add('ingest', 'items', len(tlocs))
+    # Only files are counted; how much came through a pipe isn't known
+    files = [path for path in inputs if os.path.isfile(path)]
+    meter.add('ingest', 'bytes_read', sum(os.path.getsize(path) for path in files))
+    if len(tlocs) == 0:
+        print("No GPS data to map", file=sys.stderr)
+        sys.exit(1)
+    # Size the output image to fit the shape of the track
+    with meter.stage('extent_calc'):
+        mapinfo = calc_mapinfo(tlocs.lat, tlocs.lng, tlocs.lat, tlocs.lng)
+
+    try:
+        interp_tlocs = interpolate_timelocations(fetcher, tlocs, args.interpolation, tz, meter)
+    except DirectionsCacheMiss as e:
+        print(f"--offline: {e}", file=sys.stderr)
+        sys.exit(1)
+    if cache is not None:
+        cache.evict()
+        cache.close()
+
+    if args.track_out:
+        writer = gpsbin.GpsBinWriter()
+        writer.add_track(interp_tlocs)
+        with open(args.track_out, 'wb') as f:
+            writer.write(f)
+
+    with meter.stage('day_split'):
+        orig_day_tlocs = bin_by_day(tlocs, tz)
+        day_tlocs = bin_by_day(interp_tlocs, tz)
+    meter.add('day_split', 'items', len(day_tlocs))
+
+    output_name = args.output
     nameonly = '.'.join(output_name.split('.')[:-1])
     extnonly = output_name.split('.')[-1]
 
+    # Each output image is an independent job, carrying only the points to
+    # draw, so the maps can be rendered by a pool of worker processes.
+    overview_job = {
+        'filename': output_name,
+        'dimensions': mapinfo['dimensions'],
+        'layers': list(),
+        'tolerance': args.simplify_tolerance,
+        'timezone': tz,
+        'tile_url': args.tile_url,
+        'tile_cache': args.tile_cache,
+        'profile_dir': args.profile,
+    }
+    jobs = list()
     for day, dtlocs in day_tlocs.items():
         color = color_hash(day)
-        orig_dtlocs = orig_day_tlocs.get(day, list())
-
-        tmp_daymap = staticmap.StaticMap(*calc_output_dimensions(aspect_ratio))
-        draw_tlocs(tmp_daymap, dtlocs, dtlocs)
-        mapinfo = calc_mapinfo(tmp_daymap)
-        aspect_ratio = mapinfo['feature_width'] / mapinfo['feature_height']
-        daymap = staticmap.StaticMap(*calc_output_dimensions(aspect_ratio))
-
-        draw_tlocs(daymap, dtlocs, orig_dtlocs, linecolor=color, markercolor=color)
-        draw_tlocs(m, dtlocs, orig_dtlocs, linecolor=color, markercolor=color)
-
-        dayfname = f"{nameonly}_{day}.{extnonly}"
-        print(f"Rendering {dayfname}")
-        image = daymap.render()
-        image.save(dayfname)
-
-    print(f"Rendering {output_name}")
-    image = m.render()
-    image.save(output_name)
+        orig_dtlocs = orig_day_tlocs.get(day, TrackArray())
+        layer = (dtlocs, orig_dtlocs, color)
+        overview_job['layers'].append(layer)
+
+        with meter.stage('extent_calc'):
+            day_mapinfo = calc_mapinfo(dtlocs.lat, dtlocs.lng, orig_dtlocs.lat, orig_dtlocs.lng)
+        jobs.append({
+            'filename': f"{nameonly}_{day}.{extnonly}",
+            'dimensions': day_mapinfo['dimensions'],
+            'layers': [layer],
+            'tolerance': args.simplify_tolerance,
+            'timezone': tz,
+            'tile_url': args.tile_url,
+            'tile_cache': args.tile_cache,
+            'profile_dir': args.profile,
+        })
+    # The overview has the most to draw, so start it first
+    jobs.insert(0, overview_job)
+
+    # Skip maps drawn from exactly the same inputs last time. The overview
+    # covers every day, so it's only redrawn if some day changed.
+    manifest = RenderManifest(f"{nameonly}.manifest.json")
+    with meter.stage('manifest'):
+        digests = {job['filename']: job_digest(job) for job in jobs}
+    if not args.force:
+        jobs = [job for job in jobs if not manifest.is_current(job['filename'], digests[job['filename']])]
+    skipped = len(digests) - len(jobs)
+    if skipped:
+        print(f"Skipping {skipped} unchanged maps")
+
+    workers = args.jobs if args.jobs > 0 else os.cpu_count()
+    try:
+        if workers <= 1 or len(jobs) <= 1:
+            for job in jobs:
+                print(f"Rendering {job['filename']}")
+                _, stages = render_job(job)
+                meter.merge(stages)
+                manifest.record(job['filename'], digests[job['filename']])
+        else:
+            with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+                for fname, stages in pool.imap_unordered(render_job, jobs):
+                    print(f"Rendered {fname}")
+                    meter.merge(stages)
+                    manifest.record(fname, digests[fname])
+    finally:
+        manifest.save()
+
+    if args.tile_cache and args.tile_cache_mb:
+        TileCache(args.tile_cache, max_bytes=args.tile_cache_mb * 1024 * 1024).evict()
+    meter.finish(args.metrics_out)
 
 
 if __name__ == '__main__': main()
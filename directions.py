@@ -0,0 +1,293 @@
+'''
+directions.py fetches road-following routes between pairs of coordinates from
+the Google Maps directions API, and keeps a persistent cache of them so that
+re-rendering a trip doesn't repeat requests whose answers we already have.
+'''
+import concurrent.futures
+import threading
+import sqlite3
+import random
+import time
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+import polyline
+
+Coord = Tuple[float, float]
+
+
+def decode_polyline(point_str) -> List[Coord]:
+    '''Decodes a polyline that has been encoded using Google's algorithm
+    http://code.google.com/apis/maps/documentation/polylinealgorithm.html
+
+    This is a generic method that returns a list of (latitude, longitude)
+    tuples. Points repeating the previous point are dropped.
+
+    :param point_str: Encoded polyline string.
+    :type point_str: string
+    :returns: List of 2-tuples where each tuple is (latitude, longitude)
+    :rtype: list
+    '''
+    return polyline.pairs(polyline.decode(point_str, skip_repeats=True))
+
+
+def flatten_routes_points(directionsresponse) -> List[Coord]:
+    '''Accepts a `directionsresponse`, which is the response from calling the
+    Google Maps `directions()` API. Returns a list of tuples, where each tuple
+    is a lat-lng pair. '''
+    flatpoints: List[Coord] = list()
+    for route in directionsresponse:
+        directionslegs = route['legs']
+        for leg in directionslegs:
+            directionssteps = leg['steps']
+            for step in directionssteps:
+                flatpoints += decode_polyline(step['polyline']['points'])
+    return flatpoints
+
+
+class DirectionsCacheMiss(LookupError):
+    '''Raised in offline mode when a route isn't in the directions cache.'''
+
+
+def quantize(coord, places=5) -> str:
+    '''Rounds a (lat, lng) coordinate to `places` decimal places (5 places is
+    about a meter) and returns it as a string usable as a cache key.'''
+    return f"{float(coord[0]):.{places}f},{float(coord[1]):.{places}f}"
+
+
+class DirectionsCache:
+    '''A persistent SQLite cache of flattened directions routes, keyed on the
+    quantized origin, destination and travel mode. Routes are stored as
+    encoded polylines, so points are kept to 5 decimal places, the same
+    precision the directions API returns them in. Entries older than `ttl`
+    seconds are treated as missing, and `evict()` trims the cache down to the
+    `max_entries` most recently used routes.'''
+    def __init__(self, path, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            '''CREATE TABLE IF NOT EXISTS route_polylines (
+                origin TEXT,
+                destination TEXT,
+                mode TEXT,
+                polyline TEXT,
+                created REAL,
+                last_used REAL,
+                PRIMARY KEY (origin, destination, mode)
+            )'''
+        )
+        self.db.commit()
+
+    def get(self, origin, destination, mode) -> Optional[List[Coord]]:
+        key = (quantize(origin), quantize(destination), mode)
+        found = self.db.execute(
+            '''SELECT polyline, created FROM route_polylines
+                WHERE origin = ? AND destination = ? AND mode = ?''', key
+        ).fetchone()
+        now = time.time()
+        if found is None or (self.ttl is not None and found[1] < now - self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute(
+            '''UPDATE route_polylines SET last_used = ?
+                WHERE origin = ? AND destination = ? AND mode = ?''', (now, ) + key
+        )
+        return polyline.pairs(polyline.decode(found[0]))
+
+    def put(self, origin, destination, mode, points: List[Coord]):
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO route_polylines VALUES (?, ?, ?, ?, ?, ?)',
+            (quantize(origin), quantize(destination), mode, polyline.encode(points), now, now),
+        )
+        self.db.commit()
+
+    def evict(self) -> int:
+        '''Deletes expired entries, then the least recently used entries
+        beyond `max_entries`. Returns the number of entries deleted.'''
+        deleted = 0
+        if self.ttl is not None:
+            deleted += self.db.execute(
+                'DELETE FROM route_polylines WHERE created < ?', (time.time() - self.ttl, )
+            ).rowcount
+        if self.max_entries is not None:
+            deleted += self.db.execute(
+                '''DELETE FROM route_polylines WHERE rowid NOT IN (
+                    SELECT rowid FROM route_polylines ORDER BY last_used DESC LIMIT ?
+                )''', (self.max_entries, )
+            ).rowcount
+        self.db.commit()
+        return deleted
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def batch_stops(legs: Sequence[Tuple[Coord, Coord]]) -> Tuple[List[Coord], List[int]]:
+    '''Returns the stops of a single route visiting every leg of `legs` in
+    order, and the index of each of `legs` among the route's legs.'''
+    stops: List[Coord] = list()
+    wanted: List[int] = list()
+    for origin, destination in legs:
+        if not stops or quantize(stops[-1]) != quantize(origin):
+            stops.append(origin)
+        wanted.append(len(stops) - 1)
+        stops.append(destination)
+    return stops, wanted
+
+
+class RateLimiter:
+    '''Spaces out calls to `wait()` across all threads so that no more than
+    `rate` of them return per second.'''
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# API statuses which won't change by asking again
+PERMANENT_STATUSES = {'INVALID_REQUEST', 'NOT_FOUND', 'REQUEST_DENIED', 'ZERO_RESULTS'}
+
+
+class RouteFetcher:
+    '''Returns the road-following points between two coordinates, answering
+    from `cache` when possible and otherwise asking `client` (a
+    googlemaps.Client or anything with the same `directions()` method). With
+    `offline` set, cache misses raise DirectionsCacheMiss instead.
+
+    `fetch_legs()` fetches many routes at once using up to `workers` threads,
+    starting no more than `rate` requests per second and retrying failed
+    requests up to `retries` times with exponential backoff. With
+    `max_waypoints` above zero, legs are batched into requests with up to
+    that many intermediate waypoints (Google allows 25).'''
+    def __init__(
+        self,
+        client=None,
+        cache: DirectionsCache = None,
+        mode='bicycling',
+        offline=False,
+        workers=8,
+        rate: Optional[float] = 10,
+        retries=3,
+        backoff=1.0,
+        max_waypoints=0,
+    ):
+        self.client = client
+        self.cache = cache
+        self.mode = mode
+        self.offline = offline
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_waypoints = max_waypoints
+        self.requests = 0
+        # Counts requests made from the fetch_legs() worker threads
+        self.requests_lock = threading.Lock()
+
+    def _call(self, origin, destination, **kwargs):
+        '''Asks the client for directions, retrying transient failures. Safe
+        to call from several threads at once; never touches the cache.'''
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            with self.requests_lock:
+                self.requests += 1
+            try:
+                return self.client.directions(origin, destination, mode=self.mode, **kwargs)
+            except Exception as e:
+                if attempt == self.retries or getattr(e, 'status', None) in PERMANENT_STATUSES:
+                    raise
+                time.sleep(self.backoff * (2**attempt) * random.uniform(0.5, 1.5))
+
+    def _request(self, origin, destination) -> List[Coord]:
+        return flatten_routes_points(self._call(origin, destination))
+
+    def _request_batch(self, legs: Sequence[Tuple[Coord, Coord]]) -> List[List[Coord]]:
+        '''Fetches `legs` with a single request, passing the stops between
+        the first origin and the last destination as waypoints, and splits the
+        response back into per-leg points. Where a leg doesn't start where the
+        previous one ended, the gap is routed as an extra leg whose points are
+        discarded. Falls back to one request per leg if the batched request is
+        refused.'''
+        if len(legs) == 1:
+            return [self._request(*legs[0])]
+        stops, wanted = batch_stops(legs)
+        try:
+            directions = self._call(stops[0], stops[-1], waypoints=stops[1:-1])
+        except Exception as e:
+            if getattr(e, 'status', None) not in PERMANENT_STATUSES:
+                raise
+            return [self._request(*leg) for leg in legs]
+        routelegs = directions[0]['legs'] if directions else []
+        if len(routelegs) != len(stops) - 1:
+            return [self._request(*leg) for leg in legs]
+        return [flatten_routes_points([{'legs': [routelegs[ridx]]}]) for ridx in wanted]
+
+    def _batches(self, idxs: List[int], legs, batch_keys) -> List[List[int]]:
+        '''Groups the leg indices `idxs` into runs sharing a batch key, each
+        with few enough stops to fit in one request.'''
+        batches: List[List[int]] = list()
+        for idx in idxs:
+            if batches and self.max_waypoints > 0:
+                batch = batches[-1]
+                same_key = batch_keys is None or batch_keys[batch[-1]] == batch_keys[idx]
+                stops, _ = batch_stops([legs[i] for i in batch + [idx]])
+                if same_key and len(stops) - 2 <= self.max_waypoints:
+                    batch.append(idx)
+                    continue
+            batches.append([idx])
+        return batches
+
+    def fetch_legs(
+        self,
+        legs: Sequence[Tuple[Coord, Coord]],
+        batch_keys: Optional[Sequence[Any]] = None,
+    ) -> List[List[Coord]]:
+        '''Returns the route points for each (origin, destination) pair in
+        `legs`, in the same order. Cached routes are looked up first and the
+        rest are requested concurrently. If `max_waypoints` is set, runs of
+        legs with equal `batch_keys` (e.g. the same day) are requested
+        together as one route with waypoints.'''
+        results: List[Optional[List[Coord]]] = [None] * len(legs)
+        if self.cache is not None:
+            for idx, (origin, destination) in enumerate(legs):
+                results[idx] = self.cache.get(origin, destination, self.mode)
+        missing = [idx for idx, points in enumerate(results) if points is None]
+        if not missing:
+            return results
+        if self.offline or self.client is None:
+            origin, destination = legs[missing[0]]
+            raise DirectionsCacheMiss(
+                f"no cached {self.mode} route from {origin} to {destination}"
+            )
+
+        batches = self._batches(missing, legs, batch_keys)
+        print(f"Getting directions for {len(missing)} of {len(legs)} legs in {len(batches)} requests")
+        with concurrent.futures.ThreadPoolExecutor(max(1, self.workers)) as pool:
+            futures = {
+                pool.submit(self._request_batch, [legs[idx] for idx in batch]): batch
+                for batch in batches
+            }
+            for future in concurrent.futures.as_completed(futures):
+                for idx, points in zip(futures[future], future.result()):
+                    results[idx] = points
+                    # The cache's sqlite connection belongs to this thread, so
+                    # results are stored here rather than by the workers.
+                    if self.cache is not None:
+                        self.cache.put(*legs[idx], self.mode, points)
+        return results
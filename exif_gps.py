@@ -3,22 +3,501 @@
 References:
     https://exiftool.org/TagNames/EXIF.html
     https://exiftool.org/TagNames/GPS.html
+    https://exiftool.org/TagNames/QuickTime.html
+    ISO/IEC 14496-12 (ISO base media file format) and ISO/IEC 23008-12 (HEIF)
 '''
+import multiprocessing
+import functools
 import datetime
 import argparse
+import hashlib
+import sqlite3
 import json
+import struct
 import csv
+import re
 import sys
+import os
 
-from PIL import Image, ExifTags
-from PIL.JpegImagePlugin import JpegImageFile
+from typing import NamedTuple, Optional, BinaryIO, Dict, Any, Tuple
+
+# Pillow is only needed as a fallback for files the built-in JPEG reader below
+# can't handle (PNG, WebP, unusual JPEG layouts, ...).
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import metrics
+import gpsbin
+
+# Tag number of the pointer from IFD0 to the GPS IFD
+GPSKEY = 0x8825
+
+GPSTAGS = {
+    0: 'GPSVersionID',
+    1: 'GPSLatitudeRef',
+    2: 'GPSLatitude',
+    3: 'GPSLongitudeRef',
+    4: 'GPSLongitude',
+    5: 'GPSAltitudeRef',
+    6: 'GPSAltitude',
+    7: 'GPSTimeStamp',
+    8: 'GPSSatellites',
+    9: 'GPSStatus',
+    10: 'GPSMeasureMode',
+    11: 'GPSDOP',
+    12: 'GPSSpeedRef',
+    13: 'GPSSpeed',
+    14: 'GPSTrackRef',
+    15: 'GPSTrack',
+    16: 'GPSImgDirectionRef',
+    17: 'GPSImgDirection',
+    18: 'GPSMapDatum',
+    19: 'GPSDestLatitudeRef',
+    20: 'GPSDestLatitude',
+    21: 'GPSDestLongitudeRef',
+    22: 'GPSDestLongitude',
+    23: 'GPSDestBearingRef',
+    24: 'GPSDestBearing',
+    25: 'GPSDestDistanceRef',
+    26: 'GPSDestDistance',
+    27: 'GPSProcessingMethod',
+    28: 'GPSAreaInformation',
+    29: 'GPSDateStamp',
+    30: 'GPSDifferential',
+    31: 'GPSHPositioningError',
+}
+
+
+class ExifFormatError(ValueError):
+    '''Raised when the built-in reader can't make sense of a file, meaning it
+    should be handed to Pillow instead.'''
+
+
+class Rational(NamedTuple):
+    '''A TIFF RATIONAL. Like Pillow's IFDRational, the numerator and
+    denominator are kept exactly as stored so `dilution_of_precision` is
+    written the same way regardless of which reader produced it.'''
+    numerator: int
+    denominator: int
+
+    def __float__(self):
+        if self.denominator == 0:
+            return float('nan')
+        return self.numerator / self.denominator
+
+    def __int__(self):
+        return int(float(self))
+
+
+# TIFF field type -> (struct format character, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1),  # BYTE
+    2: ('s', 1),  # ASCII
+    3: ('H', 2),  # SHORT
+    4: ('L', 4),  # LONG
+    5: ('L', 8),  # RATIONAL, two LONGs
+    6: ('b', 1),  # SBYTE
+    7: ('s', 1),  # UNDEFINED
+    8: ('h', 2),  # SSHORT
+    9: ('l', 4),  # SLONG
+    10: ('l', 8),  # SRATIONAL, two SLONGs
+}
+
+
+def read_tiff_ifd(tiff: bytes, offset: int, byteorder: str):
+    '''Reads the IFD at `offset` within the TIFF blob `tiff`, returning a dict
+    of tag number to decoded value. Single values are returned bare, multiple
+    values as a tuple, ASCII as a str and UNDEFINED as bytes.'''
+    try:
+        count, = struct.unpack_from(byteorder + 'H', tiff, offset)
+        ifd = dict()
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, typ, n = struct.unpack_from(byteorder + 'HHL', tiff, entry)
+            if typ not in TIFF_TYPES:
+                continue
+            fmt, size = TIFF_TYPES[typ]
+            valoff = entry + 8
+            if size * n > 4:
+                valoff, = struct.unpack_from(byteorder + 'L', tiff, valoff)
+            if valoff + size * n > len(tiff):
+                raise ExifFormatError(f"tag {tag} points outside of the EXIF segment")
+            if fmt == 's':
+                raw = tiff[valoff:valoff + n]
+                ifd[tag] = raw.rstrip(b'\0').decode('ascii', 'replace') if typ == 2 else raw
+                continue
+            if n == 0:
+                # No values to decode
+                continue
+            if typ in (5, 10):
+                parts = struct.unpack_from(f"{byteorder}{2 * n}{fmt}", tiff, valoff)
+                values = tuple(Rational(parts[j], parts[j + 1]) for j in range(0, len(parts), 2))
+            else:
+                values = struct.unpack_from(f"{byteorder}{n}{fmt}", tiff, valoff)
+            ifd[tag] = values[0] if n == 1 else values
+        return ifd
+    except struct.error as e:
+        raise ExifFormatError(f"truncated IFD: {e}")
+
+
+def read_jpeg_app1_exif(f: BinaryIO) -> Optional[bytes]:
+    '''Walks the JPEG marker segments of `f` and returns the TIFF blob from
+    the APP1 "Exif" segment, or None if the file has no EXIF. Only segment
+    headers are read until the EXIF segment is found; all other segments are
+    skipped with seek() and scanning stops at the start of the image data.'''
+    if f.read(2) != b'\xff\xd8':
+        raise ExifFormatError('not a JPEG file')
+    while True:
+        header = f.read(4)
+        if len(header) < 2 or header[0] != 0xFF:
+            raise ExifFormatError('malformed JPEG marker')
+        marker = header[1]
+        # Markers may be preceded by any number of 0xFF fill bytes
+        while marker == 0xFF:
+            header = header[1:] + f.read(1)
+            if len(header) < 2:
+                raise ExifFormatError('truncated JPEG marker')
+            marker = header[1]
+        # SOS (start of scan) and EOI mean we're past all the metadata
+        if marker in (0xDA, 0xD9):
+            return None
+        if len(header) < 4:
+            raise ExifFormatError('truncated JPEG segment')
+        length, = struct.unpack('>H', header[2:4])
+        if length < 2:
+            raise ExifFormatError(f"bad length for JPEG segment {marker:#04x}")
+        if marker == 0xE1:
+            payload = f.read(length - 2)
+            if payload.startswith(b'Exif\0\0'):
+                return payload[6:]
+            # Some other APP1 segment, such as XMP
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def parse_tiff_gps(tiff: bytes):
+    '''Returns the raw GPS IFD (tag number to value) of the EXIF TIFF blob
+    `tiff`, or an empty dict if there is no GPS IFD.'''
+    if tiff[:2] == b'II':
+        byteorder = '<'
+    elif tiff[:2] == b'MM':
+        byteorder = '>'
+    else:
+        raise ExifFormatError('bad TIFF byte order marker')
+    if len(tiff) < 8:
+        raise ExifFormatError('truncated TIFF header')
+    magic, ifd0_offset = struct.unpack_from(byteorder + 'HL', tiff, 2)
+    if magic != 42:
+        raise ExifFormatError('bad TIFF magic number')
+    ifd0 = read_tiff_ifd(tiff, ifd0_offset, byteorder)
+    if GPSKEY not in ifd0:
+        return dict()
+    return read_tiff_ifd(tiff, ifd0[GPSKEY], byteorder)
+
+
+def read_rawgps_builtin(filename):
+    '''Reads the raw GPS IFD of a JPEG without decoding the image. Raises
+    ExifFormatError if the file isn't something this reader understands.'''
+    with open(filename, 'rb') as f:
+        tiff = read_jpeg_app1_exif(f)
+    if tiff is None:
+        return dict()
+    return parse_tiff_gps(tiff)
+
+
+def read_rawgps_pillow(filename):
+    '''Reads the raw GPS IFD of any image format Pillow supports.'''
+    with open(filename, 'rb') as imgf:
+        image = Image.open(imgf)
+        # In order to get _all_ the EXIF data, we have to call the protected
+        # `_get_merged_dict()` method, otherwise GPS EXIF isn't included
+        rawexif = image.getexif()._get_merged_dict()
+    return rawexif.get(GPSKEY, dict())
+
+
+def iter_boxes(f: BinaryIO, start: int, end: int):
+    '''Yields (boxtype, payload_start, payload_end) for each ISO-BMFF box
+    between the file offsets `start` and `end`. Only the box headers are read;
+    payloads are skipped with seek(), so the media data of even multi-GB video
+    files is never read.'''
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, boxtype = struct.unpack('>L4s', header)
+        hdrlen = 8
+        if size == 1:
+            size, = struct.unpack('>Q', read_at(f, pos + 8, 8))
+            hdrlen = 16
+        elif size == 0:
+            # Box extends to the end of its container
+            size = end - pos
+        if size < hdrlen:
+            raise ExifFormatError(f"bad size for {boxtype!r} box at offset {pos}")
+        yield boxtype, pos + hdrlen, min(pos + size, end)
+        pos += size
+
+
+def find_box(f: BinaryIO, start: int, end: int, boxtype: bytes):
+    '''Returns (payload_start, payload_end) of the first box of `boxtype`
+    between `start` and `end`, or None.'''
+    for bt, bstart, bend in iter_boxes(f, start, end):
+        if bt == boxtype:
+            return bstart, bend
+    return None
+
+
+def read_at(f: BinaryIO, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    data = f.read(length)
+    if len(data) < length:
+        raise ExifFormatError('unexpected end of file')
+    return data
+
+
+def read_uint(data: bytes, offset: int, size: int) -> int:
+    '''Reads a big-endian unsigned int of `size` bytes (0 reads as 0).'''
+    return int.from_bytes(data[offset:offset + size], 'big')
+
+
+def meta_children_start(f: BinaryIO, start: int) -> int:
+    '''ISO `meta` boxes are FullBoxes (4 bytes of version/flags before the
+    children) but QuickTime `meta` boxes are not. Tell them apart by checking
+    whether a `hdlr` box follows directly.'''
+    if read_at(f, start, 8)[4:8] == b'hdlr':
+        return start
+    return start + 4
+
+
+# Largest EXIF item we're willing to read out of a HEIF file
+MAX_HEIF_EXIF_LENGTH = 1 << 20
+
+
+def read_heif_exif(f: BinaryIO) -> Optional[bytes]:
+    '''Returns the TIFF blob of the `Exif` item of a HEIF/HEIC file, found via
+    the meta/iinf item table and the meta/iloc item locations, or None if the
+    file has no Exif item.'''
+    f.seek(0, os.SEEK_END)
+    filesize = f.tell()
+    meta = find_box(f, 0, filesize, b'meta')
+    if meta is None:
+        raise ExifFormatError('no meta box')
+    children = dict()
+    for bt, bstart, bend in iter_boxes(f, meta_children_start(f, meta[0]), meta[1]):
+        children.setdefault(bt, (bstart, bend))
+    if b'iinf' not in children or b'iloc' not in children:
+        raise ExifFormatError('meta box is missing iinf or iloc')
+
+    # iinf: find the item ID of the Exif item
+    istart, iend = children[b'iinf']
+    version = read_at(f, istart, 1)[0]
+    entries_start = istart + (6 if version == 0 else 8)
+    exif_id = None
+    for bt, bstart, bend in iter_boxes(f, entries_start, iend):
+        if bt != b'infe':
+            continue
+        infe = read_at(f, bstart, min(bend - bstart, 16))
+        if infe[0] < 2:
+            continue
+        idsize = 2 if infe[0] == 2 else 4
+        item_id = read_uint(infe, 4, idsize)
+        item_type = infe[4 + idsize + 2:4 + idsize + 6]
+        if item_type == b'Exif':
+            exif_id = item_id
+            break
+    if exif_id is None:
+        return None
+
+    # iloc: find where the Exif item's bytes live
+    lstart, lend = children[b'iloc']
+    iloc = read_at(f, lstart, lend - lstart)
+    version = iloc[0]
+    offset_size, length_size = iloc[4] >> 4, iloc[4] & 0xF
+    base_offset_size, index_size = iloc[5] >> 4, iloc[5] & 0xF
+    if version < 1:
+        index_size = 0
+    pos = 6
+    idsize = 4 if version == 2 else 2
+    item_count = read_uint(iloc, pos, idsize)
+    pos += idsize
+    for _ in range(item_count):
+        item_id = read_uint(iloc, pos, idsize)
+        pos += idsize
+        construction_method = 0
+        if version in (1, 2):
+            construction_method = read_uint(iloc, pos, 2) & 0xF
+            pos += 2
+        pos += 2  # data_reference_index
+        base_offset = read_uint(iloc, pos, base_offset_size)
+        pos += base_offset_size
+        extent_count = read_uint(iloc, pos, 2)
+        pos += 2
+        extents = list()
+        for _ in range(extent_count):
+            pos += index_size
+            extent_offset = read_uint(iloc, pos, offset_size)
+            pos += offset_size
+            extent_length = read_uint(iloc, pos, length_size)
+            pos += length_size
+            extents.append((base_offset + extent_offset, extent_length))
+        # read_uint() reads past the end as zeros, so a corrupt item or
+        # extent count would otherwise loop on until it ran out
+        if pos > len(iloc):
+            raise ExifFormatError('truncated iloc box')
+        if item_id != exif_id:
+            continue
+        if construction_method == 1:
+            if b'idat' not in children:
+                raise ExifFormatError('Exif item refers to a missing idat box')
+            origin = children[b'idat'][0]
+        elif construction_method == 0:
+            origin = 0
+        else:
+            raise ExifFormatError(f"unsupported iloc construction method {construction_method}")
+        if sum(length for _, length in extents) > MAX_HEIF_EXIF_LENGTH:
+            raise ExifFormatError('Exif item is implausibly large')
+        data = b''.join(read_at(f, origin + offset, length) for offset, length in extents)
+        # The item starts with the offset from the end of this field to the
+        # TIFF header; the gap usually holds an "Exif\0\0" marker.
+        tiff_offset = read_uint(data, 0, 4)
+        return data[4 + tiff_offset:]
+    raise ExifFormatError('Exif item has no location')
+
+
+def read_rawgps_heif(filename):
+    '''Reads the raw GPS IFD of a HEIF/HEIC image.'''
+    with open(filename, 'rb') as f:
+        tiff = read_heif_exif(f)
+    if tiff is None:
+        return dict()
+    return parse_tiff_gps(tiff)
+
+
+ISO6709_RE = re.compile(r'([+-][0-9.]+)([+-][0-9.]+)')
+
+
+def parse_iso6709(s: str) -> Tuple[float, float]:
+    '''Parses the latitude and longitude of an ISO 6709 string such as
+    "+47.6062-122.3321+050.000/" into decimal degrees. The degrees-minutes and
+    degrees-minutes-seconds forms ("+4736.37-12219.93/") are also accepted.'''
+    match = ISO6709_RE.match(s.strip())
+    if match is None:
+        raise ExifFormatError(f"not an ISO 6709 location: {s!r}")
+
+    def to_dd(value: str, degree_digits: int) -> float:
+        sign = -1 if value[0] == '-' else 1
+        whole, _, frac = value[1:].partition('.')
+        frac = float('0.' + frac) if frac else 0.0
+        extra = len(whole) - degree_digits
+        if extra == 2:  # DDMM.MMM
+            dd = int(whole[:degree_digits]) + (int(whole[degree_digits:]) + frac) / 60
+        elif extra == 4:  # DDMMSS.SSS
+            minutes = int(whole[degree_digits:degree_digits + 2])
+            seconds = int(whole[degree_digits + 2:]) + frac
+            dd = int(whole[:degree_digits]) + minutes / 60 + seconds / 3600
+        else:
+            dd = int(whole) + frac
+        return sign * dd
+
+    return to_dd(match.group(1), 2), to_dd(match.group(2), 3)
+
+
+# Seconds between the QuickTime epoch (1904-01-01) and the Unix epoch
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+QUICKTIME_LOCATION_KEY = 'com.apple.quicktime.location.ISO6709'
+QUICKTIME_CREATIONDATE_KEY = 'com.apple.quicktime.creationdate'
+
+
+def read_quicktime_keys(f: BinaryIO, start: int, end: int) -> Dict[str, Any]:
+    '''Reads the QuickTime metadata (`keys` + `ilst`) of the `meta` box
+    between `start` and `end`, returning a dict of key name to string value.'''
+    children = dict()
+    for bt, bstart, bend in iter_boxes(f, meta_children_start(f, start), end):
+        children.setdefault(bt, (bstart, bend))
+    if b'keys' not in children or b'ilst' not in children:
+        return dict()
+    kstart, kend = children[b'keys']
+    keysdata = read_at(f, kstart, kend - kstart)
+    names = dict()
+    pos = 8
+    for idx in range(1, read_uint(keysdata, 4, 4) + 1):
+        keysize = read_uint(keysdata, pos, 4)
+        if keysize < 8:
+            break
+        names[idx] = keysdata[pos + 8:pos + keysize].decode('utf-8', 'replace')
+        pos += keysize
+
+    values = dict()
+    for bt, bstart, bend in iter_boxes(f, *children[b'ilst']):
+        name = names.get(int.from_bytes(bt, 'big'))
+        if name not in (QUICKTIME_LOCATION_KEY, QUICKTIME_CREATIONDATE_KEY):
+            continue
+        data = find_box(f, bstart, bend, b'data')
+        if data is None or data[1] - data[0] > 1024:
+            continue
+        # 4 bytes of type indicator and 4 bytes of locale precede the value
+        raw = read_at(f, data[0], data[1] - data[0])[8:]
+        values[name] = raw.decode('utf-8', 'replace')
+    return values
+
+
+def read_video_location(filename):
+    '''Returns (lat, lng, timestamp) for an MP4/MOV file from its moov box,
+    or None if it carries no location. The location comes from QuickTime
+    metadata or the `©xyz` user-data atom; the timestamp from the QuickTime
+    creation date (which includes a UTC offset) or the `mvhd` creation time.'''
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        moov = find_box(f, 0, f.tell(), b'moov')
+        if moov is None:
+            raise ExifFormatError('no moov box')
+        location = None
+        creationdate = None
+        created = None
+        for bt, bstart, bend in iter_boxes(f, *moov):
+            if bt == b'mvhd':
+                mvhd = read_at(f, bstart, 12)
+                if mvhd[0] == 1:
+                    created = read_uint(mvhd, 4, 8)
+                else:
+                    created = read_uint(mvhd, 4, 4)
+            elif bt == b'meta':
+                keys = read_quicktime_keys(f, bstart, bend)
+                location = keys.get(QUICKTIME_LOCATION_KEY, location)
+                creationdate = keys.get(QUICKTIME_CREATIONDATE_KEY)
+            elif bt == b'udta' and location is None:
+                xyz = find_box(f, bstart, bend, b'\xa9xyz')
+                if xyz is not None and xyz[1] - xyz[0] <= 256:
+                    raw = read_at(f, xyz[0], xyz[1] - xyz[0])
+                    # 2 bytes of string length and 2 bytes of language code
+                    location = raw[4:4 + read_uint(raw, 0, 2)].decode('ascii', 'replace')
+    if location is None:
+        return None
+    lat, lng = parse_iso6709(location)
+    if creationdate:
+        try:
+            timestamp = datetime.datetime.strptime(creationdate.strip(), '%Y-%m-%dT%H:%M:%S%z')
+        except ValueError:
+            raise ExifFormatError(f"bad creation date {creationdate!r}")
+    elif created:
+        timestamp = datetime.datetime.fromtimestamp(
+            created - QUICKTIME_EPOCH_OFFSET, tz=datetime.timezone.utc
+        )
+    else:
+        return None
+    return lat, lng, timestamp
 
 
 def parse_gps(rawgpsdict):
     gpsdict = dict()
     for rk, rv in rawgpsdict.items():
-        if rk in ExifTags.GPSTAGS:
-            k = ExifTags.GPSTAGS[rk]
+        if rk in GPSTAGS:
+            k = GPSTAGS[rk]
             gpsdict[k] = rv
     return gpsdict
 
@@ -52,6 +531,14 @@ def extract_gps_timestamp_utc(gpsdict):
     )
 
 
+def timestamp_sort_key(row):
+    '''Orders rows by timestamp, with rows which have no timestamp (because
+    of an error) first.'''
+    if row['timestamp_utc'] == '':
+        return (0, 0)
+    return (1, row['timestamp_utc'])
+
+
 def printrow_json(row):
     print(json.dumps(row, sort_keys=True))
 
@@ -60,17 +547,269 @@ def printrow_csv(dictwriter: csv.DictWriter, row):
     dictwriter.writerow(row)
 
 
+class ExtractionCache:
+    '''A sidecar SQLite cache of extracted rows, keyed on the identity of the
+    file they came from: its absolute path, size and mtime, plus a SHA-256 of
+    the contents if `hash_contents` is set. Files whose identity hasn't changed
+    since they were cached are never opened by `get()` (unless hashing).'''
+
+    # Bump this whenever extract_row() would produce different rows for the
+    # same file, so stale rows from an older extractor aren't reused.
+    VERSION = 2
+    FIELDS = ['latitude', 'longitude', 'timestamp_utc', 'dilution_of_precision', 'error']
+
+    def __init__(self, path, hash_contents=False):
+        self.hash_contents = hash_contents
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute(
+            '''CREATE TABLE IF NOT EXISTS rows (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                digest TEXT,
+                row TEXT
+            )'''
+        )
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != self.VERSION:
+            self.db.execute('DELETE FROM rows')
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(self.VERSION), )
+            )
+        self.db.commit()
+
+    def _identity(self, filename):
+        st = os.stat(filename)
+        digest = ''
+        if self.hash_contents:
+            h = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+        return os.path.abspath(filename), st.st_size, st.st_mtime_ns, digest
+
+    def get(self, filename) -> Optional[Dict[str, Any]]:
+        '''Returns the cached row for `filename`, or None if it isn't cached
+        or the file has changed since it was.'''
+        path, size, mtime_ns, digest = self._identity(filename)
+        found = self.db.execute(
+            'SELECT size, mtime_ns, digest, row FROM rows WHERE path = ?', (path, )
+        ).fetchone()
+        if found is None or tuple(found[:3]) != (size, mtime_ns, digest):
+            self.misses += 1
+            return None
+        self.hits += 1
+        row = json.loads(found[3])
+        row['filename'] = filename
+        return row
+
+    def put(self, row):
+        path, size, mtime_ns, digest = self._identity(row['filename'])
+        stored = json.dumps({k: row[k] for k in self.FIELDS}, sort_keys=True)
+        self.db.execute(
+            'INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)',
+            (path, size, mtime_ns, digest, stored),
+        )
+        self._pending += 1
+        if self._pending >= 500:
+            self.commit()
+
+    def prune(self) -> int:
+        '''Deletes entries for files that no longer exist or whose size or
+        mtime have changed. Returns the number of entries deleted.'''
+        stale = list()
+        for path, size, mtime_ns in self.db.execute('SELECT path, size, mtime_ns FROM rows'):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                stale.append((path, ))
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                stale.append((path, ))
+        self.db.executemany('DELETE FROM rows WHERE path = ?', stale)
+        self.commit()
+        return len(stale)
+
+    def commit(self):
+        self.db.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+VIDEO_EXTENSIONS = ['mp4', 'mov', 'm4v', '3gp']
+HEIF_EXTENSIONS = ['heic', 'heif']
+
+
+def extract_row(filename, use_pillow=False):
+    '''Returns the GPS row for a single image file. This is the unit of work
+    handed to worker processes, so it takes a filename rather than an open
+    file and returns a plain dict.'''
+    row = {
+        'latitude': '',
+        'longitude': '',
+        'timestamp_utc': '',
+        'dilution_of_precision': '',
+        'filename': filename,
+        'error': 'GPS data is not present'
+    }
+    extension = filename.split('.')[-1].lower()
+    if extension in VIDEO_EXTENSIONS:
+        try:
+            found = read_video_location(filename)
+        except ExifFormatError as e:
+            row['error'] = f"Could not read video metadata: {e}"
+            return row
+        if found is not None:
+            lat, lng, timestamp = found
+            row.update({
+                'latitude': round(lat, 6),
+                'longitude': round(lng, 6),
+                'timestamp_utc': int(timestamp.timestamp()),
+                'dilution_of_precision': '23000/1000',
+                'error': '',
+            })
+        return row
+
+    if extension in HEIF_EXTENSIONS:
+        try:
+            rawgps = read_rawgps_heif(filename)
+        except ExifFormatError as e:
+            row['error'] = f"Could not read HEIF metadata: {e}"
+            return row
+    elif use_pillow:
+        rawgps = read_rawgps_pillow(filename)
+    else:
+        try:
+            rawgps = read_rawgps_builtin(filename)
+        except ExifFormatError:
+            if Image is None:
+                raise
+            rawgps = read_rawgps_pillow(filename)
+    try:
+        if rawgps:
+            gpsdict = parse_gps(rawgps)
+            # print(f"{gpsdict=}")
+            lat, lng = convert_gps_dms_to_degreedecimal(gpsdict)
+            timestamp = extract_gps_timestamp_utc(gpsdict)
+            dopstr = '23000/1000'
+            if 'GPSDOP' in gpsdict:
+                dop = gpsdict['GPSDOP']
+                dopstr = f"{dop.numerator}/{dop.denominator}"
+            row = {
+                'latitude': round(lat, 6),
+                'longitude': round(lng, 6),
+                'timestamp_utc': int(timestamp.timestamp()),
+                'dilution_of_precision': dopstr,
+                'filename': filename,
+                'error': ''
+            }
+    except KeyError as ke:
+        pass
+    return row
+
+
+def extract_rows(filenames, jobs=1, ordered=True, use_pillow=False, cache=None):
+    '''Yields the GPS row for each filename. With `jobs` > 1 the files are
+    parsed by a pool of worker processes; rows are yielded in the order of
+    `filenames` unless `ordered` is False, in which case they are yielded as
+    soon as each file finishes. If an ExtractionCache is given, only files
+    missing from it are parsed, and their rows are added to it.'''
+    if cache is None:
+        yield from _extract_rows(filenames, jobs, ordered, use_pillow)
+        return
+    cached = [cache.get(fn) for fn in filenames]
+    missing = [fn for fn, row in zip(filenames, cached) if row is None]
+    fresh = _extract_rows(missing, jobs, ordered, use_pillow)
+    if ordered:
+        for row in cached:
+            if row is None:
+                row = next(fresh)
+                cache.put(row)
+            yield row
+        return
+    yield from (row for row in cached if row is not None)
+    for row in fresh:
+        cache.put(row)
+        yield row
+
+
+def _extract_rows(filenames, jobs, ordered, use_pillow):
+    extract = functools.partial(extract_row, use_pillow=use_pillow)
+    if jobs <= 1:
+        for fn in filenames:
+            yield extract(fn)
+        return
+    # Parsing a single image is cheap relative to the IPC round-trip, so hand
+    # the workers files in small batches.
+    chunksize = max(1, min(64, len(filenames) // (jobs * 4)))
+    with multiprocessing.Pool(jobs) as pool:
+        if ordered:
+            yield from pool.imap(extract, filenames, chunksize)
+        else:
+            yield from pool.imap_unordered(extract, filenames, chunksize)
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('imagefiles', type=argparse.FileType('rb'), nargs='*')
+    parser.add_argument('imagefiles', nargs='*')
     parser.add_argument(
         '--format',
         '-f',
-        choices=['JSON', 'CSV'],
+        choices=['JSON', 'CSV', 'GPSBIN'],
         default='JSON',
-        help='Format of GPS data written to stdout'
+        help='Format of GPS data written to stdout (GPSBIN is the binary format of gpsbin.py)'
+    )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=1,
+        help='Number of worker processes used to parse images (0 means one per CPU)'
+    )
+    parser.add_argument(
+        '--unordered',
+        action='store_true',
+        help='Write rows as soon as each image is parsed instead of in input order'
+    )
+    parser.add_argument(
+        '--sort',
+        action='store_true',
+        help='Write rows in timestamp order (rows with errors first), so create_maps.py can '
+        'merge them with other sorted inputs as they stream in'
+    )
+    parser.add_argument(
+        '--pillow',
+        action='store_true',
+        help='Always read EXIF through Pillow instead of the built-in JPEG reader'
+    )
+    parser.add_argument(
+        '--cache',
+        metavar='PATH',
+        help='SQLite file caching rows of previously parsed images, keyed on path, size and mtime'
+    )
+    parser.add_argument(
+        '--cache-hash',
+        action='store_true',
+        help='Also key the cache on a SHA-256 of each file\'s contents'
+    )
+    parser.add_argument(
+        '--prune-cache',
+        action='store_true',
+        help='Remove cache entries for files which have been deleted or modified'
     )
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    if args.pillow and Image is None:
+        parser.error('--pillow needs Pillow, which is not installed')
+    meter = metrics.from_args(args)
 
     printrow = None
     if args.format == 'JSON':
@@ -85,49 +824,48 @@ def main():
         )
         dictwriter.writeheader()
         printrow = lambda row: printrow_csv(dictwriter, row)
+    elif args.format == 'GPSBIN':
+        writer = gpsbin.GpsBinWriter()
+        printrow = writer.add
 
-    GPSKEY = [k for k, v in ExifTags.TAGS.items() if v == 'GPSInfo'][0]
-
-    for imgf in args.imagefiles:
-        row = {
-            'latitude': '',
-            'longitude': '',
-            'timestamp_utc': '',
-            'dilution_of_precision': '',
-            'filename': imgf.name,
-            'error': 'GPS data is not present'
-        }
-        extension = imgf.name.split('.')[-1]
-        if extension.lower() in ['mp4', 'mov', 'heic', 'heif']:
+    cache = None
+    if args.cache:
+        cache = ExtractionCache(args.cache, hash_contents=args.cache_hash)
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    # Rows are written as they're parsed, so this stage includes writing
+    # them (with --jobs above 1, only the main process is profiled)
+    with meter.stage('exif_parse'):
+        rows = extract_rows(
+            args.imagefiles,
+            jobs=jobs,
+            ordered=not args.unordered,
+            use_pillow=args.pillow,
+            cache=cache,
+        )
+        if args.sort:
+            # Holds every row until the last image has been parsed
+            rows = sorted(rows, key=timestamp_sort_key)
+        count = errors = 0
+        for row in rows:
+            count += 1
+            if row.get('error'):
+                errors += 1
             printrow(row)
-            continue
+    meter.add('exif_parse', 'items', count)
+    meter.add('exif_parse', 'errors', errors)
+    if args.format == 'GPSBIN':
+        with meter.stage('write'):
+            writer.write(sys.stdout.buffer)
 
-        image: JpegImageFile = Image.open(imgf)
-        # In order to get _all_ the EXIF data, we have to call the protected
-        # `_get_merged_dict()` method, otherwise GPS EXIF isn't included
-        rawexif = image.getexif()._get_merged_dict()
-        try:
-            if GPSKEY in rawexif:
-                gpsdict = parse_gps(rawexif[GPSKEY])
-                # print(f"{gpsdict=}")
-                # print({ExifTags.TAGS[k]: v for k, v in rawexif.items()})
-                lat, lng = convert_gps_dms_to_degreedecimal(gpsdict)
-                timestamp = extract_gps_timestamp_utc(gpsdict)
-                dopstr = '23000/1000'
-                if 'GPSDOP' in gpsdict:
-                    dop = gpsdict['GPSDOP']
-                    dopstr = f"{dop.numerator}/{dop.denominator}"
-                row = {
-                    'latitude': round(lat, 6),
-                    'longitude': round(lng, 6),
-                    'timestamp_utc': int(timestamp.timestamp()),
-                    'dilution_of_precision': dopstr,
-                    'filename': imgf.name,
-                    'error': ''
-                }
-        except KeyError as ke:
-            pass
-        printrow(row)
+    if cache is not None:
+        meter.add('exif_parse', 'cache_hits', cache.hits)
+        meter.add('exif_parse', 'cache_misses', cache.misses)
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+        if args.prune_cache:
+            print(f"Cache: pruned {cache.prune()} stale entries", file=sys.stderr)
+        cache.close()
+    meter.finish(args.metrics_out)
 
 
 if __name__ == '__main__':
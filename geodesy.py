@@ -0,0 +1,113 @@
+'''
+geodesy.py holds array versions of the distance and Web-Mercator projection
+math create_maps.py used to do point by point, for working on whole tracks
+at once. Every function takes sequences of coordinates and returns a NumPy
+array, or a list when NumPy isn't installed.
+'''
+import math
+
+from typing import Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Same earth radius as create_maps.py's original distance_on_unit_sphere
+EARTH_RADIUS_M = 6378100
+
+
+def consecutive_distances(lats: Sequence[float], lngs: Sequence[float]):
+    '''Returns the haversine distance in meters between each point and the
+    next, so the result is one shorter than the inputs.'''
+    if np is not None:
+        lat = np.radians(np.asarray(lats, dtype=float))
+        lng = np.radians(np.asarray(lngs, dtype=float))
+        dlat = np.diff(lat)
+        dlng = np.diff(lng)
+        a = np.sin(dlat / 2)**2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlng / 2)**2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    distances = list()
+    for idx in range(len(lats) - 1):
+        lat1, lat2 = math.radians(lats[idx]), math.radians(lats[idx + 1])
+        dlng = math.radians(lngs[idx + 1]) - math.radians(lngs[idx])
+        a = math.sin((lat2 - lat1) / 2)**2 + \
+            math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2)**2
+        distances.append(2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1, max(a, 0)))))
+    return distances
+
+
+def distances_from(lat: float, lng: float, lats: Sequence[float], lngs: Sequence[float]):
+    '''Returns the haversine distance in meters from (`lat`, `lng`) to each
+    of the points.'''
+    if np is not None:
+        lat2 = np.radians(np.asarray(lats, dtype=float))
+        dlng = np.radians(np.asarray(lngs, dtype=float)) - math.radians(lng)
+        lat1 = math.radians(lat)
+        a = np.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2)**2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    distances = list()
+    lat1 = math.radians(lat)
+    for other_lat, other_lng in zip(lats, lngs):
+        lat2 = math.radians(other_lat)
+        dlng = math.radians(other_lng) - math.radians(lng)
+        a = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2)**2
+        distances.append(2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1, max(a, 0)))))
+    return distances
+
+
+def lon_to_x(lngs: Sequence[float], zoom):
+    '''Transforms longitudes to (fractional) tile numbers.'''
+    if np is not None:
+        lng = np.asarray(lngs, dtype=float)
+        lng = np.where((lng < -180) | (lng > 180), (lng + 180) % 360 - 180, lng)
+        return ((lng + 180.) / 360) * 2**zoom
+    xs = list()
+    for lng in lngs:
+        if not (-180 <= lng <= 180):
+            lng = (lng + 180) % 360 - 180
+        xs.append(((lng + 180.) / 360) * 2**zoom)
+    return xs
+
+
+def lat_to_y(lats: Sequence[float], zoom):
+    '''Transforms latitudes to (fractional) tile numbers.'''
+    if np is not None:
+        lat = np.asarray(lats, dtype=float)
+        lat = np.where((lat < -90) | (lat > 90), (lat + 90) % 180 - 90, lat)
+        rad = np.radians(lat)
+        return (1 - np.log(np.tan(rad) + 1 / np.cos(rad)) / math.pi) / 2 * 2**zoom
+    ys = list()
+    for lat in lats:
+        if not (-90 <= lat <= 90):
+            lat = (lat + 90) % 180 - 90
+        rad = lat * math.pi / 180
+        ys.append((1 - math.log(math.tan(rad) + 1 / math.cos(rad)) / math.pi) / 2 * 2**zoom)
+    return ys
+
+
+def tile_to_px(tiles: Sequence[float], tile_center: float, tile_size: int, image_size: int):
+    '''Transforms tile numbers along one axis to pixels on an image canvas of
+    `image_size` pixels along that axis, centered on `tile_center`.'''
+    if np is not None:
+        px = (np.asarray(tiles, dtype=float) - tile_center) * tile_size + image_size / 2
+        return np.round(px).astype(int)
+    return [int(round((t - tile_center) * tile_size + image_size / 2)) for t in tiles]
+
+
+def bounding_box(lats: Sequence[float], lngs: Sequence[float]) -> Tuple[float, float, float, float]:
+    '''Returns (min_lat, min_lng, max_lat, max_lng).'''
+    if np is not None:
+        lat = np.asarray(lats, dtype=float)
+        lng = np.asarray(lngs, dtype=float)
+        return float(lat.min()), float(lng.min()), float(lat.max()), float(lng.max())
+    return min(lats), min(lngs), max(lats), max(lngs)
+
+
+def legs_longer_than(lats: Sequence[float], lngs: Sequence[float], meters: float):
+    '''Returns the indices `i` of the points which are more than `meters` away
+    from point `i + 1`.'''
+    distances = consecutive_distances(lats, lngs)
+    if np is not None:
+        return np.flatnonzero(distances > meters).tolist()
+    return [idx for idx, d in enumerate(distances) if d > meters]
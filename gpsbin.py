@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''
+gpsbin.py reads and writes GPS rows (as printed by exif_gps.py and
+markdown_gps.py) in a compact binary columnar format, which create_maps.py
+can memory-map and use without parsing anything per row. It's also a
+converter between that format and JSON lines:
+
+    python gpsbin.py 2018_batey_bike_trip/2018_pictures_gps_data.json 2018_batey_bike_trip/2018_pictures_gps_data.gpsbin
+    python gpsbin.py 2018_batey_bike_trip/2018_pictures_gps_data.gpsbin > 2018_pictures_gps_data.json
+
+A file is a header followed by columns of `count` values each, every
+column starting on an 8 byte boundary, all little-endian:
+
+    header        magic b'GPSB', version (u16), reserved (u16),
+                  count (u64), number of strings (u64)
+    latitude      f64, NaN when missing
+    longitude     f64, NaN when missing
+    timestamp_utc f64, NaN when missing
+    flags         u8, FLAG_INT_TIMESTAMP if timestamp_utc was an integer
+    filename, description, error, dilution_of_precision
+                  u32 indices into the string table, ABSENT if the row
+                  didn't have that key
+    string table  u64 offsets of each string's end within the string data,
+                  then the UTF-8 string data
+
+String 0 is always the empty string, so a row has an error exactly when
+its error index is neither 0 nor ABSENT.
+'''
+import argparse
+import struct
+import json
+import mmap
+import math
+import sys
+
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from track import TrackArray
+
+MAGIC = b'GPSB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQ')
+HEADER_SIZE = 32
+
+NUMBER_FIELDS = ['latitude', 'longitude', 'timestamp_utc']
+STRING_FIELDS = ['filename', 'description', 'error', 'dilution_of_precision']
+FLAG_INT_TIMESTAMP = 1
+ABSENT = 0xFFFFFFFF
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def _native(col: array) -> array:
+    if sys.byteorder != 'little':
+        col = array(col.typecode, col)
+        col.byteswap()
+    return col
+
+
+def is_gpsbin(path) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class GpsBinWriter:
+    '''Collects rows column by column, then writes them out in one go with
+    `write()`, since the header needs the final row count.'''
+    def __init__(self):
+        self.numbers = {field: array('d') for field in NUMBER_FIELDS}
+        self.flags = array('B')
+        self.string_idxs = {field: array('I') for field in STRING_FIELDS}
+        self.strings: List[str] = ['']
+        self.string_ids: Dict[str, int] = {'': 0}
+
+    def _intern(self, s) -> int:
+        s = str(s)
+        idx = self.string_ids.get(s)
+        if idx is None:
+            idx = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+    def add(self, row: Dict[str, Any]):
+        for field in NUMBER_FIELDS:
+            value = row.get(field, '')
+            self.numbers[field].append(float('nan') if value in ('', None) else float(value))
+        self.flags.append(FLAG_INT_TIMESTAMP if isinstance(row.get('timestamp_utc'), int) else 0)
+        for field in STRING_FIELDS:
+            self.string_idxs[field].append(self._intern(row[field]) if field in row else ABSENT)
+
+    def add_track(self, track: TrackArray):
+        '''Adds every point of `track` as a row with only a position and a
+        time.'''
+        self.numbers['latitude'].extend(track.lat)
+        self.numbers['longitude'].extend(track.lng)
+        self.numbers['timestamp_utc'].extend(track.moment)
+        self.flags.extend(bytes(len(track)))
+        absent = array('I', [ABSENT]) * len(track)
+        for field in STRING_FIELDS:
+            self.string_idxs[field].extend(absent)
+
+    def __len__(self):
+        return len(self.flags)
+
+    def write(self, f):
+        '''Writes the collected rows to binary file object `f`.'''
+        data = [s.encode('utf-8') for s in self.strings]
+        ends = array('Q')
+        end = 0
+        for b in data:
+            end += len(b)
+            ends.append(end)
+
+        def write_col(col: array):
+            raw = _native(col).tobytes()
+            f.write(raw)
+            f.write(bytes(_padded(len(raw)) - len(raw)))
+
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(self), len(self.strings)).ljust(HEADER_SIZE, b'\0'))
+        for field in NUMBER_FIELDS:
+            write_col(self.numbers[field])
+        write_col(self.flags)
+        for field in STRING_FIELDS:
+            write_col(self.string_idxs[field])
+        write_col(ends)
+        f.write(b''.join(data))
+
+
+def write_rows(rows: Iterable[Dict[str, Any]], f):
+    writer = GpsBinWriter()
+    for row in rows:
+        writer.add(row)
+    writer.write(f)
+
+
+class GpsBinReader:
+    '''Memory-maps a gpsbin file (or reads a gpsbin file's contents given as
+    bytes). The columns are zero-copy memoryviews of
+    the mapping: `latitude`, `longitude` and `timestamp_utc` of doubles,
+    `flags` of bytes, and `string_idxs[field]` of string table indices.
+    Strings are only decoded when asked for.'''
+    def __init__(self, path):
+        if isinstance(path, (bytes, bytearray)):
+            # Already read, e.g. from a pipe which can't be memory-mapped
+            self.mm = path
+        else:
+            with open(path, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count, nstrings = HEADER.unpack_from(self.mm)
+        name = 'data' if isinstance(path, (bytes, bytearray)) else path
+        if magic != MAGIC:
+            raise ValueError(f"{name} is not a gpsbin file")
+        if version != VERSION:
+            raise ValueError(f"{name} is gpsbin version {version}, expected {VERSION}")
+        if sys.byteorder != 'little':
+            raise ValueError("gpsbin files can only be memory-mapped on little-endian machines")
+
+        view = memoryview(self.mm)
+        pos = HEADER_SIZE
+
+        def column(fmt, itemsize, n):
+            nonlocal pos
+            col = view[pos:pos + itemsize * n].cast(fmt)
+            pos += _padded(itemsize * n)
+            return col
+
+        self.latitude = column('d', 8, self.count)
+        self.longitude = column('d', 8, self.count)
+        self.timestamp_utc = column('d', 8, self.count)
+        self.flags = column('B', 1, self.count)
+        self.string_idxs = {field: column('I', 4, self.count) for field in STRING_FIELDS}
+        self._string_ends = column('Q', 8, nstrings)
+        self._string_data = pos
+
+    def __len__(self):
+        return self.count
+
+    def string(self, idx) -> str:
+        start = self._string_ends[idx - 1] if idx > 0 else 0
+        end = self._string_ends[idx]
+        return self.mm[self._string_data + start:self._string_data + end].decode('utf-8')
+
+    def has_error(self, idx) -> bool:
+        return self.string_idxs['error'][idx] not in (0, ABSENT)
+
+    def row(self, idx) -> Dict[str, Any]:
+        '''Rebuilds row `idx` as it was given to the writer.'''
+        row: Dict[str, Any] = dict()
+        for field, col in (('latitude', self.latitude), ('longitude', self.longitude),
+                           ('timestamp_utc', self.timestamp_utc)):
+            value = col[idx]
+            if math.isnan(value):
+                row[field] = ''
+            elif field == 'timestamp_utc' and self.flags[idx] & FLAG_INT_TIMESTAMP:
+                row[field] = int(value)
+            else:
+                row[field] = value
+        for field in STRING_FIELDS:
+            string_idx = self.string_idxs[field][idx]
+            if string_idx != ABSENT:
+                row[field] = self.string(string_idx)
+        return row
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for idx in range(self.count):
+            yield self.row(idx)
+
+
+def load_track(path) -> TrackArray:
+    '''Reads the rows of a gpsbin file (a path, or its contents as bytes) as
+    a track in time order, leaving out rows with errors or without a
+    position and time. If the file is already clean and in order, the
+    track's columns are the memory-mapped file itself.'''
+    reader = GpsBinReader(path)
+    lat, lng, moment = reader.latitude, reader.longitude, reader.timestamp_utc
+    if np is not None:
+        errors = np.frombuffer(reader.string_idxs['error'], dtype=np.uint32)
+        lats, lngs, moments = (np.frombuffer(col, dtype=float) for col in (lat, lng, moment))
+        valid = ((errors == 0) | (errors == ABSENT)) & \
+            ~(np.isnan(lats) | np.isnan(lngs) | np.isnan(moments))
+        if valid.all() and (np.diff(moments) >= 0).all():
+            return TrackArray(lat, lng, moment)
+        keep = np.flatnonzero(valid)
+        keep = keep[np.argsort(moments[keep], kind='stable')]
+        return TrackArray(*(array('d', col[keep].tobytes()) for col in (lats, lngs, moments)))
+    keep = [
+        idx for idx in range(len(reader)) if not reader.has_error(idx) and
+        not (math.isnan(lat[idx]) or math.isnan(lng[idx]) or math.isnan(moment[idx]))
+    ]
+    keep.sort(key=moment.__getitem__)
+    if len(keep) == len(reader) and keep == list(range(len(reader))):
+        return TrackArray(lat, lng, moment)
+    return TrackArray(lat, lng, moment).take(keep)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert GPS data between JSON lines and the binary gpsbin format'
+    )
+    parser.add_argument('input', help='A JSON lines or gpsbin file')
+    parser.add_argument(
+        'output',
+        nargs='?',
+        help='Where to write the converted file; stdout if omitted, as JSON lines or gpsbin '
+        'depending on the input'
+    )
+    args = parser.parse_args()
+
+    if is_gpsbin(args.input):
+        reader = GpsBinReader(args.input)
+        out = open(args.output, 'w') if args.output else sys.stdout
+        for row in reader.rows():
+            out.write(json.dumps(row, sort_keys=True) + '\n')
+        if args.output:
+            out.close()
+    else:
+        with open(args.input) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        if args.output:
+            with open(args.output, 'wb') as out:
+                write_rows(rows, out)
+        else:
+            write_rows(rows, sys.stdout.buffer)
+
+
+if __name__ == '__main__':
+    main()
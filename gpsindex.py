@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+'''
+gpsindex.py keeps every trip's photos and logged positions in one spatial
+index, so they can be searched by place and time without reading the GPS
+data files again:
+
+    python gpsindex.py build
+    python gpsindex.py radius 46.8801 -117.3643 2        # within 2 km of Colfax
+    python gpsindex.py bbox 47.5 -123 48.5 -121.5 --after 2017-01-01
+    python gpsindex.py nearest 48.5553 -117.9190 -k 5
+    python gpsindex.py window --after 2018-06-10 --before 2018-06-11
+
+`build` indexes each trip's `20XX_pictures_gps_data.json` and the
+positions in its `20XX_batey_bike_trip.md` which aren't already in the
+former, re-reading only trips whose files have changed. The index is an
+SQLite R*Tree over latitude, longitude and time, so every query is a box
+lookup followed by an exact check of the few points inside the box. Results
+are printed as JSON lines, nearest first for radius and nearest queries,
+otherwise in time order.
+'''
+import datetime
+import argparse
+import sqlite3
+import json
+import math
+import time
+import sys
+import os
+
+from typing import Any, Dict, List, Tuple
+
+import geodesy
+import markdown_gps
+from build_trips import HERE, find_trips
+
+INDEX_FILE = '.gps_index.sqlite'
+
+# (min_lat, max_lat, min_lng, max_lng)
+Box = Tuple[float, float, float, float]
+
+
+def radius_boxes(lat: float, lng: float, meters: float) -> List[Box]:
+    '''Returns boxes which together cover every point within `meters` of
+    (`lat`, `lng`): one box, or two if it crosses the antimeridian.'''
+    dlat = math.degrees(meters / geodesy.EARTH_RADIUS_M)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        # Reaches a pole, so every longitude is in range
+        return [(max(min_lat, -90), min(max_lat, 90), -180, 180)]
+    # The circle is widest where meridians touch it, further from the
+    # equator than its center
+    dlng = math.degrees(math.asin(min(1, math.sin(meters / geodesy.EARTH_RADIUS_M) /
+                                      math.cos(math.radians(lat)))))
+    min_lng, max_lng = lng - dlng, lng + dlng
+    if min_lng < -180:
+        return [(min_lat, max_lat, min_lng + 360, 180), (min_lat, max_lat, -180, max_lng)]
+    if max_lng > 180:
+        return [(min_lat, max_lat, min_lng, 180), (min_lat, max_lat, -180, max_lng - 360)]
+    return [(min_lat, max_lat, min_lng, max_lng)]
+
+
+def trip_sources(tripdir, year) -> List[str]:
+    paths = [
+        os.path.join(tripdir, f"{year}_pictures_gps_data.json"),
+        os.path.join(tripdir, f"{year}_batey_bike_trip.md"),
+    ]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def sources_signature(paths: List[str]) -> str:
+    '''Changes whenever any of `paths` is modified, without reading them.'''
+    stats = list()
+    for path in paths:
+        st = os.stat(path)
+        stats.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+    return json.dumps(stats)
+
+
+def read_trip_rows(tripdir, year) -> List[Dict[str, Any]]:
+    '''Returns the rows with a position and time of the trip's GPS data
+    file, followed by those of its markdown notes which the GPS data file
+    doesn't already include. A note is matched on its position and
+    description only, since GPS data files written by older versions of
+    markdown_gps.py may have its time off by the trip's UTC offset.'''
+    rows = list()
+    gpsdata = os.path.join(tripdir, f"{year}_pictures_gps_data.json")
+    if os.path.exists(gpsdata):
+        with open(gpsdata) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if row.get('error') or \
+                        '' in (row['latitude'], row['longitude'], row['timestamp_utc']):
+                    continue
+                rows.append(row)
+
+    def key(row):
+        return (
+            round(float(row['latitude']), 6), round(float(row['longitude']), 6),
+            row.get('description', '').strip()
+        )
+
+    seen = {key(row) for row in rows if 'description' in row}
+    markdown = os.path.join(tripdir, f"{year}_batey_bike_trip.md")
+    if os.path.exists(markdown):
+        with open(markdown) as f:
+            for _, block in markdown_gps.stream_fenced_blocks(f):
+                # Like markdown_gps.py, keep the rows before any which can't
+                # be parsed
+                try:
+                    for timeloc in markdown_gps.iter_codeblock_timelocs(block):
+                        if key(timeloc) not in seen:
+                            rows.append(timeloc)
+                except Exception:
+                    continue
+    return rows
+
+
+def parse_time(s: str) -> float:
+    '''Parses epoch seconds, or an ISO 8601 date or time (local time unless
+    it has an offset).'''
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.datetime.fromisoformat(s).timestamp()
+
+
+class GpsIndex:
+    '''The points of every trip in an SQLite database at `path`. `points`
+    holds each point's row and `points_rtree` its bounding box in latitude,
+    longitude and time. The R*Tree stores 32-bit floats rounded outwards, so
+    its boxes may be slightly too big and every candidate is checked against
+    the exact values in `points`.'''
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            '''CREATE TABLE IF NOT EXISTS points (
+                id INTEGER PRIMARY KEY,
+                trip TEXT NOT NULL,
+                filename TEXT,
+                description TEXT,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                timestamp_utc REAL NOT NULL
+            )'''
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS points_trip ON points (trip)')
+        self.db.execute(
+            '''CREATE VIRTUAL TABLE IF NOT EXISTS points_rtree USING rtree(
+                id, min_lat, max_lat, min_lng, max_lng, min_t, max_t
+            )'''
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS trips (trip TEXT PRIMARY KEY, signature TEXT NOT NULL)'
+        )
+        self.db.commit()
+
+    def stale_trips(self, root) -> List[str]:
+        '''Returns the trips under `root` which have been added, changed or
+        removed since they were indexed.'''
+        indexed = dict(self.db.execute('SELECT trip, signature FROM trips'))
+        trips = find_trips(root)
+        stale = [
+            year for year, tripdir in trips.items()
+            if indexed.get(year) != sources_signature(trip_sources(tripdir, year))
+        ]
+        return stale + [year for year in indexed if year not in trips]
+
+    def build(self, root, force=False) -> Dict[str, int]:
+        '''(Re)indexes the trips under `root` which have changed since they
+        were indexed, or all of them if `force`, and drops removed trips.
+        Returns the number of points indexed for each trip.'''
+        trips = find_trips(root)
+        stale = self.stale_trips(root)
+        if force:
+            stale = list(trips) + [year for year in stale if year not in trips]
+        counts = dict()
+        with self.db:
+            for year in stale:
+                self.db.execute(
+                    'DELETE FROM points_rtree WHERE id IN (SELECT id FROM points WHERE trip = ?)',
+                    (year, )
+                )
+                self.db.execute('DELETE FROM points WHERE trip = ?', (year, ))
+                self.db.execute('DELETE FROM trips WHERE trip = ?', (year, ))
+                if year not in trips:
+                    continue
+                tripdir = trips[year]
+                rows = read_trip_rows(tripdir, year)
+                for row in rows:
+                    lat, lng = float(row['latitude']), float(row['longitude'])
+                    moment = float(row['timestamp_utc'])
+                    cursor = self.db.execute(
+                        '''INSERT INTO points
+                            (trip, filename, description, latitude, longitude, timestamp_utc)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                        (year, row.get('filename'), (row.get('description') or '').strip() or None,
+                         lat, lng, moment)
+                    )
+                    self.db.execute(
+                        'INSERT INTO points_rtree VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (cursor.lastrowid, lat, lat, lng, lng, moment, moment)
+                    )
+                self.db.execute(
+                    'INSERT INTO trips VALUES (?, ?)',
+                    (year, sources_signature(trip_sources(tripdir, year)))
+                )
+                counts[year] = len(rows)
+        return counts
+
+    def _query(self, boxes: List[Box], after=-math.inf, before=math.inf) -> List[Dict[str, Any]]:
+        results = list()
+        for min_lat, max_lat, min_lng, max_lng in boxes:
+            cursor = self.db.execute(
+                '''SELECT p.trip, p.filename, p.description, p.latitude, p.longitude,
+                        p.timestamp_utc FROM points_rtree r JOIN points p ON p.id = r.id
+                    WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?
+                        AND r.max_t >= ? AND r.min_t <= ?''',
+                (min_lat, max_lat, min_lng, max_lng, after, before)
+            )
+            for trip, filename, description, lat, lng, moment in cursor:
+                if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng and
+                        after <= moment <= before):
+                    continue
+                row = {'trip': trip, 'latitude': lat, 'longitude': lng, 'timestamp_utc': moment}
+                if filename is not None:
+                    row['filename'] = filename
+                if description is not None:
+                    row['description'] = description
+                results.append(row)
+        return results
+
+    def bbox(self, box: Box, after=-math.inf, before=math.inf) -> List[Dict[str, Any]]:
+        '''Returns the points inside `box` taken between `after` and
+        `before`, in time order. A box whose min_lng is greater than its
+        max_lng crosses the antimeridian.'''
+        min_lat, max_lat, min_lng, max_lng = box
+        boxes = [box]
+        if min_lng > max_lng:
+            boxes = [(min_lat, max_lat, min_lng, 180), (min_lat, max_lat, -180, max_lng)]
+        rows = self._query(boxes, after, before)
+        rows.sort(key=lambda row: row['timestamp_utc'])
+        return rows
+
+    def window(self, after=-math.inf, before=math.inf) -> List[Dict[str, Any]]:
+        '''Returns the points taken between `after` and `before`, in time
+        order.'''
+        return self.bbox((-90, 90, -180, 180), after, before)
+
+    def radius(self, lat, lng, meters, after=-math.inf, before=math.inf) -> List[Dict[str, Any]]:
+        '''Returns the points within `meters` of (`lat`, `lng`) taken between
+        `after` and `before`, nearest first, with their `distance_m`.'''
+        rows = self._query(radius_boxes(lat, lng, meters), after, before)
+        distances = geodesy.distances_from(
+            lat, lng, [row['latitude'] for row in rows], [row['longitude'] for row in rows]
+        )
+        for row, distance in zip(rows, distances):
+            row['distance_m'] = round(float(distance), 1)
+        rows = [row for row in rows if row['distance_m'] <= meters]
+        rows.sort(key=lambda row: row['distance_m'])
+        return rows
+
+    def nearest(self, lat, lng, k=10, after=-math.inf, before=math.inf) -> List[Dict[str, Any]]:
+        '''Returns the `k` points nearest to (`lat`, `lng`) taken between
+        `after` and `before`. Searches ever larger radii until one holds at
+        least `k` points; any point nearer than the `k`th is then inside it.'''
+        meters = 1000.0
+        while True:
+            rows = self.radius(lat, lng, meters, after, before)
+            if len(rows) >= k or meters >= math.pi * geodesy.EARTH_RADIUS_M:
+                return rows[:k]
+            meters *= 4
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index every trip\'s GPS data and find points by place and time'
+    )
+    parser.add_argument(
+        '--index',
+        metavar='PATH',
+        default=os.path.join(HERE, INDEX_FILE),
+        help=f"The index database (default {INDEX_FILE} next to this script)"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Index the trips whose GPS data has changed')
+    build.add_argument('--force', action='store_true', help='Re-index every trip')
+
+    radius = commands.add_parser('radius', help='Points within some distance of a place')
+    radius.add_argument('lat', type=float)
+    radius.add_argument('lng', type=float)
+    radius.add_argument('km', type=float)
+
+    bbox = commands.add_parser('bbox', help='Points inside a bounding box')
+    bbox.add_argument('min_lat', type=float)
+    bbox.add_argument('min_lng', type=float)
+    bbox.add_argument('max_lat', type=float)
+    bbox.add_argument('max_lng', type=float)
+
+    nearest = commands.add_parser('nearest', help='The points nearest to a place')
+    nearest.add_argument('lat', type=float)
+    nearest.add_argument('lng', type=float)
+    nearest.add_argument('-k', type=int, default=10, help='How many points to return')
+
+    window = commands.add_parser('window', help='Points taken between two times')
+
+    for query in (radius, bbox, nearest, window):
+        query.add_argument(
+            '--after',
+            type=parse_time,
+            default=-math.inf,
+            help='Only points taken at or after this time: epoch seconds, or an ISO 8601 date '
+            'or time (local time unless it has an offset)'
+        )
+        query.add_argument(
+            '--before',
+            type=parse_time,
+            default=math.inf,
+            help='Only points taken at or before this time'
+        )
+    args = parser.parse_args()
+
+    if args.command != 'build' and not os.path.exists(args.index):
+        print(f"No index at {args.index}; run `{sys.argv[0]} build` first", file=sys.stderr)
+        sys.exit(1)
+    index = GpsIndex(args.index)
+    if args.command == 'build':
+        start = time.perf_counter()
+        counts = index.build(HERE, force=args.force)
+        for year, count in sorted(counts.items()):
+            print(f"Indexed {count} points of {year}")
+        if not counts:
+            print('Index is up to date')
+        print(f"Finished in {time.perf_counter() - start:.2f}s")
+        index.close()
+        return
+
+    stale = index.stale_trips(HERE)
+    if stale:
+        print(f"The index is out of date for {', '.join(sorted(stale))}; run `{sys.argv[0]} build`",
+              file=sys.stderr)
+    start = time.perf_counter()
+    if args.command == 'radius':
+        rows = index.radius(args.lat, args.lng, args.km * 1000, args.after, args.before)
+    elif args.command == 'bbox':
+        box = (args.min_lat, args.max_lat, args.min_lng, args.max_lng)
+        rows = index.bbox(box, args.after, args.before)
+    elif args.command == 'nearest':
+        rows = index.nearest(args.lat, args.lng, args.k, args.after, args.before)
+    else:
+        rows = index.window(args.after, args.before)
+    elapsed = time.perf_counter() - start
+    for row in rows:
+        print(json.dumps(row, sort_keys=True))
+    print(f"{len(rows)} points in {elapsed * 1000:.1f} ms", file=sys.stderr)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
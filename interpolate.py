@@ -0,0 +1,121 @@
+'''
+interpolate.py fills in the time of each point along a directions route
+between two timestamped GPS points. Times are worked out a leg at a time on
+epoch seconds, and written straight into a preallocated TrackArray.
+'''
+import datetime
+
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import geodesy
+from track import TrackArray, next_midnight
+
+Coord = Tuple[float, float]
+
+# 'even' spaces a leg's points evenly in time; 'distance' times them by how
+# far along the route they are, as if riding at a constant speed
+STRATEGIES = ('even', 'distance')
+
+
+def clamp_end_before_midnight(start: float, end: float, tz: Optional[datetime.tzinfo] = None) -> float:
+    '''
+    If the time difference between start and end would span multiple days, we
+    don't want to smoothly interpolate between then since that would imply
+    continuous travel, even through the middle of the night, which doesn't
+    match up with what we'd intuit. Instead, we clamp the end time to be 1
+    second before midnight (in timezone `tz`, or else local time) on the day
+    of the start, and we assume that there's just missing data between then
+    and the start of the later day.
+    '''
+    midnight = next_midnight(start, tz)
+    if end >= midnight:
+        return midnight - 1
+    return end
+
+
+def leg_fractions(
+    origin: Coord, destination: Coord, points: Sequence[Coord], strategy='even'
+) -> Sequence[float]:
+    '''Returns how far through the leg from `origin` to `destination`, from 0
+    to 1, each of the route's `points` is reached.'''
+    n = len(points)
+    if strategy == 'distance':
+        lats = [origin[0]] + [p[0] for p in points] + [destination[0]]
+        lngs = [origin[1]] + [p[1] for p in points] + [destination[1]]
+        distances = geodesy.consecutive_distances(lats, lngs)
+        if np is not None:
+            total = float(distances.sum())
+            if total > 0:
+                return np.cumsum(distances[:-1]) / total
+        else:
+            total = sum(distances)
+            if total > 0:
+                fractions = list()
+                travelled = 0.0
+                for d in distances[:-1]:
+                    travelled += d
+                    fractions.append(travelled / total)
+                return fractions
+        # A leg that goes nowhere is timed evenly
+    elif strategy != 'even':
+        raise ValueError(f"unknown interpolation strategy {strategy!r}")
+    if np is not None:
+        return np.linspace(0, 1, n + 2)[1:-1]
+    return [(idx + 1) / (n + 1) for idx in range(n)]
+
+
+def interpolate_legs(
+    track: TrackArray,
+    leg_points: Dict[int, List[Coord]],
+    strategy='even',
+    tz: Optional[datetime.tzinfo] = None,
+) -> TrackArray:
+    '''Returns `track` with the route points `leg_points[idx]` inserted
+    between points `idx` and `idx + 1`, each given a time between theirs
+    according to `strategy`.'''
+    total = len(track) + sum(len(points) for points in leg_points.values())
+    out = TrackArray.zeros(total)
+    out_cols = [memoryview(out.lat), memoryview(out.lng), memoryview(out.moment)]
+    in_cols = [memoryview(track.lat), memoryview(track.lng), memoryview(track.moment)]
+    if np is not None:
+        out_np = [np.frombuffer(col, dtype=float) for col in out_cols]
+    pos = 0
+    prev = 0
+    for idx in sorted(leg_points):
+        # Copy the original points up to and including the start of the leg
+        count = idx + 1 - prev
+        for out_col, in_col in zip(out_cols, in_cols):
+            out_col[pos:pos + count] = in_col[prev:idx + 1]
+        pos += count
+        prev = idx + 1
+
+        points = leg_points[idx]
+        if not points:
+            continue
+        n = len(points)
+        origin = (track.lat[idx], track.lng[idx])
+        destination = (track.lat[idx + 1], track.lng[idx + 1])
+        start = track.moment[idx]
+        end = clamp_end_before_midnight(start, track.moment[idx + 1], tz)
+        fractions = leg_fractions(origin, destination, points, strategy)
+        if np is not None:
+            # Write through NumPy views of the output columns
+            coords = np.asarray(points, dtype=float)
+            out_np[0][pos:pos + n] = coords[:, 0]
+            out_np[1][pos:pos + n] = coords[:, 1]
+            out_np[2][pos:pos + n] = start + np.asarray(fractions) * (end - start)
+        else:
+            out_cols[0][pos:pos + n] = array('d', (p[0] for p in points))
+            out_cols[1][pos:pos + n] = array('d', (p[1] for p in points))
+            out_cols[2][pos:pos + n] = array('d', (start + f * (end - start) for f in fractions))
+        pos += n
+    count = len(track) - prev
+    for out_col, in_col in zip(out_cols, in_cols):
+        out_col[pos:pos + count] = in_col[prev:]
+    return out
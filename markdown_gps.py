@@ -1,88 +1,181 @@
+import functools
 import datetime
 import argparse
 import json
 import csv
 import sys
-import io
+import os
+import re
 
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
-class Charstream:
-    def __init__(self, s: str):
-        self.string = s
-        self.idx = 0
+import metrics
+import gpsbin
 
-    def getchar(self):
-        i = self.idx
-        self.idx += 1
-        return self.string[i]
 
-    def peak(self, n=1):
-        i = self.idx
-        return self.string[i:i + n]
+# An opening code fence: three or more backticks or tildes at the start of a
+# line, followed by an optional info string (```csv). Backtick fences may not
+# have backticks in their info string, otherwise it's inline code.
+OPEN_FENCE_RE = re.compile(r'^(?:(`{3,})([^`\n]*)|(~{3,})([^\n]*))(?:\n|\Z)', re.MULTILINE)
 
-    def skip(self, n=1):
-        self.idx += n
-        return
+_close_fence_res = dict()
 
 
-def parse_md_find_codeblocks(charstream):
-    OTHER = 'OTHER'
-    NEWLINE = 'NEWLINE'
-    GRAVE_1 = 'GRAVE_1'
-    GRAVE_2 = 'GRAVE_2'
-    INSIDE_CODEBLOCK = 'INSIDE_CODEBLOCK'
-    END_GRAVE_1 = 'END_GRAVE_1'
-    END_GRAVE_2 = 'END_GRAVE_2'
+def close_fence_re(fence: str):
+    '''Returns the regex matching the line which closes a block opened with
+    `fence`: the same character, at least as many times, and nothing else.'''
+    if fence not in _close_fence_res:
+        _close_fence_res[fence] = re.compile(
+            rf'^{re.escape(fence[0])}{{{len(fence)},}}[ \t\r]*$', re.MULTILINE
+        )
+    return _close_fence_res[fence]
+
+
+def find_fenced_blocks(text: str) -> Iterator[Tuple[str, str]]:
+    '''Yields (info string, contents) for each fenced code block in the
+    markdown document `text`. The search jumps from fence to fence with
+    compiled regexes, so the cost is linear in the size of the document.
+    Blocks which are never closed are ignored.'''
+    pos = 0
+    while True:
+        opening = OPEN_FENCE_RE.search(text, pos)
+        if opening is None:
+            return
+        fence = opening.group(1) or opening.group(3)
+        info = (opening.group(2) or opening.group(4) or '').strip()
+        closing = close_fence_re(fence).search(text, opening.end())
+        if closing is None:
+            return
+        yield info, text[opening.end():closing.start()]
+        pos = closing.end()
+
+
+def stream_fenced_blocks(f: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    '''Like find_fenced_blocks, but reads the document line by line from the
+    file object (or any iterable of lines) `f`, so only the code block being
+    collected is held in memory.'''
+    closing = None
+    for line in f:
+        if closing is None:
+            opening = OPEN_FENCE_RE.match(line)
+            if opening is not None:
+                fence = opening.group(1) or opening.group(3)
+                info = (opening.group(2) or opening.group(4) or '').strip()
+                closing = close_fence_re(fence)
+                lines = list()
+        elif closing.match(line):
+            yield info, ''.join(lines)
+            closing = None
+        else:
+            lines.append(line)
+
+
+def parse_md_find_codeblocks(text: str) -> List[str]:
+    '''Returns the contents of each fenced code block in `text`.'''
+    return [block for _, block in find_fenced_blocks(text)]
+
+
+@functools.lru_cache(maxsize=None)
+def tz_for_offset(minutes: int) -> datetime.timezone:
+    '''Returns a shared timezone object for a UTC offset in minutes, so parsing
+    many rows doesn't allocate a new tzinfo for each one.'''
+    return datetime.timezone(datetime.timedelta(minutes=minutes))
+
+
+def parse_ts_date_hm_offset(ts: str) -> float:
+    '''Parses the trip logs' usual `YYYY-MM-DD HH:MM ±HHMM` shape by slicing,
+    without going through strptime.'''
+    if len(ts) != 22 or ts[4] != '-' or ts[7] != '-' or ts[10] != ' ' or ts[13] != ':' \
+            or ts[16] != ' ' or ts[17] not in '+-':
+        raise ValueError(f"not a YYYY-MM-DD HH:MM ±HHMM timestamp: {ts!r}")
+    offset = int(ts[18:20]) * 60 + int(ts[20:22])
+    if ts[17] == '-':
+        offset = -offset
+    dt = datetime.datetime(
+        int(ts[0:4]),
+        int(ts[5:7]),
+        int(ts[8:10]),
+        int(ts[11:13]),
+        int(ts[14:16]),
+        tzinfo=tz_for_offset(offset),
+    )
+    return dt.timestamp()
+
+
+def parse_ts_iso8601(ts: str) -> float:
+    '''Parses ISO 8601 timestamps with an explicit offset or `Z` suffix, such
+    as `2016-07-07T12:01:30-07:00` or `2016-07-07T19:01:30Z`.'''
+    dt = datetime.datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        raise ValueError(f"timestamp has no UTC offset: {ts!r}")
+    return dt.timestamp()
+
+
+EPOCH_RE = re.compile(r'\d{9,11}(\.\d*)?')
 
-    codeblocks = list()
 
-    state = NEWLINE
-    try:
-        while True:
-            if state == NEWLINE:
-                c = charstream.getchar()
-                if c == '`':
-                    state = GRAVE_1
-                    continue
-            elif state == GRAVE_1:
-                c = charstream.getchar()
-                if c == '`':
-                    state = GRAVE_2
-                elif c == '\n':
-                    state = NEWLINE
-                else:
-                    state = OTHER
+def parse_ts_epoch(ts: str) -> float:
+    '''Parses seconds since the Unix epoch. At least 9 digits are required
+    so that compact dates like 20160707 aren't mistaken for epoch times.'''
+    if not EPOCH_RE.fullmatch(ts):
+        raise ValueError(f"not an epoch timestamp: {ts!r}")
+    return float(ts)
+
+
+def parse_ts_strptime(ts: str) -> float:
+    '''The original strptime-based parser, which still catches the usual
+    shape written loosely, e.g. with a single-digit hour.'''
+    return datetime.datetime.strptime(ts, '%Y-%m-%d %H:%M %z').timestamp()
+
+
+# Timestamp parsers, tried in order. Each takes the stripped timestamp string
+# and returns epoch seconds, raising ValueError if it isn't that format.
+TIMESTAMP_FORMATS: List[Tuple[str, Callable[[str], float]]] = [
+    ('date_hm_offset', parse_ts_date_hm_offset),
+    ('iso8601', parse_ts_iso8601),
+    ('epoch', parse_ts_epoch),
+    ('strptime', parse_ts_strptime),
+]
+
+
+def register_timestamp_format(name: str, parser: Callable[[str], float]):
+    TIMESTAMP_FORMATS.append((name, parser))
+
+
+class TimestampParser:
+    '''Parses timestamps with the registered formats, remembering which format
+    last succeeded and trying it first. Rows of one code block nearly always
+    share a format, so use one TimestampParser per code block.'''
+    def __init__(self):
+        self.last = None
+
+    def parse(self, ts: str) -> float:
+        ts = ts.strip()
+        if self.last is not None:
+            try:
+                return self.last(ts)
+            except ValueError:
+                pass
+        for _, parser in TIMESTAMP_FORMATS:
+            if parser is self.last:
                 continue
-            elif state == GRAVE_2:
-                c = charstream.getchar()
-                if c == '`':
-                    state = INSIDE_CODEBLOCK
-                elif c == '\n':
-                    state = NEWLINE
-                else:
-                    state = OTHER
+            try:
+                result = parser(ts)
+            except ValueError:
                 continue
-            elif state == INSIDE_CODEBLOCK:
-                newblock = ''
-                while True:
-                    if charstream.peak(3) == '```':
-                        charstream.skip(3)
-                        codeblocks.append(newblock)
-                        state = OTHER
-                        break
-                    c = charstream.getchar()
-                    newblock += c
-            elif state == OTHER:
-                c = charstream.getchar()
-                if c == '\n':
-                    state = NEWLINE
-                    continue
-    except IndexError as e:
-        # not an error, means we hit EOF
-        return codeblocks
-
-
-def parse_timeloc(row):
+            self.last = parser
+            return result
+        raise ValueError(f"couldn't parse timestamp {ts!r}")
+
+
+def parse_timestamp(timeloc, tsparser: Optional[TimestampParser] = None):
+    if tsparser is None:
+        tsparser = TimestampParser()
+    timeloc['timestamp_utc'] = tsparser.parse(timeloc['timestamp_utc'])
+    return timeloc
+
+
+def parse_timeloc(row, tsparser: Optional[TimestampParser] = None):
     nr = {k.lower().strip(): v for k, v in row.items()}
     timeloc = dict()
     possible_keys = {
@@ -98,23 +191,19 @@ def parse_timeloc(row):
     for pk, pck in possible_keys.items():
         if pk in nr:
             timeloc[pck] = nr[pk]
-    timeloc = parse_timestamp(timeloc)
+    timeloc = parse_timestamp(timeloc, tsparser)
     timeloc['latitude'] = float(timeloc['latitude'])
     timeloc['longitude'] = float(timeloc['longitude'])
     return timeloc
 
 
-def parse_timestamp(timeloc):
-    ts = timeloc['timestamp_utc']
-    for fmt in ['%Y-%m-%d %H:%M %z']:
-        try:
-            dt = datetime.datetime.strptime(ts, fmt)
-            # dt = dt.replace(tzinfo=datetime.timezone.utc)
-            timeloc['timestamp_utc'] = dt.timestamp()
-            return timeloc
-        except:
-            continue
-    raise ValueError("couldn't parse timestamp")
+def iter_codeblock_timelocs(cb: str, tsparser: Optional[TimestampParser] = None) -> Iterator[dict]:
+    '''Yields the timeloc of each row of the CSV code block `cb`.'''
+    if tsparser is None:
+        tsparser = TimestampParser()
+    lines = [l for l in cb.split('\n') if l.strip()]
+    for row in csv.DictReader(lines):
+        yield parse_timeloc(row, tsparser)
 
 
 def printrow_json(row):
@@ -122,25 +211,51 @@ def printrow_json(row):
 
 
 def main():
-    files = sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('markdownfiles', nargs='*')
+    parser.add_argument(
+        '--format',
+        '-f',
+        choices=['JSON', 'GPSBIN'],
+        default='JSON',
+        help='Format of GPS data written to stdout (GPSBIN is the binary format of gpsbin.py)'
+    )
+    parser.add_argument(
+        '--sort',
+        action='store_true',
+        help='Write rows in timestamp order, so create_maps.py can merge them with other '
+        'sorted inputs as they stream in'
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    meter = metrics.from_args(args)
+    files = args.markdownfiles
     codeblocks = list()
-    for fn in files:
-        with open(fn) as f:
-            codeblocks += parse_md_find_codeblocks(Charstream(f.read()))
+    with meter.stage('markdown_scan'):
+        for fn in files:
+            with open(fn) as f:
+                codeblocks += [block for _, block in stream_fenced_blocks(f)]
+            meter.add('markdown_scan', 'bytes_read', os.path.getsize(fn))
+    meter.add('markdown_scan', 'items', len(codeblocks))
     timelocs = list()
-    for cb in codeblocks:
-        lines = [l for l in cb.split('\n') if l.strip()]
-        try:
-            rdr = csv.DictReader(lines)
-            for row in rdr:
-                # print(row)
-                timeloc = parse_timeloc(row)
-                timelocs.append(timeloc)
-        except Exception as e:
-            print(e)
-            pass
-    for timeloc in timelocs:
-        printrow_json(timeloc)
+    with meter.stage('timeloc_parse'):
+        for cb in codeblocks:
+            try:
+                for timeloc in iter_codeblock_timelocs(cb):
+                    timelocs.append(timeloc)
+            except Exception as e:
+                print(e, file=sys.stderr)
+                meter.add('timeloc_parse', 'errors')
+        if args.sort:
+            timelocs.sort(key=lambda timeloc: timeloc['timestamp_utc'])
+    meter.add('timeloc_parse', 'items', len(timelocs))
+    with meter.stage('write'):
+        if args.format == 'GPSBIN':
+            gpsbin.write_rows(timelocs, sys.stdout.buffer)
+        else:
+            for timeloc in timelocs:
+                printrow_json(timeloc)
+    meter.finish(args.metrics_out)
 
 
 if __name__ == '__main__': main()
@@ -0,0 +1,183 @@
+'''
+metrics.py measures the stages of exif_gps.py, markdown_gps.py and
+create_maps.py: the wall and CPU time spent in each, and counters such as
+items processed, bytes read, API calls and cache hits and misses. Each
+script takes the same two options:
+
+    --metrics-out PATH  write the measurements as JSON (- for stderr)
+    --profile DIR       also run each stage under cProfile, dumping its
+                        stats to DIR/<stage>.prof (DIR/<map>.<stage>.prof
+                        for the stages rendering each of create_maps.py's
+                        maps)
+
+for example
+
+    python ./create_maps.py --metrics-out metrics.json --profile prof/ \
+        -i 2018_batey_bike_trip/2018_pictures_gps_data.json
+    python -m pstats prof/interpolation.prof
+'''
+import contextlib
+import threading
+import cProfile
+import argparse
+import json
+import time
+import sys
+import os
+
+from typing import Any, Dict, Optional
+
+# Not available on Windows; CPU time of child processes and peak memory are
+# left out there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _children_cpu() -> float:
+    '''CPU seconds used by child processes which have exited, such as the
+    workers of a closed multiprocessing.Pool.'''
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stage:
+    '''The totals of every run of one stage.'''
+    def __init__(self):
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.counters: Dict[str, int] = dict()
+
+    def as_dict(self) -> Dict[str, Any]:
+        d = {'calls': self.calls, 'wall_s': round(self.wall_s, 6), 'cpu_s': round(self.cpu_s, 6)}
+        d.update(sorted(self.counters.items()))
+        return d
+
+
+class Metrics:
+    '''Collects Stages by name, in the order they first ran. Wrap each stage
+    in `with metrics.stage(name):` and count things with `add()`. If
+    `profile_dir` is set, stages also run under cProfile; a stage run inside
+    another stage isn't profiled separately, since only one profiler can be
+    active at a time.'''
+    def __init__(self, profile_dir: Optional[str] = None):
+        self.profile_dir = profile_dir
+        self.stages: Dict[str, Stage] = dict()
+        self.profiles: Dict[str, cProfile.Profile] = dict()
+        self.profiling = False
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time() + _children_cpu()
+        # Counters may be bumped from several threads, e.g. by tile downloads
+        self.lock = threading.Lock()
+
+    def _stage(self, name) -> Stage:
+        if name not in self.stages:
+            self.stages[name] = Stage()
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        profile = None
+        if self.profile_dir is not None and not self.profiling:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            self.profiling = True
+            profile.enable()
+        start = time.perf_counter()
+        start_cpu = time.process_time() + _children_cpu()
+        try:
+            yield self._stage(name)
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.profiling = False
+            stage = self._stage(name)
+            stage.calls += 1
+            stage.wall_s += time.perf_counter() - start
+            stage.cpu_s += time.process_time() + _children_cpu() - start_cpu
+
+    def add(self, name, counter, n=1):
+        '''Adds `n` to `counter` of stage `name`.'''
+        with self.lock:
+            counters = self._stage(name).counters
+            counters[counter] = counters.get(counter, 0) + n
+
+    def merge(self, stages: Dict[str, Dict[str, Any]]):
+        '''Adds in the stages of another Metrics' `as_dict()`, e.g. one
+        collected by a worker process. Their times are summed, so a stage
+        run by several workers at once can take more than the elapsed time.'''
+        with self.lock:
+            for name, values in stages.items():
+                stage = self._stage(name)
+                for key, value in values.items():
+                    if key == 'calls':
+                        stage.calls += value
+                    elif key == 'wall_s':
+                        stage.wall_s += value
+                    elif key == 'cpu_s':
+                        stage.cpu_s += value
+                    else:
+                        stage.counters[key] = stage.counters.get(key, 0) + value
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stage.as_dict() for name, stage in self.stages.items()}
+
+    def report(self) -> Dict[str, Any]:
+        '''Returns the totals of the whole run and its stages.'''
+        report = {
+            'script': os.path.basename(sys.argv[0]),
+            'argv': sys.argv[1:],
+            'wall_s': round(time.perf_counter() - self.started, 6),
+            'cpu_s': round(time.process_time() + _children_cpu() - self.started_cpu, 6),
+        }
+        if resource is not None:
+            # Kilobytes on Linux, bytes on macOS
+            report['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['stages'] = self.as_dict()
+        return report
+
+    def dump_profiles(self, prefix=''):
+        '''Writes each stage's cProfile stats to `profile_dir`, as
+        `<prefix><stage>.prof`.'''
+        if self.profile_dir is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.profile_dir, f"{prefix}{name}.prof"))
+
+    def finish(self, metrics_out: Optional[str]):
+        '''Dumps the profiles and writes the report to `metrics_out`, if
+        given.'''
+        self.dump_profiles()
+        if not metrics_out:
+            return
+        text = json.dumps(self.report(), indent=2) + '\n'
+        if metrics_out == '-':
+            # stdout is usually the GPS data
+            sys.stderr.write(text)
+            return
+        tmppath = metrics_out + '.tmp'
+        with open(tmppath, 'w') as f:
+            f.write(text)
+        os.replace(tmppath, metrics_out)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    '''Adds --metrics-out and --profile to a script's arguments.'''
+    parser.add_argument(
+        '--metrics-out',
+        metavar='PATH',
+        help='Write the time spent in each stage and what it processed as JSON (- for stderr)'
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='DIR',
+        help='Run each stage under cProfile and write its stats to DIR/<stage>.prof'
+    )
+
+
+def from_args(args: argparse.Namespace) -> Metrics:
+    return Metrics(profile_dir=args.profile)
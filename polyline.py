@@ -0,0 +1,82 @@
+'''
+polyline.py encodes and decodes Google's encoded polyline format
+(https://developers.google.com/maps/documentation/utilities/polylinealgorithm)
+in a single pass, writing decoded coordinates straight into a flat
+array('d') of alternating latitudes and longitudes.
+'''
+from array import array
+from typing import Iterable, List, Sequence, Tuple
+
+Coord = Tuple[float, float]
+
+
+def decode(point_str: str, skip_repeats=False) -> array:
+    '''Decodes `point_str` into an array('d') of alternating latitude and
+    longitude values. With `skip_repeats`, points identical to the previous
+    point are left out.'''
+    data = point_str.encode('ascii')
+    # Every value takes at least one character, so this is always enough room
+    out = array('d', bytes(8 * len(data)))
+    n = 0
+    lat = lng = 0
+    value = shift = 0
+    have_lat = False
+    for char in data:
+        chunk = char - 63
+        value |= (chunk & 0x1F) << shift
+        if chunk & 0x20:
+            shift += 5
+            continue
+        delta = ~(value >> 1) if value & 1 else value >> 1
+        value = shift = 0
+        if not have_lat:
+            dlat = delta
+            have_lat = True
+            continue
+        have_lat = False
+        if skip_repeats and dlat == 0 and delta == 0:
+            continue
+        lat += dlat
+        lng += delta
+        out[n] = lat / 100000.0
+        out[n + 1] = lng / 100000.0
+        n += 2
+    del out[n:]
+    return out
+
+
+def pairs(flat: Sequence[float]) -> List[Coord]:
+    '''Turns a flat sequence of alternating latitudes and longitudes into a
+    list of (latitude, longitude) tuples.'''
+    return list(zip(flat[0::2], flat[1::2]))
+
+
+def _encode_value(delta: int, chars: List[str]):
+    value = ~(delta << 1) if delta < 0 else delta << 1
+    while value >= 0x20:
+        chars.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chars.append(chr(value + 63))
+
+
+def encode_flat(flat: Sequence[float]) -> str:
+    '''Encodes a flat sequence of alternating latitudes and longitudes, such
+    as the output of decode().'''
+    chars: List[str] = list()
+    prev_lat = prev_lng = 0
+    for idx in range(0, len(flat) - 1, 2):
+        lat = int(round(flat[idx] * 100000))
+        lng = int(round(flat[idx + 1] * 100000))
+        _encode_value(lat - prev_lat, chars)
+        _encode_value(lng - prev_lng, chars)
+        prev_lat, prev_lng = lat, lng
+    return ''.join(chars)
+
+
+def encode(points: Iterable[Coord]) -> str:
+    '''Encodes (latitude, longitude) points; the inverse of pairs(decode()).'''
+    flat = array('d')
+    for lat, lng in points:
+        flat.append(lat)
+        flat.append(lng)
+    return encode_flat(flat)
@@ -0,0 +1,111 @@
+'''
+simplify.py thins out tracks before they're drawn, dropping points which
+wouldn't visibly change the line at the zoom level a map is rendered at.
+'''
+from typing import List, Sequence
+
+import geodesy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Below this many points, scanning a span in pure Python beats NumPy's
+# per-call overhead
+NUMPY_MIN_SPAN = 64
+
+
+def _farthest(xs, ys, first, last, x1, y1, dx, dy, seg_sq):
+    '''Returns (squared distance, index) of the point between `first` and
+    `last` farthest from the segment joining them.'''
+    worst, worst_idx = -1.0, first
+    for idx in range(first + 1, last):
+        px, py = xs[idx] - x1, ys[idx] - y1
+        if seg_sq == 0:
+            dist_sq = px * px + py * py
+        else:
+            # Distance to the segment, not the infinite line, so that points
+            # beyond an endpoint (e.g. an out-and-back) are kept
+            t = max(0.0, min(1.0, (px * dx + py * dy) / seg_sq))
+            ex, ey = px - t * dx, py - t * dy
+            dist_sq = ex * ex + ey * ey
+        if dist_sq > worst:
+            worst, worst_idx = dist_sq, idx
+    return worst, worst_idx
+
+
+def _farthest_numpy(xarr, yarr, first, last, x1, y1, dx, dy, seg_sq):
+    px = xarr[first + 1:last] - x1
+    py = yarr[first + 1:last] - y1
+    if seg_sq == 0:
+        dist_sq = px * px + py * py
+    else:
+        t = np.clip((px * dx + py * dy) / seg_sq, 0.0, 1.0)
+        ex, ey = px - t * dx, py - t * dy
+        dist_sq = ex * ex + ey * ey
+    idx = int(np.argmax(dist_sq))
+    return float(dist_sq[idx]), first + 1 + idx
+
+
+def douglas_peucker(xs: Sequence[float], ys: Sequence[float], tolerance: float) -> List[int]:
+    '''Returns the sorted indices of the points kept by Douglas-Peucker
+    simplification of the polyline (xs, ys): every dropped point is within
+    `tolerance` of the simplified line. Iterative, so long tracks can't
+    exhaust the recursion limit.'''
+    n = len(xs)
+    if n <= 2:
+        return list(range(n))
+    if np is not None:
+        xarr = np.asarray(xs, dtype=float)
+        yarr = np.asarray(ys, dtype=float)
+        # Plain lists are faster than arrays for the short spans scanned in
+        # pure Python
+        xs, ys = xarr.tolist(), yarr.tolist()
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    tol_sq = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        x1, y1 = xs[first], ys[first]
+        dx, dy = xs[last] - x1, ys[last] - y1
+        seg_sq = dx * dx + dy * dy
+        if np is not None and last - first > NUMPY_MIN_SPAN:
+            worst, worst_idx = _farthest_numpy(xarr, yarr, first, last, x1, y1, dx, dy, seg_sq)
+        else:
+            worst, worst_idx = _farthest(xs, ys, first, last, x1, y1, dx, dy, seg_sq)
+        if worst > tol_sq:
+            keep[worst_idx] = True
+            stack.append((first, worst_idx))
+            stack.append((worst_idx, last))
+    return [idx for idx in range(n) if keep[idx]]
+
+
+def simplify_indices(
+    lats: Sequence[float],
+    lngs: Sequence[float],
+    zoom: int,
+    tolerance_px=0.5,
+    tile_size=256,
+) -> List[int]:
+    '''Returns the indices of the points to draw for a track rendered at
+    `zoom`, dropping points within `tolerance_px` pixels of the simplified
+    line. The northern-, southern-, eastern- and westernmost points are
+    always kept so the track's extent, and with it the map's zoom and center,
+    are unchanged.'''
+    if len(lats) <= 2 or tolerance_px <= 0:
+        return list(range(len(lats)))
+    xs = geodesy.lon_to_x(lngs, zoom)
+    ys = geodesy.lat_to_y(lats, zoom)
+    if np is not None:
+        xs, ys = xs * tile_size, ys * tile_size
+    else:
+        xs, ys = [x * tile_size for x in xs], [y * tile_size for y in ys]
+    kept = set(douglas_peucker(xs, ys, tolerance_px))
+    for values in (lats, lngs):
+        kept.add(min(range(len(values)), key=values.__getitem__))
+        kept.add(max(range(len(values)), key=values.__getitem__))
+    return sorted(kept)
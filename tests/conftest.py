@@ -0,0 +1,12 @@
+'''
+The modules under test are flat scripts in the repository root, and some
+tests reuse the stand-ins and reference implementations in benchmarks/, so
+both are put on the import path, as the benchmarks do for themselves.
+'''
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, ROOT)
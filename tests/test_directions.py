@@ -0,0 +1,156 @@
+'''
+Runs RouteFetcher against the stand-in directions server in
+benchmarks/directions_server.py, checking how many requests it makes when
+batching, retrying and rate limiting, and that every way of fetching gives
+the same decoded track.
+'''
+import random
+import time
+
+import pytest
+
+import directions_server
+from directions import DirectionsCache, DirectionsCacheMiss, RouteFetcher
+
+googlemaps = pytest.importorskip('googlemaps')
+
+POINTS_PER_LEG = 50
+
+
+def make_legs(n, seed=0, gaps=False):
+    '''Returns `n` legs of a random walk, each starting where the last one
+    ended unless `gaps` is set.'''
+    rnd = random.Random(seed)
+    lat, lng = 48.7, -119.4
+    stops = list()
+    for _ in range(n + 1):
+        lat += rnd.uniform(-0.02, 0.02)
+        lng += rnd.uniform(-0.02, 0.02)
+        stops.append((round(lat, 5), round(lng, 5)))
+    legs = list(zip(stops, stops[1:]))
+    if gaps:
+        legs = legs[::2]
+    return legs
+
+
+def expected_track(legs):
+    return [directions_server.straight_route(*leg, POINTS_PER_LEG) for leg in legs]
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = directions_server.start_server(points_per_leg=POINTS_PER_LEG)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client(server):
+    server.RequestHandlerClass.requests = 0
+    return googlemaps.Client(
+        key='AIza-test', base_url=directions_server.server_url(server), queries_per_second=1000
+    )
+
+
+class FlakyClient:
+    '''Fails the first `failures` requests with `error`, then answers like
+    the stand-in server.'''
+    def __init__(self, failures, error):
+        self.failures = failures
+        self.error = error
+        self.client = directions_server.StraightDirectionsClient(POINTS_PER_LEG)
+
+    def directions(self, *args, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise self.error
+        return self.client.directions(*args, **kwargs)
+
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_one_request_per_leg(server, client, workers):
+    legs = make_legs(40)
+    fetcher = RouteFetcher(client, None, workers=workers, rate=None)
+    assert fetcher.fetch_legs(legs) == expected_track(legs)
+    assert fetcher.requests == len(legs)
+    assert server.RequestHandlerClass.requests == len(legs)
+
+
+@pytest.mark.parametrize('gaps', [False, True])
+def test_batching(server, client, gaps):
+    legs = make_legs(40, gaps=gaps)
+    fetcher = RouteFetcher(client, None, workers=4, rate=None, max_waypoints=9)
+    assert fetcher.fetch_legs(legs) == expected_track(legs)
+    # Contiguous legs fit ten to a request; with gaps, every leg but the
+    # first of a request needs a second waypoint for the gap before it
+    batches = fetcher._batches(list(range(len(legs))), legs, None)
+    assert [len(batch) for batch in batches][:-1] == [5 if gaps else 10] * (len(batches) - 1)
+    assert fetcher.requests == server.RequestHandlerClass.requests == len(batches)
+
+
+def test_batch_keys_split_batches(server, client):
+    legs = make_legs(20)
+    keys = [idx // 7 for idx in range(len(legs))]
+    fetcher = RouteFetcher(client, None, workers=4, rate=None, max_waypoints=24)
+    assert fetcher.fetch_legs(legs, batch_keys=keys) == expected_track(legs)
+    assert fetcher.requests == server.RequestHandlerClass.requests == 3
+
+
+def test_retries_transient_errors():
+    legs = make_legs(5)
+    client = FlakyClient(2, googlemaps.exceptions.TransportError('connection reset'))
+    fetcher = RouteFetcher(client, None, workers=1, rate=None, retries=3, backoff=0)
+    assert fetcher.fetch_legs(legs) == expected_track(legs)
+    assert fetcher.requests == len(legs) + 2
+    assert client.client.requests == len(legs)
+
+
+def test_gives_up_after_retries():
+    client = FlakyClient(10, googlemaps.exceptions.TransportError('connection reset'))
+    fetcher = RouteFetcher(client, None, workers=1, rate=None, retries=2, backoff=0)
+    with pytest.raises(googlemaps.exceptions.TransportError):
+        fetcher.fetch_legs(make_legs(1))
+    assert fetcher.requests == 3
+
+
+def test_permanent_errors_are_not_retried():
+    client = FlakyClient(1, googlemaps.exceptions.ApiError('NOT_FOUND'))
+    fetcher = RouteFetcher(client, None, workers=1, rate=None, retries=3, backoff=0)
+    with pytest.raises(googlemaps.exceptions.ApiError):
+        fetcher.fetch_legs(make_legs(1))
+    assert fetcher.requests == 1
+
+
+def test_refused_batch_falls_back_to_single_legs():
+    legs = make_legs(6)
+    client = FlakyClient(1, googlemaps.exceptions.ApiError('INVALID_REQUEST'))
+    fetcher = RouteFetcher(client, None, workers=1, rate=None, backoff=0, max_waypoints=24)
+    assert fetcher.fetch_legs(legs) == expected_track(legs)
+    assert fetcher.requests == 1 + len(legs)
+
+
+def test_rate_limit(server, client):
+    legs = make_legs(11)
+    rate = 40
+    fetcher = RouteFetcher(client, None, workers=8, rate=rate)
+    start = time.monotonic()
+    assert fetcher.fetch_legs(legs) == expected_track(legs)
+    # The first request starts straight away and each later one waits its turn
+    assert time.monotonic() - start >= (len(legs) - 1) / rate
+    assert server.RequestHandlerClass.requests == len(legs)
+
+
+def test_cache(server, client, tmp_path):
+    legs = make_legs(10)
+    cache = DirectionsCache(str(tmp_path / 'directions.sqlite'))
+    fetcher = RouteFetcher(client, cache, workers=4, rate=None)
+    assert fetcher.fetch_legs(legs[:6]) == expected_track(legs[:6])
+    assert fetcher.fetch_legs(legs) == expected_track(legs)
+    assert server.RequestHandlerClass.requests == len(legs)
+    assert (cache.hits, cache.misses) == (6, 10)
+
+    offline = RouteFetcher(None, cache, offline=True)
+    assert offline.fetch_legs(legs) == expected_track(legs)
+    with pytest.raises(DirectionsCacheMiss):
+        offline.fetch_legs(make_legs(1, seed=1))
+    cache.close()
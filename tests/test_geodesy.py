@@ -0,0 +1,92 @@
+'''
+Checks geodesy.py's array functions, both with NumPy and with the pure
+Python fallback, against the scalar functions create_maps.py used to have
+(kept in benchmarks/bench_geodesy.py).
+'''
+import math
+
+import pytest
+
+import bench_geodesy
+import geodesy
+
+ZOOM = 12
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        if geodesy.np is None:
+            pytest.skip('NumPy is not installed')
+    else:
+        monkeypatch.setattr(geodesy, 'np', None)
+    return request.param
+
+
+@pytest.fixture
+def track():
+    lats, lngs = bench_geodesy.make_track(2000)
+    # Points past the antimeridian and the poles, which wrap around
+    return lats + [10.0, -95.0, 95.0], lngs + [185.0, -190.0, 0.0]
+
+
+def test_consecutive_distances(backend, track):
+    lats, lngs = track
+    distances = geodesy.consecutive_distances(lats, lngs)
+    assert len(distances) == len(lats) - 1
+    for idx in range(len(lats) - 1):
+        expected = bench_geodesy.distance_on_unit_sphere(
+            lats[idx], lngs[idx], lats[idx + 1], lngs[idx + 1]
+        )
+        # The scalar version uses the spherical law of cosines, whose acos()
+        # loses precision for short distances (around 0.1 m of noise), so
+        # distances are compared absolutely
+        assert abs(distances[idx] - expected) < 0.5
+
+
+def test_distances_from(backend, track):
+    lats, lngs = track
+    distances = geodesy.distances_from(lats[0], lngs[0], lats, lngs)
+    for idx in range(len(lats)):
+        expected = bench_geodesy.distance_on_unit_sphere(lats[0], lngs[0], lats[idx], lngs[idx])
+        assert abs(distances[idx] - expected) < 0.5
+
+
+def test_projection(backend, track):
+    lats, lngs = track
+    xs = geodesy.lon_to_x(lngs, ZOOM)
+    ys = geodesy.lat_to_y(lats, ZOOM)
+    for idx in range(len(lats)):
+        assert math.isclose(xs[idx], bench_geodesy.lon_to_x(lngs[idx], ZOOM), rel_tol=1e-12)
+        assert math.isclose(ys[idx], bench_geodesy.lat_to_y(lats[idx], ZOOM), rel_tol=1e-12)
+
+
+def test_tile_to_px(backend, track):
+    lats, lngs = track
+    xs = [bench_geodesy.lon_to_x(lng, ZOOM) for lng in lngs]
+    ys = [bench_geodesy.lat_to_y(lat, ZOOM) for lat in lats]
+
+    class Canvas:
+        x_center, y_center = xs[0], ys[0]
+        tile_size, width, height = 256, 1000, 800
+
+    pxs = geodesy.tile_to_px(xs, Canvas.x_center, Canvas.tile_size, Canvas.width)
+    pys = geodesy.tile_to_px(ys, Canvas.y_center, Canvas.tile_size, Canvas.height)
+    for idx in range(len(lats)):
+        assert pxs[idx] == bench_geodesy.x_to_px(Canvas, xs[idx])
+        assert pys[idx] == bench_geodesy.y_to_px(Canvas, ys[idx])
+
+
+def test_bounding_box(backend, track):
+    lats, lngs = track
+    assert geodesy.bounding_box(lats, lngs) == (min(lats), min(lngs), max(lats), max(lngs))
+
+
+def test_legs_longer_than(backend, track):
+    lats, lngs = track
+    expected = [
+        idx for idx in range(len(lats) - 1) if bench_geodesy.distance_on_unit_sphere(
+            lats[idx], lngs[idx], lats[idx + 1], lngs[idx + 1]
+        ) > 1000
+    ]
+    assert geodesy.legs_longer_than(lats, lngs, 1000) == expected
@@ -0,0 +1,67 @@
+'''
+Round-trip tests for polyline.py's encoder and decoder, and checks that
+directions.decode_polyline still matches the original implementation (kept in
+benchmarks/bench_polyline.py).
+'''
+import random
+
+import pytest
+
+import bench_polyline
+import directions
+import polyline
+
+# The example from Google's description of the format
+GOOGLE_EXAMPLE = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+GOOGLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def round_trip(points):
+    encoded = polyline.encode(points)
+    assert polyline.pairs(polyline.decode(encoded)) == points
+    assert polyline.encode_flat(polyline.decode(encoded)) == encoded
+    assert directions.decode_polyline(encoded) == bench_polyline.decode_polyline(encoded)
+    return encoded
+
+
+def test_google_example():
+    assert polyline.encode(GOOGLE_POINTS) == GOOGLE_EXAMPLE
+    assert polyline.pairs(polyline.decode(GOOGLE_EXAMPLE)) == GOOGLE_POINTS
+
+
+def test_empty():
+    assert round_trip([]) == ''
+    assert len(polyline.decode('')) == 0
+    assert directions.decode_polyline('') == []
+
+
+@pytest.mark.parametrize('points', [
+    [(-33.86882, -151.20929)],
+    [(-0.00001, -0.00001), (0.00001, 0.00001), (-0.00001, 0.0)],
+    [(-89.99999, -179.99999), (-45.5, -90.25)],
+])
+def test_negative_values(points):
+    round_trip(points)
+
+
+@pytest.mark.parametrize('points', [
+    # From pole to pole and across the whole range of longitudes
+    [(-90.0, -180.0), (90.0, 180.0), (-90.0, -180.0)],
+    [(0.0, 0.0), (89.99999, 179.99999), (0.0, 0.0)],
+    [(48.7, -119.4), (-48.7, 119.4)],
+])
+def test_large_deltas(points):
+    round_trip(points)
+
+
+def test_skip_repeats():
+    points = [(48.7, -119.4), (48.7, -119.4), (48.70001, -119.4), (48.70001, -119.4)]
+    encoded = polyline.encode(points)
+    assert polyline.pairs(polyline.decode(encoded)) == points
+    assert polyline.pairs(polyline.decode(encoded, skip_repeats=True)) == [points[0], points[2]]
+
+
+def test_random_routes():
+    rnd = random.Random(0)
+    for _ in range(2000):
+        round_trip(bench_polyline.random_route(rnd.randint(0, 200), rnd))
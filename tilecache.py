@@ -0,0 +1,126 @@
+'''
+tilecache.py keeps downloaded map tiles on disk, so the many maps rendered
+for a trip (and every later re-render) only download each tile once.
+'''
+import threading
+import hashlib
+import tempfile
+import os
+
+from typing import Optional
+
+import staticmap
+
+
+class TileCache:
+    '''An on-disk tile store shared by any number of processes. Each tile is
+    a file named by the SHA-256 of its URL (which encodes the URL template,
+    z, x and y). File mtimes serve as the LRU clock: hits touch the file, and
+    `evict()` deletes the least recently used tiles until the cache is no
+    bigger than `max_bytes`. Writes go through a temporary file and an atomic
+    rename, so readers never see a partial tile.'''
+    def __init__(self, directory, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # staticmap fetches tiles from several threads at once
+        self.counters_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:] + '.tile')
+
+    def get(self, url) -> Optional[bytes]:
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Missing, or evicted by another process since we looked
+            with self.counters_lock:
+                self.misses += 1
+            return None
+        with self.counters_lock:
+            self.hits += 1
+        return content
+
+    def put(self, url, content: bytes):
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmppath, path)
+
+    def evict(self) -> int:
+        '''Deletes least recently used tiles until the cache fits in
+        `max_bytes`. Returns the number of tiles deleted.'''
+        if self.max_bytes is None:
+            return 0
+        tiles = list()
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for fn in filenames:
+                if not fn.endswith('.tile'):
+                    continue
+                path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                tiles.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        deleted = 0
+        for _, size, path in sorted(tiles):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted += 1
+        return deleted
+
+
+class CachedStaticMap(staticmap.StaticMap):
+    '''A StaticMap which fetches its tiles through a TileCache. Given a
+    metrics.Metrics, it also times fetching the tiles ('tile_fetch') apart
+    from drawing the lines and markers over them ('draw').'''
+    def __init__(self, *args, tile_cache: Optional[TileCache] = None, meter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tile_cache = tile_cache
+        self.meter = meter
+
+    def _draw_base_layer(self, image):
+        if self.meter is None:
+            return super()._draw_base_layer(image)
+        with self.meter.stage('tile_fetch'):
+            super()._draw_base_layer(image)
+
+    def _draw_features(self, image):
+        if self.meter is None:
+            return super()._draw_features(image)
+        with self.meter.stage('draw'):
+            super()._draw_features(image)
+
+    def get(self, url, **kwargs):
+        status, content = self._get(url, **kwargs)
+        if self.meter is not None:
+            self.meter.add('tile_fetch', 'items')
+            self.meter.add('tile_fetch', 'bytes_read', len(content or b''))
+        return status, content
+
+    def _get(self, url, **kwargs):
+        if self.tile_cache is None:
+            return super().get(url, **kwargs)
+        content = self.tile_cache.get(url)
+        if content is not None:
+            return 200, content
+        status, content = super().get(url, **kwargs)
+        if status == 200:
+            self.tile_cache.put(url, content)
+        return status, content
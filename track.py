@@ -0,0 +1,168 @@
+'''
+track.py holds GPS tracks as three parallel columns of doubles (latitude,
+longitude and epoch seconds) instead of one Python object per point, which
+keeps even a multi-million point interpolated track to 24 bytes per point.
+TimeLocation is kept as a lightweight view of a single point.
+'''
+import datetime
+import bisect
+
+from array import array
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+
+class TimeLocation:
+    __slots__ = ('lat', 'lng', 'moment')
+
+    def __init__(self, lat=None, lng=None, moment=None):
+        '''TimeLocation is both a time and place.'''
+        # lat/lng are latitude longitude expressed in Decimal Degrees (DD)
+        self.lat = lat
+        self.lng = lng
+        # moment is epoch timestamp in seconds
+        self.moment: int = moment
+
+    @staticmethod
+    def fromrow(d):
+        lat = d['latitude']
+        lng = d['longitude']
+        moment = d['timestamp_utc']
+        return TimeLocation(lat, lng, moment)
+
+    def latlngpoint(self):
+        return [self.lat, self.lng]
+
+    def dt(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.moment)
+
+
+def _column(values=()) -> array:
+    col = array('d')
+    _extend_column(col, values)
+    return col
+
+
+def _extend_column(col: array, values):
+    if isinstance(values, memoryview):
+        # Copies the raw doubles, rather than boxing each one as a float
+        col.frombytes(values.cast('B'))
+    else:
+        col.extend(values)
+
+
+def next_midnight(moment: float, tz: Optional[datetime.tzinfo] = None) -> float:
+    '''Returns the epoch timestamp of the first midnight after `moment`, in
+    timezone `tz` or else local time.'''
+    day = datetime.datetime.fromtimestamp(moment, tz).date() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, datetime.time(), tzinfo=tz).timestamp()
+
+
+class TrackArray:
+    '''A track of points in time order, stored as `lat`, `lng` and `moment`
+    columns. The columns are array('d') for a track being built with
+    `append`, and zero-copy memoryviews for the views returned by slicing,
+    `take_range` and `days`. Views keep their parent's arrays alive and
+    fixed in size, so build a track completely before viewing it.'''
+    __slots__ = ('lat', 'lng', 'moment')
+
+    def __init__(self, lat=(), lng=(), moment=()):
+        self.lat: Union[array, memoryview] = lat if isinstance(lat, (array, memoryview)) else _column(lat)
+        self.lng: Union[array, memoryview] = lng if isinstance(lng, (array, memoryview)) else _column(lng)
+        self.moment: Union[array, memoryview] = \
+            moment if isinstance(moment, (array, memoryview)) else _column(moment)
+
+    @staticmethod
+    def zeros(n: int) -> 'TrackArray':
+        '''Returns a track of `n` zeroed points, to be filled in place.'''
+        return TrackArray(*(array('d', bytes(8 * n)) for _ in range(3)))
+
+    @staticmethod
+    def from_rows(rows: Iterable[dict]) -> 'TrackArray':
+        track = TrackArray()
+        for row in rows:
+            track.append(row['latitude'], row['longitude'], row['timestamp_utc'])
+        return track
+
+    @staticmethod
+    def from_tlocs(tlocs: Iterable[TimeLocation]) -> 'TrackArray':
+        track = TrackArray()
+        for tloc in tlocs:
+            track.append(tloc.lat, tloc.lng, tloc.moment)
+        return track
+
+    @staticmethod
+    def concat(tracks: Sequence['TrackArray']) -> 'TrackArray':
+        track = TrackArray()
+        for other in tracks:
+            track.extend(other)
+        return track
+
+    def append(self, lat: float, lng: float, moment: float):
+        self.lat.append(lat)
+        self.lng.append(lng)
+        self.moment.append(moment)
+
+    def extend(self, other: 'TrackArray'):
+        _extend_column(self.lat, other.lat)
+        _extend_column(self.lng, other.lng)
+        _extend_column(self.moment, other.moment)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, key) -> Union[TimeLocation, 'TrackArray']:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.take(range(start, stop, step))
+            return self.take_range(start, stop)
+        return TimeLocation(self.lat[key], self.lng[key], self.moment[key])
+
+    def __iter__(self) -> Iterator[TimeLocation]:
+        for lat, lng, moment in zip(self.lat, self.lng, self.moment):
+            yield TimeLocation(lat, lng, moment)
+
+    def __reduce__(self):
+        # memoryviews can't be pickled, so views are sent as copies of just
+        # their own points
+        return (TrackArray, (_column(self.lat), _column(self.lng), _column(self.moment)))
+
+    def take_range(self, start: int, stop: int) -> 'TrackArray':
+        '''Returns a zero-copy view of points `start` to `stop`.'''
+        return TrackArray(
+            memoryview(self.lat)[start:stop],
+            memoryview(self.lng)[start:stop],
+            memoryview(self.moment)[start:stop],
+        )
+
+    def take(self, indices: Iterable[int]) -> 'TrackArray':
+        '''Returns a new track of the points at `indices`.'''
+        track = TrackArray()
+        for idx in indices:
+            track.append(self.lat[idx], self.lng[idx], self.moment[idx])
+        return track
+
+    def points(self) -> Iterator[Tuple[float, float]]:
+        '''Iterates over (lat, lng) pairs.'''
+        return zip(self.lat, self.lng)
+
+    def day_ranges(self, tz: Optional[datetime.tzinfo] = None) -> List[Tuple[datetime.date, int, int]]:
+        '''Returns (date, start, stop) for each run of points on the same day,
+        in timezone `tz` or else local time. Since the track is in time order,
+        the end of each run is found by bisecting for the next midnight, not
+        by checking every point.'''
+        ranges = list()
+        start = 0
+        while start < len(self):
+            moment = self.moment[start]
+            day = datetime.datetime.fromtimestamp(moment, tz).date()
+            stop = bisect.bisect_left(self.moment, next_midnight(moment, tz), start + 1)
+            ranges.append((day, start, stop))
+            start = stop
+        return ranges
+
+    def days(self, tz: Optional[datetime.tzinfo] = None) -> Iterator[Tuple[datetime.date, 'TrackArray']]:
+        '''Iterates over (date, view) for each day of the track; see
+        `day_ranges`.'''
+        for day, start, stop in self.day_ranges(tz):
+            yield day, self.take_range(start, stop)